@@ -1,20 +1,19 @@
 
 import frappe
-from line_integration.line_integration.api.line_webhook import normalize_key, fetch_menu_items
+from line_integration.api.line_webhook import normalize_key
+from line_integration.utils import menu_catalog
 
 def check_items():
-    print("--- Fetching Menu Items ---")
-    items = fetch_menu_items(limit=1000)
-    print(f"Found {len(items)} items.")
-    
-    item_map = {normalize_key(item.item_name or item.name): item for item in items}
-    
+    print("--- Loading Menu Catalog ---")
+    item_map = menu_catalog.get_item_map()
+    matcher = menu_catalog.get_matcher()
+    print(f"Found {len(menu_catalog.get_menu_items())} items, {len(item_map)} names/aliases.")
+
     # Debug: print first 10 keys
     print("Sample keys in map:", list(item_map.keys())[:10])
 
     # The user's specific inputs from the screenshot/message
-    # Assuming the "1", "2" are part of the name or user added them?
-    # Let's test both hypotheses.
+    # (numbered prefixes are resolved by aliases or the fuzzy matcher)
     test_inputs = [
         "1 Bye Heavy",
         "2 Green Hug",
@@ -26,23 +25,13 @@ def check_items():
     for raw_name in test_inputs:
         key = normalize_key(raw_name)
         print(f"Searching for '{raw_name}' (key='{key}')...")
-        
-        # Direct match
-        match = item_map.get(key)
+
+        match = matcher.match(key)
         if match:
-             print(f"  [DIRECT MATCH] -> Item: {match.item_name} ({match.name})")
-             continue
-             
-        # Fuzzy match
-        found = False
-        for k, candidate in item_map.items():
-            if key in k or k in key:
-                print(f"  [FUZZY MATCH] '{key}' <-> '{k}' -> Item: {candidate.item_name} ({candidate.name})")
-                found = True
-                break
-        
-        if not found:
-            print(f"  [NO MATCH FOUND]")
+            kind = "DIRECT MATCH" if match.score == 1.0 else "FUZZY MATCH"
+            print(f"  [{kind}] '{key}' <-> '{match.key}' ({match.score}) -> Item: {match.item.item_name} ({match.item.name})")
+        else:
+            print(f"  [NO MATCH FOUND] closest: {matcher.candidates(key, limit=3)}")
 
 if __name__ == "__main__":
     frappe.connect()
@@ -29,6 +29,8 @@ axios.interceptors.request.use(config => {
 let user = null;
 let cart = [];
 let menuItems = [];
+// First history page delivered by liff_bootstrap, used once by the profile page
+let bootstrapHistory = null;
 
 // DOM Elements
 const loadingEl = document.getElementById('loading');
@@ -39,6 +41,17 @@ const userImgEl = document.getElementById('user-img');
 const userNameEl = document.getElementById('user-name');
 const userPointsEl = document.getElementById('user-points');
 
+/**
+ * Credentials sent with every API call. The ID token is verified locally by the
+ * backend; the access token is kept as a fallback once the ID token expires.
+ */
+function authPayload() {
+  return {
+    access_token: liff.getAccessToken(),
+    id_token: liff.getIDToken()
+  };
+}
+
 /**
  * Initialize LIFF
  */
@@ -72,7 +85,8 @@ async function init() {
 }
 
 /**
- * Authenticate with Frappe Backend
+ * Authenticate with Frappe Backend. One `liff_bootstrap` call returns the profile,
+ * points, the menu (stored as the local menu cache) and the first history page.
  */
 async function authenticate(token) {
   if (!token) {
@@ -80,16 +94,22 @@ async function authenticate(token) {
     return;
   }
   try {
-    const response = await axios.post(`${API_BASE}.liff_auth`, {
-      access_token: token
+    const response = await axios.post(`${API_BASE}.liff_bootstrap`, {
+      access_token: token,
+      id_token: liff.getIDToken()
     });
     
-    const res = response.data.message;
+    const data = response.data.message || {};
+    const res = data.auth;
     if (res && res.success) {
       user = res;
       // console.log('Authenticated User:', user);
       updateUIProfile();
-      fetchPoints(); 
+      if (data.points) userPointsEl.textContent = data.points.points || 0;
+      if (data.menu && data.menu.complete && data.menu.etag) {
+        writeMenuCache(data.menu.etag, data.menu.items);
+      }
+      bootstrapHistory = data.history || null;
     } else {
       console.error('Auth API Error:', res?.error);
       // alert('ไม่สามารถยืนยันตัวตนได้: ' + (res?.error || 'Unknown error')); // Silent fail or show modal if critical
@@ -112,19 +132,6 @@ function updateUIProfile() {
   navEl.classList.remove('hidden');
 }
 
-async function fetchPoints() {
-  if (!user || !user.is_registered) return;
-  try {
-    const response = await axios.post(`${API_BASE}.liff_get_points`, {
-      access_token: liff.getAccessToken()
-    });
-    const pointsData = response.data.message;
-    userPointsEl.textContent = pointsData.points || 0;
-  } catch (err) {
-    console.error('Fetch Points Error:', err);
-  }
-}
-
 /**
  * Navigation logic
  */
@@ -206,24 +213,159 @@ function renderHome() {
   `;
 }
 
+const MENU_CACHE_KEY = 'line_menu_cache';
+
+function readMenuCache() {
+  try {
+    return JSON.parse(localStorage.getItem(MENU_CACHE_KEY)) || null;
+  } catch (e) {
+    return null;
+  }
+}
+
+function writeMenuCache(etag, items) {
+  try {
+    localStorage.setItem(MENU_CACHE_KEY, JSON.stringify({ etag, items }));
+  } catch (e) {
+    // Storage full or disabled: the menu is simply refetched next time
+  }
+}
+
+const STATIC_MENU_CACHE_KEY = 'line_static_menu';
+const MENU_PRICES_CACHE_KEY = 'line_menu_prices';
+
+function readStored(key) {
+  try {
+    return JSON.parse(localStorage.getItem(key)) || null;
+  } catch (e) {
+    return null;
+  }
+}
+
+function writeStored(key, value) {
+  try {
+    localStorage.setItem(key, JSON.stringify(value));
+  } catch (e) {
+    // Storage full or disabled: the data is fetched again next time
+  }
+}
+
+/**
+ * Version and URL of the static menu. Registered customers get them from
+ * `liff_get_menu_prices` together with their prices, revalidated with If-None-Match so
+ * an unchanged menu costs one body-less 304; guests ask `liff_menu_version`.
+ */
+async function loadMenuInfo() {
+  if (!user || !user.customer_id) {
+    const response = await axios.get(`${API_BASE}.liff_menu_version`);
+    return { ...(response.data.message || {}), prices: {} };
+  }
+  const stored = readStored(MENU_PRICES_CACHE_KEY);
+  const headers = stored && stored.etag ? { 'If-None-Match': stored.etag } : {};
+  const response = await axios.get(`${API_BASE}.liff_get_menu_prices`, {
+    params: authPayload(),
+    headers,
+    validateStatus: status => (status >= 200 && status < 300) || status === 304
+  });
+  if (response.status === 304 && stored) return stored.info;
+  const info = response.data.message || {};
+  writeStored(MENU_PRICES_CACHE_KEY, { etag: response.headers['etag'], info });
+  return info;
+}
+
+/**
+ * Static menu published by the backend: get its current version, fetch the versioned
+ * JSON file straight from the web server when it is not stored yet, then overlay this
+ * customer's own prices. Returns null when no static menu is published.
+ */
+async function loadStaticMenu() {
+  const info = await loadMenuInfo();
+  if (!info.version || !info.url) return null;
+
+  let stored = readStored(STATIC_MENU_CACHE_KEY);
+  if (!stored || stored.version !== info.version) {
+    // Plain fetch: no API auth headers, so no CORS preflight for the static file
+    const fileResponse = await fetch(info.url);
+    if (!fileResponse.ok) throw new Error(`Static menu ${fileResponse.status}`);
+    const file = await fileResponse.json();
+    stored = { version: info.version, items: file.items };
+    writeStored(STATIC_MENU_CACHE_KEY, stored);
+  }
+
+  const prices = info.prices || {};
+  return stored.items.map(item => (prices[item.item_code] ? { ...item, ...prices[item.item_code] } : item));
+}
+
+/**
+ * Fetch the menu, preferring the static menu file. Otherwise the per-user endpoint is
+ * revalidated with If-None-Match; an unchanged menu comes back as a body-less 304.
+ */
+async function loadMenu(cached = readMenuCache()) {
+  try {
+    const items = await loadStaticMenu();
+    if (items) {
+      writeMenuCache(null, items);
+      return items;
+    }
+  } catch (err) {
+    console.warn('Static menu unavailable, using the menu API:', err);
+  }
+
+  const headers = cached && cached.etag ? { 'If-None-Match': cached.etag } : {};
+  const response = await axios.get(`${API_BASE}.liff_get_menu`, {
+      params: authPayload(),
+      headers,
+      validateStatus: status => (status >= 200 && status < 300) || status === 304
+  });
+  if (response.status === 304 && cached) {
+    return cached.items;
+  }
+  const items = response.data.message;
+  writeMenuCache(response.headers['etag'], items);
+  return items;
+}
+
 async function renderMenu() {
-  contentEl.innerHTML = '<div class="loader-container"><div class="loader"></div><p>กำลังโหลดเมนู...</p></div>';
+  const cached = readMenuCache();
+  if (cached && cached.items) {
+    // Show the stored menu right away; revalidation replaces it only if it changed
+    menuItems = cached.items;
+    renderMenuItems(menuItems);
+  } else {
+    contentEl.innerHTML = '<div class="loader-container"><div class="loader"></div><p>กำลังโหลดเมนู...</p></div>';
+  }
   
   try {
-    const response = await axios.get(`${API_BASE}.liff_get_menu`, {
-        params: { access_token: liff.getAccessToken() }
-    });
-    menuItems = response.data.message;
-    
+    const items = await loadMenu(cached);
+    if (!cached || JSON.stringify(items) !== JSON.stringify(cached.items)) {
+      menuItems = items;
+      renderMenuItems(menuItems);
+    }
+  } catch (err) {
+    console.error(err);
+    if (!cached) {
+      contentEl.innerHTML = '<p class="error">ไม่สามารถโหลดเมนูได้ กรุณาลองใหม่อีกครั้ง</p>';
+    }
+  }
+}
+
+function renderMenuItems(items) {
     let html = '<div class="menu-grid">';
-    menuItems.forEach(item => {
+    items.forEach(item => {
       const priceHtml = item.formatted_price 
         ? `<div class="price">${item.formatted_price}</div>` 
         : '';
         
+      const webpSource = item.image_webp_url
+        ? `<source srcset="${item.image_webp_url}" type="image/webp" />`
+        : '';
+        
       html += `
         <div class="item-card">
-          <img src="${item.image_url || 'https://via.placeholder.com/200'}" class="item-image" />
+          <picture>
+            ${webpSource}
+            <img src="${item.image_url || 'https://via.placeholder.com/200'}" class="item-image" loading="lazy" />
+          </picture>
           <div class="item-info">
             <div class="item-name">${item.item_name}</div>
             ${priceHtml}
@@ -241,10 +383,6 @@ async function renderMenu() {
     });
     html += '</div>';
     contentEl.innerHTML = html;
-  } catch (err) {
-    console.error(err);
-    contentEl.innerHTML = '<p class="error">ไม่สามารถโหลดเมนูได้ กรุณาลองใหม่อีกครั้ง</p>';
-  }
 }
 
 window.adjustMenuQty = (itemCode, delta) => {
@@ -281,6 +419,94 @@ window.addToCart = async (itemCode) => {
   if (qtyEl) qtyEl.textContent = '1';
 };
 
+const CART_SYNC_DEBOUNCE_MS = 400;
+let cartSyncTimer = null;
+let cartSyncController = null;
+let cartSyncWaiters = [];
+let serverCart = null;
+let serverCartKey = null;
+
+function formatTHB(value) {
+  return value.toLocaleString('th-TH', { style: 'currency', currency: 'THB' });
+}
+
+function cartKey() {
+  return JSON.stringify(cart.map(item => [item.item_code, item.qty]));
+}
+
+/**
+ * Optimistic total from cached prices: the last server price of each item if we have
+ * one, otherwise its menu price. The server total replaces it once the sync lands.
+ */
+function localCartTotal() {
+  const serverPrices = {};
+  (serverCart ? serverCart.items : []).forEach(item => { serverPrices[item.item_code] = item.price; });
+  return cart.reduce((sum, item) => {
+    const price = serverPrices[item.item_code] ?? item.price ?? 0;
+    return sum + price * item.qty;
+  }, 0);
+}
+
+/**
+ * Debounced server pricing. Rapid edits collapse into one request; a request still in
+ * flight when the cart changes again is aborted. Resolves with the server cart for the
+ * cart as it is when the request completes (or null on failure).
+ */
+function scheduleCartSync() {
+  return new Promise(resolve => {
+    cartSyncWaiters.push(resolve);
+    clearTimeout(cartSyncTimer);
+    cartSyncTimer = setTimeout(runCartSync, CART_SYNC_DEBOUNCE_MS);
+  });
+}
+
+async function runCartSync() {
+  const key = cartKey();
+  let result = null;
+  if (cart.length > 0 && key === serverCartKey) {
+    result = serverCart;
+  } else if (cart.length > 0) {
+    if (cartSyncController) cartSyncController.abort();
+    const controller = new AbortController();
+    cartSyncController = controller;
+    result = await calculateCartBackend(controller.signal);
+    if (controller.signal.aborted || key !== cartKey()) {
+      // A newer edit superseded this request; its own sync will settle the waiters
+      return;
+    }
+    cartSyncController = null;
+    if (result) {
+      serverCart = result;
+      serverCartKey = key;
+    }
+  }
+  const waiters = cartSyncWaiters;
+  cartSyncWaiters = [];
+  waiters.forEach(resolve => resolve(result));
+  applyServerCart(result);
+}
+
+function applyServerCart(result) {
+  if (!result) return;
+  const floatTotal = document.querySelector('#floating-cart-btn .float-total');
+  if (floatTotal) floatTotal.textContent = `ไปตะกร้า ${result.formatted_total} >`;
+
+  result.items.forEach((item, index) => {
+    const priceEl = document.getElementById(`cart-price-${index}`);
+    if (priceEl && item.formatted_price) priceEl.textContent = `${item.formatted_price}/ชิ้น`;
+  });
+  setOrderTotal(result.grand_total, result.formatted_total);
+}
+
+function setOrderTotal(total, formattedTotal) {
+  const totalEl = document.getElementById('cart-total');
+  if (totalEl) {
+    totalEl.innerHTML = total > 0 ? `<h3>ยอดรวม: ${formattedTotal}</h3>` : '';
+  }
+  const submitBtn = document.getElementById('submit-order-btn');
+  if (submitBtn && !submitBtn.disabled) submitBtn.textContent = `สั่งออเดอร์ (${formattedTotal})`;
+}
+
 async function updateFloatingCart() {
     let floatBtn = document.getElementById('floating-cart-btn');
     const totalQty = cart.reduce((sum, item) => sum + item.qty, 0);
@@ -298,46 +524,35 @@ async function updateFloatingCart() {
         document.body.appendChild(floatBtn);
     }
     
-    // Show current local total first or "..."
-    const localTotal = cart.reduce((sum, item) => sum + ((item.price || 0) * item.qty), 0);
-    const formattedLocal = localTotal.toLocaleString('th-TH', { style: 'currency', currency: 'THB' });
-    
+    // Show the optimistic local total right away
     floatBtn.innerHTML = `
         <div class="float-content">
             <div class="float-qty">${totalQty} รายการ</div>
-            <div class="float-total">ไปตะกร้า ${formattedLocal} ></div>
+            <div class="float-total">ไปตะกร้า ${formatTHB(localCartTotal())} ></div>
         </div>
     `;
     floatBtn.classList.remove('hidden');
 
-    // Sync with backend for accurate Pricing Rules
-    const serverCart = await calculateCartBackend();
-    if (serverCart && serverCart.formatted_total) {
-        floatBtn.innerHTML = `
-            <div class="float-content">
-                <div class="float-qty">${totalQty} รายการ</div>
-                <div class="float-total">ไปตะกร้า ${serverCart.formatted_total} ></div>
-            </div>
-        `;
-    }
+    // Sync with backend for accurate Pricing Rules (debounced)
+    await scheduleCartSync();
 }
 
-async function calculateCartBackend() {
+async function calculateCartBackend(signal) {
     if (cart.length === 0) return null;
     
     try {
         const response = await axios.post(`${API_BASE}.liff_calculate_cart`, {
-            access_token: liff.getAccessToken(),
-            items: cart
-        });
+            ...authPayload(),
+            items: cart.map(item => ({ item_code: item.item_code, item_name: item.item_name, qty: item.qty }))
+        }, { signal });
         return response.data.message;
     } catch (err) {
-        console.error('Calculation failed:', err);
+        if (!axios.isCancel(err)) console.error('Calculation failed:', err);
         return null;
     }
 }
 
-async function renderOrder() {
+function renderOrder() {
   if (cart.length === 0) {
     contentEl.innerHTML = `
       <div class="empty-state">
@@ -349,26 +564,18 @@ async function renderOrder() {
     return;
   }
 
-  // Show loading state while calculating
-  contentEl.innerHTML = `
-    <h2>ตะกร้าสินค้า</h2>
-    <div class="loader-container">
-        <div class="loader"></div>
-        <p>กำลังคำนวณราคา...</p>
-    </div>
-  `;
-
-  const serverCart = await calculateCartBackend();
-  
-  // Use server cart if available, otherwise fallback to local calculation
-  const itemsToRender = serverCart ? serverCart.items : cart;
-  const grandTotal = serverCart ? serverCart.grand_total : cart.reduce((sum, i) => sum + (i.price * i.qty), 0);
-  const formattedTotal = serverCart ? serverCart.formatted_total : grandTotal.toLocaleString('th-TH', { style: 'currency', currency: 'THB' });
+  // Render immediately from the local cart; server prices are filled in when they arrive
+  const synced = serverCart && serverCartKey === cartKey() ? serverCart : null;
+  const grandTotal = synced ? synced.grand_total : localCartTotal();
+  const formattedTotal = synced ? synced.formatted_total : formatTHB(grandTotal);
+  const previousNote = document.getElementById('note')?.value || '';
 
   let html = '<h2>ตะกร้าสินค้า</h2><div class="cart-items">';
   
-  itemsToRender.forEach((item, index) => {
-    const priceText = item.formatted_price ? `${item.formatted_price}/ชิ้น` : '';
+  cart.forEach((item, index) => {
+    const priced = synced ? synced.items[index] : null;
+    const formattedPrice = (priced || item).formatted_price;
+    const priceText = formattedPrice ? `${formattedPrice}/ชิ้น` : '';
     const imageUrl = item.image_url || 'https://via.placeholder.com/80';
     
     html += `
@@ -376,12 +583,12 @@ async function renderOrder() {
         <img src="${imageUrl}" class="cart-item-image" onerror="this.src='https://via.placeholder.com/80'" />
         <div class="cart-item-info">
           <div class="name">${item.item_name}</div>
-          <div class="price-detail">${priceText}</div>
+          <div class="price-detail" id="cart-price-${index}">${priceText}</div>
         </div>
         <div class="cart-item-actions">
           <div class="qty-selector">
               <button class="qty-btn" onclick="adjustCartQty(${index}, -1)">-</button>
-              <span class="qty-display">${item.qty}</span>
+              <span class="qty-display" id="cart-qty-${index}">${item.qty}</span>
               <button class="qty-btn" onclick="adjustCartQty(${index}, 1)">+</button>
           </div>
           <button class="remove-btn" onclick="removeFromCart(${index})">
@@ -392,9 +599,7 @@ async function renderOrder() {
     `;
   });
   
-  if (grandTotal > 0) {
-      html += `<div class="cart-total"><h3>ยอดรวม: ${formattedTotal}</h3></div>`;
-  }
+  html += `<div class="cart-total" id="cart-total">${grandTotal > 0 ? `<h3>ยอดรวม: ${formattedTotal}</h3>` : ''}</div>`;
   
   html += `</div>
     <div class="order-note">
@@ -403,15 +608,20 @@ async function renderOrder() {
     <button class="btn btn-primary" id="submit-order-btn">สั่งออเดอร์ (${formattedTotal})</button>
   `;
   contentEl.innerHTML = html;
+  document.getElementById('note').value = previousNote;
   
   document.getElementById('submit-order-btn').onclick = submitOrder;
+  // Also schedules the (debounced) server sync
   updateCartBadge();
 }
 
 window.adjustCartQty = (index, delta) => {
     cart[index].qty += delta;
     if (cart[index].qty < 1) cart[index].qty = 1;
-    renderOrder();
+    // Update in place: optimistic total now, server total after the debounce
+    const qtyEl = document.getElementById(`cart-qty-${index}`);
+    if (qtyEl) qtyEl.textContent = cart[index].qty;
+    setOrderTotal(localCartTotal(), formatTHB(localCartTotal()));
     updateCartBadge();
 };
 
@@ -421,6 +631,34 @@ window.removeFromCart = (index) => {
   updateCartBadge();
 };
 
+const ORDER_POLL_INTERVAL_MS = 1500;
+const ORDER_POLL_TIMEOUT_MS = 120000;
+// Idempotency key of the cart being submitted, reused for retries of the same cart
+let submission = null;
+
+function newIdempotencyKey() {
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+/**
+ * Poll an async order submission until the worker has created (or failed) the order.
+ */
+async function waitForOrder(jobId) {
+  const deadline = Date.now() + ORDER_POLL_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    await new Promise(resolve => setTimeout(resolve, ORDER_POLL_INTERVAL_MS));
+    const response = await axios.post(`${API_BASE}.liff_get_order_status`, {
+      ...authPayload(),
+      job_id: jobId
+    });
+    const status = response.data.message;
+    if (!status.pending) return status;
+  }
+  // Still queued: the LINE confirmation message will follow once it is created
+  return { success: false, error: 'ออเดอร์กำลังดำเนินการ จะแจ้งยืนยันทาง LINE เมื่อเสร็จค่ะ' };
+}
+
 async function submitOrder() {
   if (!user || !user.is_registered) {
     showModal('แจ้งเตือน', 'กรุณาสมัครสมาชิกก่อนสั่งออเดอร์', () => {
@@ -441,14 +679,31 @@ async function submitOrder() {
         btn.disabled = true;
       }
 
+      // Same cart + note keeps the same key, so a retry after a timeout cannot double-order
+      const signature = JSON.stringify([cartKey(), note]);
+      if (!submission || submission.signature !== signature) {
+        submission = { signature, key: newIdempotencyKey() };
+      }
       const response = await axios.post(`${API_BASE}.liff_submit_order`, {
-        access_token: liff.getAccessToken(),
+        ...authPayload(),
         items: cart,
-        note: note
+        note: note,
+        idempotency_key: submission.key
       });
       
-      showModal('สำเร็จ', `สั่งออเดอร์เรียบร้อย! เลขที่: ${response.data.message.sales_order}`);
+      let result = response.data.message;
+      if (result.pending) {
+        if (btn) btn.textContent = 'กำลังสร้างออเดอร์...';
+        result = await waitForOrder(result.job_id);
+      }
+      if (!result.success) {
+        throw new Error(result.error || 'ไม่สามารถสร้างออเดอร์ได้');
+      }
+      
+      showModal('สำเร็จ', `สั่งออเดอร์เรียบร้อย! เลขที่: ${result.sales_order}`);
+      submission = null;
       cart = [];
+      bootstrapHistory = null;
       showPage('home');
       updateCartBadge();
     } catch (err) {
@@ -497,72 +752,95 @@ async function renderProfile() {
     `;
     contentEl.innerHTML = html;
     
-    // Fetch History
-    try {
-        const response = await axios.post(`${API_BASE}.liff_get_history`, {
-             access_token: liff.getAccessToken()
-        });
-        const orders = response.data.message || [];
-        const historyList = document.getElementById('history-list');
-        document.getElementById('history-loading').style.display = 'none';
-        
-        if (orders.length === 0) {
-            historyList.innerHTML = '<p class="text-center text-muted">ยังไม่มีประวัติการสั่งซื้อ</p>';
-            return;
-        }
-        
-        const statusMap = {
-            'To Deliver and Bill': 'รอจัดส่ง',
-            'To Bill': 'รอชำระ',
-            'To Deliver': 'รอจัดส่ง',
-            'Completed': 'สำเร็จ',
-            'Cancelled': 'ยกเลิก',
-            'Overdue': 'เกินกำหนด'
-        };
-
-        let listHtml = '';
-        orders.forEach(order => {
-            let itemsHtml = '';
-            if (order.items && order.items.length > 0) {
-                itemsHtml = `<div class="history-items hidden" id="order-items-${order.name}">`;
-                order.items.forEach(item => {
-                    itemsHtml += `
-                        <div class="history-item-row">
-                            <span class="item-name">${item.item_name}</span>
-                            <span class="item-qty">x${item.formatted_qty}</span>
-                        </div>
-                    `;
-                });
-                itemsHtml += '</div>';
-            }
-
-            const statusClass = order.status || 'Draft';
-            const statusLabel = statusMap[order.status] || order.status;
-            const date = order.transaction_date || '';
-
-            listHtml += `
-                <div class="history-card status-${statusClass}" onclick="toggleOrderDetails('${order.name}')">
-                    <div class="history-card-header">
-                        <div class="history-info">
-                            <h4>${order.name}</h4>
-                            <div class="history-date">${date}</div>
-                        </div>
-                        <div class="history-status">
-                            <span class="status-badge ${statusClass}">${statusLabel}</span>
-                            <div class="history-total">${order.formatted_total}</div>
-                        </div>
-                    </div>
-                    ${itemsHtml}
+    // Fetch History (the first page may already have come with the bootstrap call)
+    if (bootstrapHistory) {
+      renderHistoryPage(bootstrapHistory, null);
+      bootstrapHistory = null;
+    } else {
+      loadHistoryPage(null);
+    }
+  }
+}
+
+const ORDER_STATUS_LABELS = {
+    'To Deliver and Bill': 'รอจัดส่ง',
+    'To Bill': 'รอชำระ',
+    'To Deliver': 'รอจัดส่ง',
+    'Completed': 'สำเร็จ',
+    'Cancelled': 'ยกเลิก',
+    'Overdue': 'เกินกำหนด'
+};
+
+function renderHistoryOrder(order) {
+    let itemsHtml = '';
+    if (order.items && order.items.length > 0) {
+        itemsHtml = `<div class="history-items hidden" id="order-items-${order.name}">`;
+        order.items.forEach(item => {
+            itemsHtml += `
+                <div class="history-item-row">
+                    <span class="item-name">${item.item_name}</span>
+                    <span class="item-qty">x${item.formatted_qty}</span>
                 </div>
             `;
         });
-        historyList.innerHTML = listHtml;
-        
+        itemsHtml += '</div>';
+    }
+
+    const statusClass = order.status || 'Draft';
+    const statusLabel = ORDER_STATUS_LABELS[order.status] || order.status;
+    const date = order.transaction_date || '';
+
+    return `
+        <div class="history-card status-${statusClass}" onclick="toggleOrderDetails('${order.name}')">
+            <div class="history-card-header">
+                <div class="history-info">
+                    <h4>${order.name}</h4>
+                    <div class="history-date">${date}</div>
+                </div>
+                <div class="history-status">
+                    <span class="status-badge ${statusClass}">${statusLabel}</span>
+                    <div class="history-total">${order.formatted_total}</div>
+                </div>
+            </div>
+            ${itemsHtml}
+        </div>
+    `;
+}
+
+function renderHistoryPage(page, cursor) {
+    const historyList = document.getElementById('history-list');
+    const orders = page.orders || [];
+    document.getElementById('history-loading').style.display = 'none';
+    
+    if (!cursor && orders.length === 0) {
+        historyList.innerHTML = '<p class="text-center text-muted">ยังไม่มีประวัติการสั่งซื้อ</p>';
+        return;
+    }
+
+    historyList.insertAdjacentHTML('beforeend', orders.map(renderHistoryOrder).join(''));
+    if (page.next_cursor) {
+        const btn = document.createElement('button');
+        btn.id = 'history-more-btn';
+        btn.className = 'btn';
+        btn.textContent = 'ดูเพิ่มเติม';
+        btn.onclick = () => loadHistoryPage(page.next_cursor);
+        historyList.after(btn);
+    }
+}
+
+/**
+ * Append one page of order history; `cursor` is the `next_cursor` of the previous page.
+ */
+async function loadHistoryPage(cursor) {
+    const moreBtn = document.getElementById('history-more-btn');
+    if (moreBtn) moreBtn.remove();
+    try {
+        const response = await axios.post(`${API_BASE}.liff_get_history`, { ...authPayload(), cursor });
+        renderHistoryPage(response.data.message || {}, cursor);
     } catch (err) {
         console.error("History Error", err);
         document.getElementById('history-loading').innerHTML = '<p class="error">โหลดประวัติไม่สำเร็จ</p>';
     }
-  }
 }
 
 window.toggleOrderDetails = (orderId) => {
@@ -581,7 +859,7 @@ async function register() {
 
   try {
     const response = await axios.post(`${API_BASE}.liff_register`, {
-      access_token: liff.getAccessToken(),
+      ...authPayload(),
       phone: phone
     });
     
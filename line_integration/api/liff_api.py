@@ -2,26 +2,64 @@
 LIFF API Endpoints
 ==================
 Guest-accessible REST endpoints called from the LINE LIFF frontend.
-Authentication: LIFF access_token → LINE verify API → line_user_id lookup.
+Authentication: LIFF id_token verified locally (JWT), falling back to
+access_token → LINE verify API → line_user_id lookup.
 """
 
+import base64
+import hashlib
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 
-import requests
 import frappe
-from frappe.utils import add_days, fmt_money, now_datetime, today, flt
-
-from line_integration.utils.line_client import get_settings, ensure_profile
+from frappe.utils import add_days, cint, fmt_money, now_datetime, today, flt
+from werkzeug.wrappers import Response
+
+from line_integration.utils.line_client import (
+    LINE_API_BASE,
+    ensure_profile,
+    get_settings,
+    line_request,
+    set_cached_line_profile,
+)
+from line_integration.utils import (
+    liff_session,
+    loyalty_cache,
+    menu_catalog,
+    menu_publisher,
+    order_submission,
+    rate_limit,
+)
+from line_integration.utils.cart_pricing import quote_cart, simulate_sales_order
+from line_integration.utils.rate_limit import rate_limited
+from line_integration.utils.pricing import (
+    get_customer_pricing,
+    get_menu_prices,
+    get_price_version,
+    get_selling_defaults,
+)
+from line_integration.utils.id_token import verify_id_token
+from line_integration.utils.image_urls import resolve_public_image_urls
+from line_integration.utils.image_variants import GRID_WIDTH, THUMB_WIDTH
 from line_integration.api.line_webhook import (
-    fetch_menu_items,
-    resolve_public_image_url,
     format_qty,
     build_so_items,
     DEFAULT_LOYALTY_PROGRAM,
     PHONE_REGEX,
 )
-from erpnext.stock.get_item_details import get_item_details
+
+# Bump when the menu item payload changes shape, so cached client copies are refetched
+MENU_FORMAT_VERSION = 2
+MENU_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE = 10
+HISTORY_MAX_PAGE_SIZE = 50
+BOOTSTRAP_HISTORY_SIZE = 5
+# Upper bound for the liff_bootstrap JSON, in bytes
+BOOTSTRAP_PAYLOAD_BUDGET = 64 * 1024
+# Profile fields kept when the bootstrap profile alone exceeds the budget
+BOOTSTRAP_AUTH_FIELDS = ("success", "user_id", "is_registered", "customer_id")
 
 
 # ──────────────────────────────────────────────
@@ -29,6 +67,7 @@ from erpnext.stock.get_item_details import get_item_details
 # ──────────────────────────────────────────────
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("ping")
 def ping():
     return "pong"
 
@@ -43,16 +82,21 @@ def _verify_liff_token(access_token):
     Steps:
         1. Verify token → get client_id + expires_in
         2. Fetch profile using the same token → get userId, displayName, pictureUrl
+    Successful results are cached (see utils.liff_session) for at most expires_in.
     Returns dict with user info or raises.
     """
     if not access_token:
         frappe.throw("Missing access_token", frappe.AuthenticationError)
 
+    cached = liff_session.get_session(access_token)
+    if cached:
+        return cached
+
     # Step 1: Verify the token
-    verify_resp = requests.get(
-        "https://api.line.me/oauth2/v2.1/verify",
+    verify_resp = line_request(
+        "GET",
+        f"{LINE_API_BASE}/oauth2/v2.1/verify",
         params={"access_token": access_token},
-        timeout=10,
     )
     if verify_resp.status_code != 200:
         frappe.throw("Invalid or expired LIFF access token", frappe.AuthenticationError)
@@ -62,30 +106,65 @@ def _verify_liff_token(access_token):
         frappe.throw("LIFF access token expired", frappe.AuthenticationError)
 
     # Step 2: Fetch user profile
-    profile_resp = requests.get(
-        "https://api.line.me/v2/profile",
+    profile_resp = line_request(
+        "GET",
+        f"{LINE_API_BASE}/v2/profile",
         headers={"Authorization": f"Bearer {access_token}"},
-        timeout=10,
     )
     if profile_resp.status_code != 200:
         frappe.throw("Failed to fetch LINE profile", frappe.AuthenticationError)
 
     profile = profile_resp.json()
-    return {
+    user_info = {
         "user_id": profile.get("userId"),
         "display_name": profile.get("displayName"),
         "picture_url": profile.get("pictureUrl"),
         "status_message": profile.get("statusMessage"),
     }
+    liff_session.save_session(access_token, user_info, verify_data.get("expires_in"), get_settings())
+    return user_info
+
+
+def _verify_liff_id_token(id_token):
+    """Verify a LIFF ID token locally (no LINE API round-trip) and return user info."""
+    settings = get_settings()
+    claims = verify_id_token(id_token, settings.liff_channel_id or settings.channel_id)
+    return {
+        "user_id": claims.get("sub"),
+        "display_name": claims.get("name"),
+        "picture_url": claims.get("picture"),
+        "status_message": None,
+    }
 
 
-def _get_liff_user(access_token):
-    """Verify token, ensure LINE Profile doc exists, return (profile_doc, user_info)."""
-    user_info = _verify_liff_token(access_token)
+def _get_liff_user(access_token=None, id_token=None):
+    """Verify token, ensure LINE Profile doc exists, return (profile_doc, user_info).
+
+    The ID token is tried first; the access token path (two LINE API calls) remains as
+    a fallback for older clients or an expired ID token.
+    """
+    user_info = None
+    if id_token:
+        try:
+            user_info = _verify_liff_id_token(id_token)
+        except Exception as e:
+            frappe.logger("line_webhook").info({"event": "liff_id_token_rejected", "error": str(e)})
+            if not access_token:
+                frappe.throw("Invalid or expired LIFF ID token", frappe.AuthenticationError)
+    if user_info is None:
+        user_info = _verify_liff_token(access_token)
     user_id = user_info.get("user_id")
     if not user_id:
         frappe.throw("Could not determine LINE user ID", frappe.AuthenticationError)
-
+    rate_limit.check_user(user_id)
+
+    # The LIFF profile is fresh from LINE; seed the profile cache so ensure_profile
+    # does not schedule another profile API call for this user
+    if user_info.get("display_name"):
+        set_cached_line_profile(
+            user_id,
+            {"displayName": user_info.get("display_name"), "pictureUrl": user_info.get("picture_url")},
+        )
     # ensure_profile creates or updates the LINE Profile doc
     profile_doc = ensure_profile(user_id)
     return profile_doc, user_info
@@ -96,21 +175,23 @@ def _get_liff_user(access_token):
 # ──────────────────────────────────────────────
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("liff_debug")
 def liff_debug():
     """Simple ping to check if code is updated."""
     return {"status": "ok", "version": "2026-02-10-v3-no-cors"}
 
 @frappe.whitelist(allow_guest=True)
-def liff_auth(access_token=None):
+@rate_limited("liff_auth")
+def liff_auth(access_token=None, id_token=None):
     # CORS handled by site_config
 
     try:
         # If token is missing, return success=False but 200 OK to avoid 417
-        if not access_token:
+        if not access_token and not id_token:
             frappe.local.response['http_status_code'] = 200
             return {"success": False, "error": "No access_token provided"}
 
-        profile_doc, user_info = _get_liff_user(access_token)
+        profile_doc, user_info = _get_liff_user(access_token, id_token)
         customer_data = {}
         if profile_doc.customer:
             customer_data = frappe.db.get_value(
@@ -130,6 +211,8 @@ def liff_auth(access_token=None):
             "customer_id": profile_doc.customer,
             "phone": customer_data.get("mobile_no"),
         }
+    except rate_limit.RateLimitExceeded:
+        raise
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "LIFF Auth Error")
         # Ensure we return a 200 status with error info to avoid 417
@@ -144,83 +227,162 @@ def liff_auth(access_token=None):
 #  2. Menu endpoint
 # ──────────────────────────────────────────────
 
+def _menu_validators(customer):
+    """(ETag, catalog version, last-modified epoch) of `customer`'s menu, without building it."""
+    catalog = menu_catalog.get_catalog()
+    price_version = get_price_version()
+    pricing = get_customer_pricing(customer)
+    raw = ":".join(
+        str(part)
+        for part in (
+            MENU_FORMAT_VERSION,
+            catalog.version,
+            price_version,
+            customer or "",
+            pricing["price_list"] or "",
+            pricing["customer_group"] or "",
+            today(),
+        )
+    )
+    etag = '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+    last_modified = max(float(catalog.get("built_ts") or 0), price_version / 1000.0)
+    return etag, catalog.version, last_modified
+
+
+def _not_modified(etag, last_modified):
+    headers = frappe.request.headers if getattr(frappe, "request", None) else {}
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if not headers.get("If-Modified-Since") or not last_modified:
+        return False
+    try:
+        since = parsedate_to_datetime(headers.get("If-Modified-Since"))
+    except (TypeError, ValueError):
+        # Malformed header: answer in full rather than fail
+        return False
+    return bool(since) and int(last_modified) <= since.timestamp()
+
+
+def _menu_response(body, status, etag, version, last_modified):
+    response = Response(body, status=status, mimetype="application/json")
+    response.headers["ETag"] = etag
+    if last_modified:
+        response.headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    response.headers["X-Catalog-Version"] = str(version)
+    # Prices are per customer; the client must revalidate before reuse
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.headers["Access-Control-Expose-Headers"] = "ETag, Last-Modified, X-Catalog-Version"
+    return response
+
+
 @frappe.whitelist(allow_guest=True)
-def liff_get_menu(access_token=None):
+@rate_limited("liff_get_menu")
+def liff_get_menu(access_token=None, id_token=None):
+    """Menu with customer-specific prices; answers 304 when the client copy is current."""
     # CORS handled by site_config
     
     # Try to identify user for specific pricing
     customer = None
     try:
-        if access_token:
-            profile_doc, _ = _get_liff_user(access_token)
+        if access_token or id_token:
+            profile_doc, _ = _get_liff_user(access_token, id_token)
             customer = profile_doc.customer
+    except rate_limit.RateLimitExceeded:
+        raise
     except:
         pass
 
-    items = fetch_menu_items(limit=50)
-    result = []
-    
-    # Pre-fetch default price list if needed
-    price_list = None
-    if not customer:
-        price_list = frappe.db.get_single_value("Selling Settings", "selling_price_list")
+    etag, version, last_modified = _menu_validators(customer)
+    if _not_modified(etag, last_modified):
+        return _menu_response(b"", 304, etag, version, last_modified)
 
-    for item in items:
-        image_url = resolve_public_image_url(
-            item.get("custom_line_menu_image")
-        )
-        
-        formatted_price = ""
-        try:
-            args = {
-                "item_code": item.name,
-                "qty": 1,
-                "customer": customer,
-                "price_list": price_list,
-                "company": frappe.db.get_default("Company"),
-                "transaction_date": today(),
-            }
-            details = get_item_details(args)
-            rate = details.get("price_list_rate") or details.get("rate") or 0
-        except:
-            rate = 0
+    result = build_menu(customer)
+    return _menu_response(frappe.as_json({"message": result}), 200, etag, version, last_modified)
 
-        # Fallback 1: Item Price (Standard Selling)
-        if rate <= 0:
-            rate = frappe.db.get_value("Item Price", 
-                {"item_code": item.name, "price_list": "Standard Selling"}, 
-                "price_list_rate"
-            ) or 0
 
-        # Fallback 2: Item Standard Rate
-        if rate <= 0:
-            rate = flt(item.standard_rate)
+def build_menu(customer=None, limit=MENU_PAGE_SIZE):
+    items = menu_catalog.get_menu_items(limit=limit)
+    result = []
+    currency = get_selling_defaults()["currency"]
+    try:
+        prices = get_menu_prices(items, customer=customer)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "LIFF Menu Pricing Error")
+        prices = {item.name: flt(item.standard_rate) for item in items}
 
-        if rate > 0:
-            formatted_price = fmt_money(rate, currency=frappe.db.get_default("Currency") or "THB")
+    for item in items:
+        image_url = menu_catalog.image_url(item, GRID_WIDTH)
+        webp_url = menu_catalog.image_url(item, GRID_WIDTH, "webp") if (item.get("image_variants") or {}).get("webp") else None
+        rate = prices.get(item.name) or 0
+        formatted_price = fmt_money(rate, currency=currency) if rate > 0 else ""
 
         result.append({
             "item_code": item.name,
             "item_name": item.item_name or item.name,
-            "description": (item.get("description") or "").strip(),
+            "description": item.description,
             "image_url": image_url,
+            "image_webp_url": webp_url,
             "price": rate,
             "formatted_price": formatted_price,
         })
     return result
 
 
+@frappe.whitelist(allow_guest=True)
+@rate_limited("liff_menu_version")
+def liff_menu_version():
+    """Version and URL of the static menu file (see utils.menu_publisher)."""
+    return menu_publisher.get_version_info()
+
+
+@frappe.whitelist(allow_guest=True)
+@rate_limited("liff_get_menu_prices")
+def liff_get_menu_prices(access_token=None, id_token=None):
+    """Static menu version and URL plus the customer's own prices, in one call.
+
+    The client overlays `prices` on the static menu. The ETag covers both the published
+    menu and the customer's prices, so an unchanged menu is answered with a 304.
+    """
+    profile_doc, _ = _get_liff_user(access_token, id_token)
+    info = menu_publisher.get_version_info()
+    customer = profile_doc.customer
+    menu_etag, version, last_modified = _menu_validators(customer)
+    etag = '"' + hashlib.sha1(f"{menu_etag}:{info['version']}".encode()).hexdigest()[:20] + '"'
+    if _not_modified(etag, None):
+        return _menu_response(b"", 304, etag, version, last_modified)
+
+    prices = {}
+    if customer:
+        items = menu_catalog.get_menu_items(limit=MENU_PAGE_SIZE)
+        currency = get_selling_defaults()["currency"]
+        prices = {
+            code: {"price": rate, "formatted_price": fmt_money(rate, currency=currency) if rate > 0 else ""}
+            for code, rate in get_menu_prices(items, customer=customer).items()
+        }
+    body = frappe.as_json({"message": dict(info, prices=prices)})
+    return _menu_response(body, 200, etag, version, last_modified)
+
+
 # ──────────────────────────────────────────────
 #  3. Submit order endpoint
 # ──────────────────────────────────────────────
 
 @frappe.whitelist(allow_guest=True)
-def liff_submit_order(access_token=None, items=None, note=None):
+@rate_limited("liff_submit_order")
+def liff_submit_order(access_token=None, items=None, note=None, id_token=None, idempotency_key=None, async_mode=None):
+    """Create and submit a Sales Order for the LIFF cart.
+
+    With `idempotency_key`, repeats of the same submission return the first result (or its
+    pending status) instead of creating another order. In async mode (`async_mode=1` or
+    LINE Settings "Async Order Submission") the order is created by a worker and the
+    response only carries a `job_id` to poll with `liff_get_order_status`.
+    """
     # CORS handled by site_config
-    if not access_token:
+    if not access_token and not id_token:
         frappe.throw("Access Token is required")
     
-    profile_doc, user_info = _get_liff_user(access_token)
+    profile_doc, user_info = _get_liff_user(access_token, id_token)
     settings = get_settings()
 
     if not settings.auto_create_sales_order:
@@ -236,8 +398,7 @@ def liff_submit_order(access_token=None, items=None, note=None):
         frappe.throw("กรุณาเลือกสินค้าอย่างน้อย 1 รายการ", frappe.ValidationError)
 
     # Validate items exist in menu
-    menu_items = fetch_menu_items(limit=1000)
-    valid_codes = {m.name for m in menu_items}
+    valid_codes = {m.name for m in menu_catalog.get_menu_items()}
 
     orders = []
     for entry in items:
@@ -257,6 +418,55 @@ def liff_submit_order(access_token=None, items=None, note=None):
         frappe.throw("ไม่มีรายการสินค้าที่ถูกต้อง", frappe.ValidationError)
 
     note = (note or "").strip()
+    customer = profile_doc.customer
+    run_async = cint(async_mode) or cint(getattr(settings, "async_order_submission", 0))
+    if run_async and not idempotency_key:
+        idempotency_key = frappe.generate_hash(length=20)
+    if idempotency_key:
+        idempotency_key = order_submission.clean_key(idempotency_key)
+        existing = order_submission.reserve(customer, idempotency_key, sync=not run_async)
+        if existing:
+            return order_submission.to_response(existing)
+
+    if run_async:
+        frappe.enqueue(
+            "line_integration.api.liff_api.run_order_submission",
+            queue="default",
+            job_id=order_submission.job_id(customer, idempotency_key),
+            customer=customer,
+            line_user_id=profile_doc.line_user_id,
+            orders=orders,
+            note=note,
+            idempotency_key=idempotency_key,
+            enqueue_after_commit=True,
+        )
+        return {"success": True, "pending": True, "status": order_submission.QUEUED, "job_id": idempotency_key}
+
+    try:
+        result = create_liff_order(customer, profile_doc.line_user_id, orders, note, settings, idempotency_key)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "LIFF Order Error")
+        if idempotency_key:
+            order_submission.mark_failed(customer, idempotency_key, "ไม่สามารถสร้างออเดอร์ได้ กรุณาลองใหม่อีกครั้ง")
+        frappe.throw("ไม่สามารถสร้างออเดอร์ได้ กรุณาลองใหม่อีกครั้ง")
+    if idempotency_key:
+        result["job_id"] = idempotency_key
+        # Only record success once the Sales Order is actually committed
+        frappe.db.after_commit.add(lambda: order_submission.mark_done(customer, idempotency_key, result))
+    return result
+
+
+def create_liff_order(customer, line_user_id, orders, note, settings=None, idempotency_key=None):
+    """Insert and submit the Sales Order, then push the LINE confirmation.
+
+    With `idempotency_key`, the key is stored on the order, and an order already
+    committed under it is returned instead of creating another one.
+    """
+    settings = settings or get_settings()
+    if idempotency_key:
+        existing = order_submission.find_order(customer, idempotency_key)
+        if existing:
+            return order_result(existing)
 
     # Calculate delivery date (next Saturday)
     weekday = now_datetime().weekday()
@@ -264,58 +474,87 @@ def liff_submit_order(access_token=None, items=None, note=None):
     if days_until_sat == 0:
         days_until_sat = 7  # if today is Saturday, deliver next Saturday
 
+    so = frappe.get_doc({
+        "doctype": "Sales Order",
+        "customer": customer,
+        "transaction_date": today(),
+        "delivery_date": add_days(today(), days_until_sat),
+        "ignore_pricing_rule": 0,
+        "remarks": note,
+        "line_order_note": note,
+        "line_idempotency_key": idempotency_key,
+        "items": build_so_items(orders, settings),
+    })
+    so.insert(ignore_permissions=True)
+    so.submit()
+
+    total_text = fmt_money(so.grand_total, currency=so.currency)
+    
+    # Send confirmation via LINE
     try:
-        so = frappe.get_doc({
-            "doctype": "Sales Order",
-            "customer": profile_doc.customer,
-            "transaction_date": today(),
-            "delivery_date": add_days(today(), days_until_sat),
-            "ignore_pricing_rule": 0,
-            "remarks": note,
-            "line_order_note": note,
-            "items": build_so_items(orders, settings),
-        })
-        so.insert(ignore_permissions=True)
-        so.submit()
-
-        total_text = fmt_money(so.grand_total, currency=so.currency)
+        msg_lines = [
+            f"สั่งซื้อสำเร็จ! {so.name}",
+            f"รายการสินค้า {len(orders)} รายการ",
+        ]
+        for o in orders:
+            msg_lines.append(f"- {o['title']} x {format_qty(o['qty'])}")
         
-        # Send confirmation via LINE
-        try:
-            msg_lines = [
-                f"สั่งซื้อสำเร็จ! {so.name}",
-                f"รายการสินค้า {len(orders)} รายการ",
-            ]
-            for o in orders:
-                msg_lines.append(f"- {o['title']} x {format_qty(o['qty'])}")
-            
-            msg_lines.append(f"ยอดรวม: {total_text}")
-            msg_lines.append(f"รอรับสินค้าวันที่: {so.delivery_date}")
-            msg_lines.append("ขอบคุณค่ะ 🙏")
-            
-            msg = "\n".join(msg_lines)
-            
-            # Send push message
-            from line_integration.utils.line_client import push_message
-            push_message(profile_doc.line_user_id, msg)
-        except:
-            frappe.log_error(frappe.get_traceback(), "LIFF Confirmation Push Failed")
+        msg_lines.append(f"ยอดรวม: {total_text}")
+        msg_lines.append(f"รอรับสินค้าวันที่: {so.delivery_date}")
+        msg_lines.append("ขอบคุณค่ะ 🙏")
+        
+        msg = "\n".join(msg_lines)
+        
+        # Send push message
+        from line_integration.utils.line_client import push_message
+        push_message(line_user_id, msg)
+    except:
+        frappe.log_error(frappe.get_traceback(), "LIFF Confirmation Push Failed")
 
-        return {
-            "success": True,
-            "sales_order": so.name,
-            "total_items": len(orders),
-            "total_qty": sum(o["qty"] for o in orders),
-            "grand_total": so.grand_total,
-            "grand_total_formatted": total_text,
-            "currency": so.currency,
-        }
+    return order_result(so)
+
+
+def order_result(so):
+    """Order submission result for a submitted Sales Order."""
+    return {
+        "success": True,
+        "sales_order": so.name,
+        "total_items": len(so.items),
+        "total_qty": sum(row.qty for row in so.items),
+        "grand_total": so.grand_total,
+        "grand_total_formatted": fmt_money(so.grand_total, currency=so.currency),
+        "currency": so.currency,
+    }
+
+
+def run_order_submission(customer, line_user_id, orders, note, idempotency_key):
+    """RQ job for async submissions: create the order and record the outcome."""
+    try:
+        result = create_liff_order(customer, line_user_id, orders, note, idempotency_key=idempotency_key)
+        frappe.db.commit()
     except Exception:
+        frappe.db.rollback()
         frappe.log_error(frappe.get_traceback(), "LIFF Order Error")
-        frappe.throw("ไม่สามารถสร้างออเดอร์ได้ กรุณาลองใหม่อีกครั้ง")
+        order_submission.mark_failed(customer, idempotency_key, "ไม่สามารถสร้างออเดอร์ได้ กรุณาลองใหม่อีกครั้ง")
+        return
+    order_submission.mark_done(customer, idempotency_key, result)
+
+
+@frappe.whitelist(allow_guest=True)
+@rate_limited("liff_get_order_status")
+def liff_get_order_status(access_token=None, id_token=None, job_id=None):
+    """Status of an order submission: pending, done (with the order result) or failed."""
+    profile_doc, _ = _get_liff_user(access_token, id_token)
+    if not profile_doc.customer or not job_id:
+        frappe.throw("ไม่พบรายการสั่งซื้อ", frappe.DoesNotExistError)
+    record = order_submission.get_record(profile_doc.customer, order_submission.clean_key(job_id))
+    if not record:
+        frappe.throw("ไม่พบรายการสั่งซื้อ", frappe.DoesNotExistError)
+    return order_submission.to_response(record)
 
 @frappe.whitelist(allow_guest=True)
-def liff_calculate_cart(access_token=None, items=None):
+@rate_limited("liff_calculate_cart")
+def liff_calculate_cart(access_token=None, items=None, id_token=None):
     if not items:
         return {"grand_total": 0, "formatted_total": fmt_money(0), "items": []}
 
@@ -324,47 +563,68 @@ def liff_calculate_cart(access_token=None, items=None):
 
     customer = None
     try:
-        if access_token:
-            profile_doc, _ = _get_liff_user(access_token)
+        if access_token or id_token:
+            profile_doc, _ = _get_liff_user(access_token, id_token)
             customer = profile_doc.customer
+    except rate_limit.RateLimitExceeded:
+        raise
     except:
         pass
 
-    currency = frappe.db.get_default("Currency") or "THB"
-    company = frappe.db.get_default("Company")
+    currency = get_selling_defaults()["currency"]
     settings = get_settings()
-    
-    # Simulate Sales Order
-    so = frappe.new_doc("Sales Order")
-    so.customer = customer
-    so.company = company
-    so.currency = currency
-    so.transaction_date = today()
-    so.delivery_date = add_days(today(), 7)
-
-    # Convert to build_so_items input
-    order_rows = []
-    for item in items:
-        order_rows.append({
-            "item_code": item.get("item_code"),
-            "qty": flt(item.get("qty") or 1)
-        })
 
-    # Add items using the custom build logic (which we will also refine)
-    for row in build_so_items(order_rows, settings):
-        so.append("items", row)
-    
-    # Trigger ERPNext Pricing Rules
-    so.set_missing_values()
-    so.calculate_taxes_and_totals()
-    
+    try:
+        quote = quote_cart(items, customer=customer, settings=settings)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "LIFF Cart Pricing Error")
+        quote = None
+    if quote:
+        updated_items = [
+            {
+                "item_code": line["item_code"],
+                "item_name": line["item_name"],
+                "image_url": menu_catalog.image_url(line["item"], THUMB_WIDTH),
+                "qty": line["qty"],
+                "price": line["rate"],
+                "formatted_price": fmt_money(line["rate"], currency=currency),
+                "line_total": line["amount"],
+                "formatted_line_total": fmt_money(line["amount"], currency=currency),
+            }
+            for line in quote["items"]
+        ]
+        return {
+            "items": updated_items,
+            "grand_total": quote["grand_total"],
+            "formatted_total": fmt_money(quote["grand_total"], currency=currency),
+        }
+
+    # Pricing setups the engine cannot model: simulate the Sales Order
+    so = simulate_sales_order(items, customer=customer, settings=settings)
+    catalog = {item.name: item for item in menu_catalog.get_menu_items()}
+    # Items outside the menu catalog: one Item query and one batch URL resolution
+    other_codes = list({row.item_code for row in so.items if row.item_code not in catalog})
+    other_images = {}
+    if other_codes:
+        other_images = dict(
+            frappe.get_all(
+                "Item",
+                filters={"name": ["in", other_codes]},
+                fields=["name", "custom_line_menu_image"],
+                as_list=True,
+            )
+        )
+    other_urls = resolve_public_image_urls(other_images.values())
+
     updated_items = []
     for i, so_item in enumerate(so.items):
         original = items[i] if i < len(items) else {}
         
-        # Fetch image URL like in liff_get_menu
-        image_url = frappe.db.get_value("Item", so_item.item_code, "custom_line_menu_image")
-        image_url = resolve_public_image_url(image_url)
+        catalog_item = catalog.get(so_item.item_code)
+        if catalog_item:
+            image_url = menu_catalog.image_url(catalog_item, THUMB_WIDTH)
+        else:
+            image_url = other_urls.get(other_images.get(so_item.item_code))
 
         updated_items.append({
             "item_code": so_item.item_code,
@@ -389,9 +649,10 @@ def liff_calculate_cart(access_token=None, items=None):
 # ──────────────────────────────────────────────
 
 @frappe.whitelist(allow_guest=True)
-def liff_register(access_token=None, phone=None):
+@rate_limited("liff_register")
+def liff_register(access_token=None, phone=None, id_token=None):
     # CORS handled by site_config
-    profile_doc, user_info = _get_liff_user(access_token)
+    profile_doc, user_info = _get_liff_user(access_token, id_token)
 
     phone = (phone or "").strip()
     if not phone or not PHONE_REGEX.match(phone):
@@ -503,9 +764,10 @@ def liff_register(access_token=None, phone=None):
 # ──────────────────────────────────────────────
 
 @frappe.whitelist(allow_guest=True)
-def liff_get_points(access_token=None):
+@rate_limited("liff_get_points")
+def liff_get_points(access_token=None, id_token=None):
     # CORS handled by site_config
-    profile_doc, user_info = _get_liff_user(access_token)
+    profile_doc, user_info = _get_liff_user(access_token, id_token)
 
     if not profile_doc.customer:
         return {
@@ -519,14 +781,7 @@ def liff_get_points(access_token=None):
     points = 0
 
     try:
-        from erpnext.accounts.doctype.loyalty_program.loyalty_program import (
-            get_loyalty_program_details_with_points,
-        )
-        lp_details = get_loyalty_program_details_with_points(
-            customer=profile_doc.customer,
-            loyalty_program=loyalty_program,
-        )
-        points = (lp_details or {}).get("loyalty_points", 0) or 0
+        points = loyalty_cache.get_points(profile_doc.customer, loyalty_program)
     except Exception:
         frappe.log_error(frappe.get_traceback(), "LIFF Points Error")
 
@@ -546,39 +801,196 @@ def liff_get_points(access_token=None):
 #  5. Order History endpoint
 # ──────────────────────────────────────────────
 @frappe.whitelist(allow_guest=True)
-def liff_get_history(access_token=None):
-    profile_doc, _ = _get_liff_user(access_token)
-    if not profile_doc.customer:
-        return []
-
-    orders = frappe.get_all(
-        "Sales Order",
-        filters={
-            "customer": profile_doc.customer,
-            "status": ["!=", "Draft"]
-        },
-        fields=["name", "status", "grand_total", "currency", "transaction_date"],
-        order_by="transaction_date desc, creation desc",
-        limit=10,
-        ignore_permissions=True
+@rate_limited("liff_get_history")
+def liff_get_history(access_token=None, id_token=None, cursor=None, page_size=None):
+    """One page of the customer's orders, newest first.
+
+    Pages are keyed on (transaction_date, creation, name): pass back `next_cursor` to get
+    the following page. Cost per page does not depend on how many orders came before.
+    """
+    profile_doc, _ = _get_liff_user(access_token, id_token)
+    return get_history_page(profile_doc.customer, cursor, page_size)
+
+
+def get_history_page(customer, cursor=None, page_size=None):
+    if not customer:
+        return {"orders": [], "next_cursor": None}
+
+    page_size = min(max(cint(page_size) or HISTORY_PAGE_SIZE, 1), HISTORY_MAX_PAGE_SIZE)
+    values = {"customer": customer, "limit": page_size + 1}
+    after = ""
+    if cursor:
+        try:
+            values["c_date"], values["c_creation"], values["c_name"] = json.loads(
+                base64.urlsafe_b64decode(cursor.encode()).decode()
+            )
+        except Exception:
+            frappe.throw("Invalid cursor", frappe.ValidationError)
+        after = """
+            AND (so.transaction_date < %(c_date)s
+                OR (so.transaction_date = %(c_date)s
+                    AND (so.creation < %(c_creation)s
+                        OR (so.creation = %(c_creation)s AND so.name < %(c_name)s))))
+        """
+
+    orders = frappe.db.sql(
+        f"""
+        SELECT so.name, so.status, so.grand_total, so.currency, so.transaction_date, so.creation
+        FROM `tabSales Order` so
+        WHERE so.customer = %(customer)s
+          AND so.status != 'Draft'
+          {after}
+        ORDER BY so.transaction_date DESC, so.creation DESC, so.name DESC
+        LIMIT %(limit)s
+        """,
+        values,
+        as_dict=True,
     )
-    
+    next_cursor = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        last = orders[-1]
+        next_cursor = base64.urlsafe_b64encode(
+            json.dumps([str(last.transaction_date), str(last.creation), last.name]).encode()
+        ).decode()
+
+    items_by_order = {}
+    if orders:
+        for item in frappe.db.sql(
+            """
+            SELECT parent, item_name, qty, amount
+            FROM `tabSales Order Item`
+            WHERE parent IN %(parents)s AND parenttype = 'Sales Order'
+            ORDER BY parent, idx
+            """,
+            {"parents": tuple(order.name for order in orders)},
+            as_dict=True,
+        ):
+            try:
+                item["formatted_qty"] = format_qty(item["qty"])
+            except:
+                item["formatted_qty"] = f"{item['qty']}"
+            items_by_order.setdefault(item.pop("parent"), []).append(item)
+
     for order in orders:
+        order.pop("creation")
         order["formatted_total"] = fmt_money(order["grand_total"], currency=order["currency"])
-        
-        # Fetch items
-        items = frappe.get_all(
-            "Sales Order Item",
-            filters={"parent": order.name},
-            fields=["item_name", "qty", "amount"],
-            ignore_permissions=True
-        )
-        for item in items:
-             try:
-                 item["formatted_qty"] = format_qty(item["qty"])
-             except:
-                 item["formatted_qty"] = f"{item['qty']}"
-             
-        order["items"] = items
-        
-    return orders
+        order["items"] = items_by_order.get(order.name, [])
+
+    return {"orders": orders, "next_cursor": next_cursor}
+
+
+# ──────────────────────────────────────────────
+#  6. Bootstrap endpoint
+# ──────────────────────────────────────────────
+
+def _run_in_site(site, sites_path, user, fn, *args):
+    """Run `fn` in a worker thread with its own Frappe context and DB connection, as `user`."""
+    frappe.init(site=site, sites_path=sites_path)
+    try:
+        frappe.connect()
+        frappe.set_user(user)
+        return fn(*args)
+    finally:
+        frappe.destroy()
+
+
+def _run_parts(parts):
+    """Compute independent bootstrap parts concurrently; {name: result or None on error}.
+
+    Each part runs in its own thread and connection for the request's site and user, so
+    the bootstrap takes as long as its slowest part rather than the sum of all parts.
+    """
+    site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+        futures = {
+            name: pool.submit(_run_in_site, site, sites_path, user, fn, *args) for name, (fn, args) in parts.items()
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception:
+                frappe.log_error(frappe.get_traceback(), f"LIFF Bootstrap Error: {name}")
+                results[name] = None
+    return results
+
+
+def _bootstrap_menu(customer):
+    etag, version, _ = _menu_validators(customer)
+    return {"etag": etag, "version": version, "items": build_menu(customer), "complete": True}
+
+
+def _bootstrap_points(customer):
+    settings = get_settings()
+    loyalty_program = settings.loyalty_program or DEFAULT_LOYALTY_PROGRAM
+    points = loyalty_cache.get_points(customer, loyalty_program)
+    return {"points": points, "points_formatted": format_qty(points), "loyalty_program": loyalty_program}
+
+
+def _payload_size(payload):
+    # Same encoding as the JSON response frappe sends
+    return len(frappe.as_json(payload, indent=None, separators=(",", ":")).encode("utf-8"))
+
+
+def fit_payload_budget(payload, budget=BOOTSTRAP_PAYLOAD_BUDGET):
+    """Trim optional bootstrap content until the JSON fits `budget` bytes.
+
+    Drops menu descriptions first, then history item lines, then menu items from the
+    end (marking the menu incomplete so the client fetches it in full), then whole
+    parts, which the client loads from their own endpoints. If the profile alone is
+    still too large, only its identifying fields are kept, and failing that an error.
+    """
+    if _payload_size(payload) <= budget:
+        return payload
+    menu = payload.get("menu") or {}
+    for item in menu.get("items") or []:
+        item.pop("description", None)
+    if _payload_size(payload) <= budget:
+        return payload
+    for order in (payload.get("history") or {}).get("orders") or []:
+        order["items"] = []
+    while menu.get("items") and _payload_size(payload) > budget:
+        menu["items"] = menu["items"][: len(menu["items"]) // 2]
+        menu["complete"] = False
+        menu["etag"] = None
+    for part in ("history", "menu", "points"):
+        if _payload_size(payload) <= budget:
+            return payload
+        payload[part] = None
+    if _payload_size(payload) <= budget:
+        return payload
+    auth = payload.get("auth") or {}
+    payload["auth"] = {key: auth.get(key) for key in BOOTSTRAP_AUTH_FIELDS if key in auth}
+    if _payload_size(payload) <= budget:
+        return payload
+    return {"auth": {"success": False, "error": "Bootstrap payload too large"}}
+
+
+@frappe.whitelist(allow_guest=True)
+@rate_limited("liff_bootstrap")
+def liff_bootstrap(access_token=None, id_token=None):
+    """Everything the LIFF app needs at startup, from a single token verification.
+
+    Returns the `liff_auth` profile plus points, the first menu page (with its ETag) and
+    the first page of recent orders. The parts are computed concurrently and the
+    response is kept under BOOTSTRAP_PAYLOAD_BUDGET bytes.
+    """
+    auth = liff_auth(access_token=access_token, id_token=id_token)
+    if not auth.get("success"):
+        return {"auth": auth}
+
+    customer = auth.get("customer_id")
+    parts = {"menu": (_bootstrap_menu, (customer,))}
+    if customer:
+        parts["points"] = (_bootstrap_points, (customer,))
+        parts["history"] = (get_history_page, (customer, None, BOOTSTRAP_HISTORY_SIZE))
+    results = _run_parts(parts)
+
+    payload = {
+        "auth": auth,
+        "points": results.get("points"),
+        "menu": results.get("menu"),
+        "history": results.get("history"),
+    }
+    return fit_payload_budget(payload)
@@ -7,14 +7,31 @@ import unicodedata
 # import urllib.parse
 
 import frappe
-from frappe.utils import add_days, fmt_money, get_url, now_datetime, today
+from frappe.utils import add_days, fmt_money, now_datetime, today
 
 from line_integration.utils.line_client import (
+    PROFILE_METRICS,
     ensure_profile,
     get_settings,
     push_message,
+    record_profile_activity,
     reply_message,
 )
+from line_integration.utils import (
+    image_urls,
+    image_variants,
+    liff_session,
+    loyalty_cache,
+    menu_aliases,
+    menu_catalog,
+    metrics,
+    outbound_queue,
+    rate_limit,
+    webhook_dedup,
+    webhook_queue,
+)
+from line_integration.utils.menu_matcher import MenuMatcher
+from line_integration.utils.rate_limit import rate_limited
 
 # Fallback defaults; settings fields override these at runtime
 DEFAULT_REGISTER_PROMPT = (
@@ -41,6 +58,7 @@ KEYWORD_KIND_MAP = {
 
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("line_webhook")
 def line_webhook():
     """LINE webhook endpoint."""
     raw_body = frappe.request.get_data() or b""
@@ -85,6 +103,15 @@ def line_webhook():
 
     payload = json.loads(raw_body.decode("utf-8") or "{}")
     events = payload.get("events", []) or []
+    total_events = len(events)
+    events = webhook_dedup.filter_new_events(events, settings)
+    if len(events) != total_events:
+        logger.info({"event": "line_webhook_duplicates_dropped", "count": total_events - len(events)})
+
+    if webhook_queue.is_async_enabled(settings):
+        queued = webhook_queue.enqueue_events(events, settings)
+        logger.info({"event": "line_webhook_queued", "count": queued})
+        return "OK"
 
     for event in events:
         try:
@@ -107,6 +134,7 @@ def handle_event(event, settings):
     state = get_state(user_id)
 
     if event_type == "unfollow":
+        liff_session.revoke_user_sessions(user_id)
         if profile_doc.status != "Blocked":
             profile_doc.status = "Blocked"
             profile_doc.last_event = json.dumps(event)
@@ -264,7 +292,8 @@ def handle_event(event, settings):
                 return
         profile_doc.last_event = json.dumps(event)
         profile_doc.last_seen = now_datetime()
-        profile_doc.save(ignore_permissions=True)
+        if not record_profile_activity(user_id, event, profile_doc.last_seen):
+            profile_doc.save(ignore_permissions=True)
 
 
 def link_customer(profile_doc, phone_number, reply_token):
@@ -305,30 +334,11 @@ def reply_points(profile_doc, reply_token):
     loyalty_program = settings.loyalty_program or DEFAULT_LOYALTY_PROGRAM
 
     try:
-        try:
-            from erpnext.accounts.doctype.loyalty_program.loyalty_program import (
-                get_loyalty_program_details_with_points,
-            )
-        except Exception:
-            frappe.log_error(
-                frappe.get_traceback(),
-                "LINE Points Check Error: import erpnext.accounts.loyalty_program",
-            )
-            reply_message(
-                reply_token,
-                "ขออภัย ไม่สามารถตรวจสอบคะแนนได้ในขณะนี้ กรุณาลองใหม่อีกครั้งค่ะ",
-            )
-            return
-
         customer_name = profile_doc.customer
         display_name = (
             frappe.db.get_value("Customer", customer_name, "customer_name") or customer_name
         )
-        lp_details = get_loyalty_program_details_with_points(
-            customer=customer_name,
-            loyalty_program=loyalty_program,
-        )
-        points = (lp_details or {}).get("loyalty_points", 0) or 0
+        points = loyalty_cache.get_points(customer_name, loyalty_program)
         points_text = format_qty(points)
         reply_message(
             reply_token,
@@ -345,7 +355,7 @@ def reply_points(profile_doc, reply_token):
 def reply_menu(reply_token, settings):
     logger = frappe.logger("line_webhook")
     try:
-        items = fetch_menu_items(limit=10)
+        items = menu_catalog.get_menu_items(limit=10)
         menu_info = {"event": "line_menu_build", "items": len(items)}
         logger.info(menu_info)
         if not items:
@@ -384,7 +394,8 @@ def reply_menu(reply_token, settings):
         logger.info(
             {
                 "event": "line_menu_reply_attempt",
-                "sent": bool(sent),
+                "sent": sent is True,
+                "queued": sent == outbound_queue.QUEUED,
                 "item_count": len(items),
                 "has_summary": bool(summary_image_url),
             }
@@ -407,7 +418,7 @@ def reply_order_form(reply_token, settings):
     """Send a single flex message with form template for user to fill quantities."""
     logger = frappe.logger("line_webhook")
     try:
-        items = fetch_menu_items(limit=20)
+        items = menu_catalog.get_menu_items(limit=20)
         template_lines = ["“สั่งออเดอร์”"]
         for item in items or []:
             title = (item.item_name or item.name or "").strip()
@@ -426,7 +437,8 @@ def reply_order_form(reply_token, settings):
         logger.info(
             {
                 "event": "line_order_form_reply_attempt",
-                "sent": bool(sent),
+                "sent": sent is True,
+                "queued": sent == outbound_queue.QUEUED,
                 "item_count": len(items or []),
                 "message_count": 2,
             }
@@ -451,10 +463,9 @@ def review_order_submission(profile_doc, text, reply_token, settings, user_id):
     if not settings.auto_create_sales_order or not settings.require_order_confirmation:
         return False
 
-    menu_items = fetch_menu_items(limit=1000)
-    item_map = {normalize_key(item.item_name or item.name): item for item in menu_items}
-
-    orders, unknown, note, invalid_qty = parse_orders_from_text(text, item_map)
+    orders, unknown, note, invalid_qty = parse_orders_from_text(text, menu_catalog.get_matcher())
+    if unknown:
+        menu_aliases.record_unmatched(unknown)
 
     if invalid_qty:
         reply_message(
@@ -625,10 +636,9 @@ def finalize_order_submission(profile_doc, text, reply_token, settings, user_id)
     if not settings.auto_create_sales_order:
         return False
 
-    menu_items = fetch_menu_items(limit=1000)
-    item_map = {normalize_key(item.item_name or item.name): item for item in menu_items}
-
-    orders, unknown, note, invalid_qty = parse_orders_from_text(text, item_map)
+    orders, unknown, note, invalid_qty = parse_orders_from_text(text, menu_catalog.get_matcher())
+    if unknown:
+        menu_aliases.record_unmatched(unknown)
 
     if invalid_qty:
         reply_message(
@@ -698,16 +708,8 @@ def reply_registered_flex(profile_doc, reply_token, settings):
     # Fetch loyalty points
     points_text = "-"
     try:
-        lp_details = None
         loyalty_program = settings.loyalty_program or DEFAULT_LOYALTY_PROGRAM
-        from erpnext.accounts.doctype.loyalty_program.loyalty_program import (
-            get_loyalty_program_details_with_points,
-        )
-        lp_details = get_loyalty_program_details_with_points(
-            customer=customer,
-            loyalty_program=loyalty_program,
-        )
-        points_val = (lp_details or {}).get("loyalty_points", 0) or 0
+        points_val = loyalty_cache.get_points(customer, loyalty_program)
         points_text = format_qty(points_val)
     except Exception:
         points_text = "-"
@@ -898,6 +900,13 @@ def eval_qty_expression(expr):
 
 
 def parse_orders_from_text(text, item_map):
+    """Parse "<menu name> จำนวน <qty>" lines.
+
+    `item_map` is a MenuMatcher (or a {normalized name: item} dict, compiled on the fly).
+    Returns (orders, unknown names, note, invalid quantity lines); each order carries the
+    match confidence.
+    """
+    matcher = item_map if isinstance(item_map, MenuMatcher) else MenuMatcher.from_item_map(item_map)
     orders = []
     unknown = []
     note = ""
@@ -983,22 +992,20 @@ def parse_orders_from_text(text, item_map):
                 invalid_qty.append(f"{line} (ต้องเป็นจำนวนเต็มเท่านั้น)")
                 continue
 
-            key = normalize_key(name_part)
+            # Exact key, then the best indexed fuzzy match (e.g. "1byeheavy", typos)
+            match = matcher.match(normalize_key(name_part))
             
-            # Try exact match first
-            item = item_map.get(key)
-            if not item:
-                # Fuzzy match
-                # Strategy: 
-                # 1. Check if item_key is substring of user_key (e.g. "byeheavy" in "1byeheavy")
-                # 2. Check if user_key is substring of item_key (e.g. "tea" in "icetea")
-                for k, candidate in item_map.items():
-                    if k in key or key in k:
-                        item = candidate
-                        break
-            
-            if item:
-                orders.append({"item": item, "qty": qty_val, "line": line, "title": item.item_name or item.name})
+            if match:
+                item = match.item
+                orders.append(
+                    {
+                        "item": item,
+                        "qty": qty_val,
+                        "line": line,
+                        "title": item.item_name or item.name,
+                        "confidence": match.score,
+                    }
+                )
             else:
                 unknown.append(name_part)
         else:
@@ -1012,38 +1019,7 @@ def resolve_public_image_url(path, logger=None):
     """Return absolute URL only if the image is public; otherwise return None."""
     if not path:
         return None
-    # If already absolute URL, use it as-is
-    if isinstance(path, str) and path.startswith(("http://", "https://")):
-        return path
-    try:
-        file_doc = frappe.db.get_value(
-            "File",
-            {"file_url": path},
-            ["file_url", "is_private"],
-            as_dict=True,
-        )
-    except Exception:
-        file_doc = None
-    if file_doc and file_doc.get("is_private"):
-        if logger:
-            logger.warning({"event": "line_image_private", "file_url": path})
-        return None
-    try:
-        return get_url((file_doc and file_doc.get("file_url")) or path)
-    except Exception:
-        if logger:
-            logger.warning({"event": "line_image_get_url_failed", "file_url": path})
-        return None
-
-
-def fetch_menu_items(limit=10, order_by="item_name asc"):
-    return frappe.get_all(
-        "Item",
-        filters={"custom_add_in_line_menu": 1},
-        fields=["name", "item_name", "description", "custom_line_menu_image", "standard_rate"],
-        order_by=order_by,
-        limit=limit,
-    )
+    return image_urls.resolve_public_image_urls([path], logger).get(path)
 
 
 def build_summary_bubble(image_url, title, subtitle, body_contents=None, aspect_ratio="1:1"):
@@ -1081,7 +1057,10 @@ def build_summary_bubble(image_url, title, subtitle, body_contents=None, aspect_
 
 def build_item_bubble(item, logger=None):
     title = (item.item_name or item.name or "").strip()
-    image_url = resolve_public_image_url(getattr(item, "custom_line_menu_image", None) or item.get("custom_line_menu_image"), logger)
+    if "image_path" in item:
+        image_url = menu_catalog.image_url(item, image_variants.HERO_WIDTH)
+    else:
+        image_url = resolve_public_image_url(getattr(item, "custom_line_menu_image", None) or item.get("custom_line_menu_image"), logger)
 
     body = {
         "type": "box",
@@ -1281,7 +1260,36 @@ def clear_order_state(user_id):
     frappe.cache().delete_value(order_cache_key(user_id))
 
 
+@frappe.whitelist()
+def get_webhook_queue_stats():
+    """Queue depth and processing lag of async webhook processing."""
+    frappe.only_for("System Manager")
+    stats = webhook_queue.get_stats()
+    stats["dedup"] = webhook_dedup.get_stats()
+    return stats
+
+
+@frappe.whitelist()
+def get_line_metrics():
+    """Counters of the LINE integration caches and queues."""
+    frappe.only_for("System Manager")
+    return {
+        "webhook_queue": webhook_queue.get_stats(),
+        "webhook_dedup": webhook_dedup.get_stats(),
+        "outbound_queue": metrics.get_all(outbound_queue.METRICS_NAME),
+        "profile_cache": metrics.get_all(PROFILE_METRICS),
+        "liff_session_cache": liff_session.get_stats(),
+        "menu_catalog": metrics.get_all(menu_catalog.METRICS_NAME),
+        "cart_pricing": metrics.get_all("cart_pricing"),
+        "loyalty_cache": metrics.get_all(loyalty_cache.METRICS_NAME),
+        "rate_limit": metrics.get_all(rate_limit.METRICS_NAME),
+        "image_urls": metrics.get_all(image_urls.METRICS_NAME),
+        "image_variants": metrics.get_all(image_variants.METRICS_NAME),
+    }
+
+
 @frappe.whitelist(allow_guest=True)
+@rate_limited("ping")
 def ping():
     """Simple health check to confirm module is loaded."""
     return "pong"
@@ -2,7 +2,8 @@ import frappe
 from frappe import _
 from frappe.utils import add_days, getdate
 
-from line_integration.utils.line_client import get_settings, push_message
+from line_integration.utils import loyalty_cache
+from line_integration.utils.line_client import get_settings, multicast_message, multicast_sent_count
 from line_integration.api.line_webhook import resolve_public_image_url, format_qty
 from frappe.utils.jinja import render_template
 
@@ -26,7 +27,8 @@ def quick_pay_sales_order(sales_order: str, points_to_redeem: float = 0):
     if not points_to_redeem:
         points_to_redeem = float(so.get("line_loyalty_points") or 0)
 
-    si = _make_sales_invoice(so, points_to_redeem, settings)
+    lp_details = _get_loyalty_details(so.customer, settings) if points_to_redeem else {}
+    si = _make_sales_invoice(so, points_to_redeem, settings, lp_details)
     pe = _make_payment_entry(si, mop)
 
     msg = _("Created Sales Invoice {0} and Payment Entry {1}").format(si.name, pe.name)
@@ -43,23 +45,19 @@ def quick_pay_sales_order(sales_order: str, points_to_redeem: float = 0):
             fields=["line_user_id"],
         )
         if profiles:
-            remaining = 0
-            try:
-                lp_details = _get_loyalty_details(so.customer, settings)
-                remaining = lp_details.get("loyalty_points", 0) or 0
-            except Exception:
-                remaining = 0
+            # From the ledger, including the entries this invoice just made: the cached
+            # balance is only adjusted once this transaction commits
+            remaining = float(_get_ledger_points(so.customer, settings) or 0)
             text = (
                 f"ได้มีการใช้คะแนนสะสม {format_qty(points_used)} แต้ม "
                 f"กับหมายเลขออเดอร์ {so.name}\n"
                 f"คงเหลือ {format_qty(remaining)} แต้ม"
             )
-            for p in profiles:
-                push_message(p.line_user_id, text)
+            multicast_message([p.line_user_id for p in profiles], text)
     return msg
 
 
-def _make_sales_invoice(so, points_to_redeem=0, settings=None):
+def _make_sales_invoice(so, points_to_redeem=0, settings=None, lp_details=None):
     from erpnext.selling.doctype.sales_order.sales_order import make_sales_invoice
 
     si = make_sales_invoice(so.name)
@@ -67,7 +65,7 @@ def _make_sales_invoice(so, points_to_redeem=0, settings=None):
     redemption_account = None
     redemption_cost_center = None
     if points_to_redeem and settings:
-        lp_details = _get_loyalty_details(so.customer, settings) or {}
+        lp_details = lp_details or _get_loyalty_details(so.customer, settings) or {}
         redemption_account = (
             getattr(settings, "redeem_account", None)
             or lp_details.get("loyalty_redemption_account")
@@ -170,10 +168,8 @@ def request_payment(sales_order: str):
         return _("No LINE Profile linked to Customer {0}, nothing sent.").format(so.customer)
 
     messages = [{"type": "text", "text": text}, {"type": "image", "originalContentUrl": qr_url, "previewImageUrl": qr_url}]
-    sent_count = 0
-    for p in profiles:
-        if push_message(p.line_user_id, messages):
-            sent_count += 1
+    results = multicast_message([p.line_user_id for p in profiles], messages)
+    sent_count = multicast_sent_count(results)
 
     return _("Sent payment request to {0} LINE user(s).").format(sent_count)
 
@@ -198,17 +194,26 @@ def get_loyalty_balance(sales_order: str):
 
 
 def _get_loyalty_details(customer, settings):
+    try:
+        return loyalty_cache.get_loyalty_details(customer, settings.loyalty_program) or {}
+    except Exception:
+        return {}
+
+
+def _get_ledger_points(customer, settings):
+    """Uncached balance, which also sees this transaction's uncommitted entries."""
     try:
         from erpnext.accounts.doctype.loyalty_program.loyalty_program import (
             get_loyalty_program_details_with_points,
         )
 
-        return get_loyalty_program_details_with_points(
+        details = get_loyalty_program_details_with_points(
             customer=customer,
             loyalty_program=settings.loyalty_program,
         ) or {}
+        return details.get("loyalty_points", 0)
     except Exception:
-        return {}
+        return 0
 
 
 def _compute_redeem(customer, settings, points_requested, max_amount, lp_details=None):
@@ -290,10 +295,8 @@ def notify_sales_order(sales_order: str):
     lines.append("ขอบคุณที่อุดหนุนนะคะ")
     text = "\n".join(lines)
 
-    sent = 0
-    for p in profiles:
-        if push_message(p.line_user_id, text):
-            sent += 1
+    results = multicast_message([p.line_user_id for p in profiles], text)
+    sent = multicast_sent_count(results)
 
     return _("Sent to {0} LINE user(s).").format(sent)
 
@@ -0,0 +1,68 @@
+"""
+Cart pricing parity and latency: in-process engine vs. simulated Sales Order.
+
+Builds random carts from the menu catalog (including carts above the quantity discount
+threshold), prices each with both paths and reports every total or rate mismatch along
+with per-cart latency. Read-only; nothing is saved.
+
+    bench --site <site> execute line_integration.benchmarks.cart_pricing.run \
+        --kwargs "{'carts': 200, 'customer': 'CUST-0001'}"
+"""
+
+import random
+import statistics
+import time
+
+from frappe.utils import getdate, today
+
+from line_integration.utils import cart_pricing, menu_catalog
+from line_integration.utils.line_client import get_settings
+
+
+def _random_carts(count, seed):
+    rng = random.Random(seed)
+    codes = [item.name for item in menu_catalog.get_menu_items()]
+    carts = []
+    for _ in range(count):
+        size = rng.randint(1, min(6, len(codes)))
+        carts.append([{"item_code": code, "qty": rng.choice([1, 1, 2, 3, 5, 10])} for code in rng.sample(codes, size)])
+    return carts
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run(carts=100, customer=None, seed=7):
+    carts = _random_carts(int(carts), int(seed))
+    if not carts:
+        print({"error": "menu catalog is empty"})
+        return None
+    settings = get_settings()
+    date = getdate(today())
+    engine_ms, order_ms = [], []
+    mismatches, unsupported = [], 0
+    for cart in carts:
+        quote, elapsed = _timed(lambda: cart_pricing._compute_quote(cart, customer, settings, date))
+        engine_ms.append(elapsed)
+        so, elapsed = _timed(lambda: cart_pricing.simulate_sales_order(cart, customer, settings))
+        order_ms.append(elapsed)
+        if not quote:
+            unsupported += 1
+            continue
+        expected = (float(so.grand_total), [float(row.rate) for row in so.items])
+        actual = (float(quote["grand_total"]), [float(line["rate"]) for line in quote["items"]])
+        if actual != expected:
+            mismatches.append({"cart": cart, "engine": actual, "sales_order": expected})
+    result = {
+        "carts": len(carts),
+        "unsupported": unsupported,
+        "mismatches": len(mismatches),
+        "engine_mean_ms": round(statistics.mean(engine_ms), 3),
+        "sales_order_mean_ms": round(statistics.mean(order_ms), 3),
+        "examples": mismatches[:5],
+    }
+    print(result)
+    return result
@@ -0,0 +1,95 @@
+"""
+Payload budget check for `liff_bootstrap`.
+
+Builds bootstrap payloads around synthetic menus and order histories of growing size
+(Thai names and descriptions, as on the live menu) and reports the encoded size before and
+after `fit_payload_budget`, failing loudly if any result exceeds the budget. With
+`customer`, also times the real bootstrap parts of that customer, concurrently (as
+`liff_bootstrap` runs them) and one after another in this connection.
+
+    bench --site <site> execute line_integration.benchmarks.liff_bootstrap.run \
+        --kwargs "{'sizes': [10, 50, 200], 'customer': 'CUST-0001'}"
+"""
+
+import time
+
+from line_integration.api import liff_api
+
+
+def _synthetic_payload(menu_items, orders):
+    menu = [
+        {
+            "item_code": f"ITEM-{n:04d}",
+            "item_name": f"ชาไทยเย็น สูตรพิเศษ {n}",
+            "description": "ชาไทยเข้มข้น หวานน้อย ใส่นมสดและวิปครีม " * 4,
+            "image_url": f"https://example.com/files/menu-{n:04d}.jpg",
+            "price": 65.0,
+            "formatted_price": "฿ 65.00",
+        }
+        for n in range(menu_items)
+    ]
+    history = [
+        {
+            "name": f"SAL-ORD-2025-{n:05d}",
+            "status": "To Deliver and Bill",
+            "grand_total": 390.0,
+            "currency": "THB",
+            "transaction_date": "2025-01-01",
+            "formatted_total": "฿ 390.00",
+            "items": [{"item_name": f"ชาไทยเย็น {k}", "qty": 2, "amount": 130.0, "formatted_qty": "2"} for k in range(6)],
+        }
+        for n in range(orders)
+    ]
+    return {
+        "auth": {"success": True, "user_id": "U" + "0" * 32, "display_name": "ลูกค้า", "is_registered": True},
+        "points": {"points": 120, "points_formatted": "120", "loyalty_program": "Wellie Point"},
+        "menu": {"etag": '"0"', "version": 1, "items": menu, "complete": True},
+        "history": {"orders": history, "next_cursor": None},
+    }
+
+
+def run(sizes=(10, 50, 200), customer=None):
+    budget = liff_api.BOOTSTRAP_PAYLOAD_BUDGET
+    report = []
+    for size in sizes:
+        payload = _synthetic_payload(int(size), liff_api.BOOTSTRAP_HISTORY_SIZE)
+        before = liff_api._payload_size(payload)
+        fitted = liff_api.fit_payload_budget(payload)
+        after = liff_api._payload_size(fitted)
+        report.append(
+            {
+                "menu_items": int(size),
+                "bytes_before": before,
+                "bytes_after": after,
+                "menu_items_kept": len(fitted["menu"]["items"]),
+                "menu_complete": fitted["menu"]["complete"],
+            }
+        )
+        assert after <= budget, f"bootstrap payload {after} B exceeds budget {budget} B"
+
+    if customer:
+        parts = {
+            "menu": (liff_api._bootstrap_menu, (customer,)),
+            "points": (liff_api._bootstrap_points, (customer,)),
+            "history": (liff_api.get_history_page, (customer, None, liff_api.BOOTSTRAP_HISTORY_SIZE)),
+        }
+        started = time.perf_counter()
+        for fn, args in parts.values():
+            fn(*args)
+        serial_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        results = liff_api._run_parts(parts)
+        elapsed = (time.perf_counter() - started) * 1000
+        payload = liff_api.fit_payload_budget({"auth": {"success": True}, **results})
+        report.append(
+            {
+                "customer": customer,
+                "bytes": liff_api._payload_size(payload),
+                "parts_ms": round(elapsed, 2),
+                "serial_ms": round(serial_ms, 2),
+            }
+        )
+
+    for row in report:
+        print(row)
+    return report
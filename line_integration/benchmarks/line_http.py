@@ -0,0 +1,83 @@
+"""
+Per-call latency benchmark: one-off `requests.post` vs. the pooled LINE client.
+
+Starts a local HTTP/1.1 keep-alive server standing in for api.line.me and sends the same
+push payload through both paths. Against the real API the gap is larger, since every
+unpooled call also pays a TLS handshake.
+
+    bench --site <site> execute line_integration.benchmarks.line_http.run --kwargs "{'calls': 500}"
+"""
+
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from line_integration.utils.line_client import line_request
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Avoid Nagle/delayed-ACK stalls on reused connections skewing the pooled numbers
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _measure(send, calls):
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        send()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+    }
+
+
+def run(calls=500):
+    calls = int(calls)
+    server = _start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v2/bot/message/push"
+    payload = {"to": "U" + "0" * 32, "messages": [{"type": "text", "text": "benchmark"}]}
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer benchmark"}
+    try:
+        before = _measure(
+            lambda: requests.post(url, data=json.dumps(payload), headers=headers, timeout=10), calls
+        )
+        after = _measure(
+            lambda: line_request("POST", url, json=payload, headers=headers),
+            calls,
+        )
+    finally:
+        server.shutdown()
+    result = {
+        "calls": calls,
+        "unpooled": before,
+        "pooled": after,
+        "speedup_mean": round(before["mean_ms"] / after["mean_ms"], 2),
+    }
+    print(result)
+    return result
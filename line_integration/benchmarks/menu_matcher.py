@@ -0,0 +1,148 @@
+"""
+Order-name matching benchmark: legacy linear substring scan vs. the indexed MenuMatcher.
+
+Builds a synthetic catalog (Thai and English names, default 1000 items) and a labelled
+corpus of typed names derived from it (numbered prefixes, missing tone marks, typos,
+truncated names). It reports build time, per-lookup latency and accuracy for both
+matchers. An optional file of real order texts (one "<name> จำนวน <qty>" per line) is
+matched too; its names are unlabelled, so only the match rate and latency are reported.
+Pure Python, so it runs with or without a site:
+
+    python -m line_integration.benchmarks.menu_matcher
+    bench --site <site> execute line_integration.benchmarks.menu_matcher.run \
+        --kwargs "{'items': 1000, 'corpus': '/path/to/orders.txt'}"
+"""
+
+import random
+import re
+import statistics
+import time
+
+from line_integration.utils.menu_matcher import MenuMatcher
+
+THAI_WORDS = ["ชา", "เขียว", "นม", "สด", "มะนาว", "ส้ม", "กาแฟ", "เย็น", "ร้อน", "ปั่น", "น้ำผึ้ง", "มะพร้าว", "ไข่มุก", "โกโก้", "ลิ้นจี่", "แตงโม", "สับปะรด", "มะม่วง", "อัญชัน", "เก๊กฮวย"]
+EN_WORDS = ["green", "hug", "bye", "heavy", "glow", "skin", "calm", "kale", "berry", "boost", "detox", "tea", "ice", "latte", "mango", "power", "fresh", "juice", "lemon", "honey"]
+SEPARATOR = re.compile(r"\s*(?:จำนวน|qty)\s*[:\uff1a]?", re.IGNORECASE)
+
+
+def normalize_key(val):
+    # Same as line_webhook.normalize_key, kept local so this runs without Frappe
+    return "".join((val or "").lower().split())
+
+
+def _catalog(count, rng):
+    names = set()
+    while len(names) < count:
+        words = THAI_WORDS if rng.random() < 0.5 else EN_WORDS
+        joiner = "" if words is THAI_WORDS else " "
+        names.add(joiner.join(rng.sample(words, rng.randint(2, 3))))
+    return {normalize_key(name): {"item_name": name} for name in sorted(names)}
+
+
+def _typo(text, rng):
+    if len(text) < 4:
+        return text
+    i = rng.randrange(1, len(text) - 1)
+    return text[:i] + text[i + 1 :] if rng.random() < 0.5 else text[:i] + text[i + 1] + text[i] + text[i + 2 :]
+
+
+def _corpus(item_map, size, rng):
+    """[(typed name, expected key)] with the kinds of variation seen in real orders."""
+    keys = list(item_map)
+    corpus = []
+    for _ in range(size):
+        key = rng.choice(keys)
+        name = item_map[key]["item_name"]
+        kind = rng.random()
+        if kind < 0.3:
+            typed = name
+        elif kind < 0.5:
+            typed = f"{rng.randint(1, 9)} {name}"
+        elif kind < 0.65:
+            typed = re.sub("[็่้๊๋์]", "", name) if re.search("[็่้๊๋์]", name) else name.upper()
+        elif kind < 0.85:
+            typed = _typo(name, rng)
+        else:
+            typed = name + rng.choice(["", " ค่ะ", " x"])
+        corpus.append((typed, key))
+    return corpus
+
+
+def legacy_match(item_map, key):
+    """The previous parse_orders_from_text lookup."""
+    item = item_map.get(key)
+    if item:
+        return key
+    for k in item_map:
+        if k in key or key in k:
+            return k
+    return None
+
+
+def _timed_lookups(fn, names):
+    results, times = [], []
+    for name in names:
+        started = time.perf_counter()
+        results.append(fn(normalize_key(name)))
+        times.append((time.perf_counter() - started) * 1_000_000)
+    return results, times
+
+
+def _summary(times):
+    ordered = sorted(times)
+    return {
+        "mean_us": round(statistics.mean(ordered), 2),
+        "p95_us": round(ordered[int(len(ordered) * 0.95) - 1], 2),
+    }
+
+
+def _read_corpus(path):
+    names = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = SEPARATOR.split(line.strip(), maxsplit=1)
+            if len(parts) == 2 and parts[0]:
+                names.append(re.sub(r"^[\-•\u2013\u2014]\s*", "", parts[0]))
+    return names
+
+
+def run(items=1000, lookups=2000, corpus=None, seed=11):
+    rng = random.Random(int(seed))
+    item_map = _catalog(int(items), rng)
+    labelled = _corpus(item_map, int(lookups), rng)
+    names = [typed for typed, _ in labelled]
+
+    started = time.perf_counter()
+    matcher = MenuMatcher.from_item_map(item_map)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    legacy, legacy_times = _timed_lookups(lambda key: legacy_match(item_map, key), names)
+    indexed, indexed_times = _timed_lookups(lambda key: getattr(matcher.match(key), "key", None), names)
+
+    def accuracy(results):
+        correct = sum(1 for result, (_, expected) in zip(results, labelled, strict=True) if result == expected)
+        return round(correct / len(labelled), 4)
+
+    result = {
+        "items": len(item_map),
+        "lookups": len(labelled),
+        "build_ms": round(build_ms, 2),
+        "legacy": dict(_summary(legacy_times), accuracy=accuracy(legacy), unmatched=legacy.count(None)),
+        "indexed": dict(_summary(indexed_times), accuracy=accuracy(indexed), unmatched=indexed.count(None)),
+    }
+    if corpus:
+        real = _read_corpus(corpus)
+        if real:
+            legacy, legacy_times = _timed_lookups(lambda key: legacy_match(item_map, key), real)
+            indexed, indexed_times = _timed_lookups(lambda key: matcher.match(key), real)
+            result["corpus"] = {
+                "names": len(real),
+                "legacy": dict(_summary(legacy_times), matched=len(real) - legacy.count(None)),
+                "indexed": dict(_summary(indexed_times), matched=len(real) - indexed.count(None)),
+            }
+    print(result)
+    return result
+
+
+if __name__ == "__main__":
+    run()
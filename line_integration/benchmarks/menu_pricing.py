@@ -0,0 +1,110 @@
+"""
+Menu pricing benchmark: per-item `get_item_details` vs. the batched pricing service.
+
+Prices the first N sales items of the site with the previous `liff_get_menu` loop and with
+`pricing.get_menu_prices` (cold cache and warm cache), reporting latency and SQL query
+count per menu size. Read-only; runs against whatever items the site has.
+
+    bench --site <site> execute line_integration.benchmarks.menu_pricing.run \
+        --kwargs "{'sizes': [10, 25, 50], 'rounds': 5}"
+"""
+
+import statistics
+import time
+
+import frappe
+from erpnext.stock.get_item_details import get_item_details
+from frappe.utils import flt, today
+
+from line_integration.utils import pricing
+
+
+def _items(limit):
+    return frappe.get_all(
+        "Item",
+        filters={"disabled": 0, "is_sales_item": 1},
+        fields=["name", "item_name", "standard_rate"],
+        order_by="name asc",
+        limit=limit,
+    )
+
+
+def _legacy_prices(items, customer=None):
+    price_list = None
+    if not customer:
+        price_list = frappe.db.get_single_value("Selling Settings", "selling_price_list")
+    prices = {}
+    for item in items:
+        try:
+            details = get_item_details(
+                {
+                    "item_code": item.name,
+                    "qty": 1,
+                    "customer": customer,
+                    "price_list": price_list,
+                    "company": frappe.db.get_default("Company"),
+                    "transaction_date": today(),
+                }
+            )
+            rate = details.get("price_list_rate") or details.get("rate") or 0
+        except Exception:
+            rate = 0
+        if rate <= 0:
+            rate = frappe.db.get_value(
+                "Item Price", {"item_code": item.name, "price_list": "Standard Selling"}, "price_list_rate"
+            ) or 0
+        if rate <= 0:
+            rate = flt(item.standard_rate)
+        frappe.db.get_default("Currency")
+        prices[item.name] = rate
+    return prices
+
+
+def _measure(fn, rounds, before_each=None):
+    samples = []
+    queries = 0
+    sql = frappe.db.sql
+    counter = {"n": 0}
+
+    def counting_sql(*args, **kwargs):
+        counter["n"] += 1
+        return sql(*args, **kwargs)
+
+    frappe.db.sql = counting_sql
+    try:
+        for _ in range(rounds):
+            if before_each:
+                before_each()
+            counter["n"] = 0
+            started = time.perf_counter()
+            result = fn()
+            samples.append((time.perf_counter() - started) * 1000)
+            queries = counter["n"]
+    finally:
+        frappe.db.sql = sql
+    return {"mean_ms": round(statistics.mean(samples), 2), "queries": queries}, result
+
+
+def run(sizes=(10, 25, 50), rounds=5, customer=None):
+    rounds = int(rounds)
+    report = []
+    for size in sizes:
+        items = _items(int(size))
+        legacy, legacy_prices = _measure(lambda: _legacy_prices(items, customer), rounds)
+        cold, _ = _measure(
+            lambda: pricing.get_menu_prices(items, customer=customer), rounds, before_each=pricing.clear_price_cache
+        )
+        warm, batched_prices = _measure(lambda: pricing.get_menu_prices(items, customer=customer), rounds)
+        mismatches = sorted(code for code in legacy_prices if flt(legacy_prices[code]) != flt(batched_prices.get(code)))
+        report.append(
+            {
+                "items": len(items),
+                "legacy": legacy,
+                "batched_cold": cold,
+                "batched_warm": warm,
+                "price_mismatches": mismatches[:20],
+            }
+        )
+    for row in report:
+        print(row)
+    return report
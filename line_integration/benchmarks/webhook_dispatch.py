@@ -0,0 +1,113 @@
+"""
+Throughput benchmark of the partitioned webhook queue against real Redis.
+
+Pushes synthetic events with `webhook_queue.push_events` and drains them with the same
+`_drain` loop the RQ job runs (locks, LMOVE onto the processing list, acknowledgement,
+metrics, commit). Only `handle_event` is replaced, by a fixed I/O latency, so nothing is
+sent to LINE. Compares one worker draining every partition in turn with `workers`
+threads draining partitions in parallel, and checks that each user's events are still
+handled in order.
+
+The queue keys are shared with production, so it refuses to run while async webhook
+processing is enabled or events are pending. Run it on a development site:
+
+    bench --site <site> execute line_integration.benchmarks.webhook_dispatch.run \
+        --kwargs "{'events': 2000, 'users': 200, 'workers': 8}"
+"""
+
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+
+from line_integration.utils import webhook_queue
+from line_integration.utils.line_client import get_settings
+
+
+def _make_events(count, users):
+    return [
+        {
+            "type": "message",
+            "source": {"type": "user", "userId": f"U{n % users:032d}"},
+            "message": {"type": "text", "text": str(n)},
+            "seq": n,
+        }
+        for n in range(count)
+    ]
+
+
+def _handler(handler_ms, seen, lock):
+    def handle(event, settings):
+        time.sleep(handler_ms / 1000.0)
+        with lock:
+            seen[webhook_queue.partition_key(event)].append(event["seq"])
+
+    return handle
+
+
+def _drain_all(partitions, handle, settings):
+    for partition in partitions:
+        token = uuid.uuid4().hex
+        if webhook_queue._acquire_lock(partition, token):
+            webhook_queue._drain(partition, token, handle, settings)
+
+
+def _drain_in_thread(site, partitions, handle, settings):
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        _drain_all(partitions, handle, settings)
+    finally:
+        frappe.destroy()
+
+
+def _run_once(batch, handler_ms, workers, settings):
+    seen, lock = defaultdict(list), threading.Lock()
+    handle = _handler(handler_ms, seen, lock)
+
+    started = time.perf_counter()
+    touched = sorted(webhook_queue.push_events(batch, settings))
+    push_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if workers <= 1:
+        _drain_all(touched, handle, settings)
+    else:
+        site = frappe.local.site
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            shares = [touched[n::workers] for n in range(workers)]
+            list(pool.map(lambda share: _drain_in_thread(site, share, handle, settings), shares))
+    return push_time, time.perf_counter() - started, seen
+
+
+def _in_order(seen):
+    return all(seq == sorted(seq) for seq in seen.values())
+
+
+def run(events=2000, users=200, workers=8, handler_ms=5):
+    settings = get_settings()
+    if webhook_queue.is_async_enabled(settings) or webhook_queue.get_stats(settings).get("pending"):
+        frappe.throw("Disable Async Webhook Processing and let the queue drain before benchmarking.")
+
+    batch = _make_events(int(events), int(users))
+    push_time, serial_time, serial_seen = _run_once(batch, handler_ms, 1, settings)
+    _, parallel_time, parallel_seen = _run_once(batch, handler_ms, int(workers), settings)
+    result = {
+        "events": len(batch),
+        "users": int(users),
+        "workers": int(workers),
+        "partitions": webhook_queue.get_partition_count(settings),
+        "handler_ms": handler_ms,
+        "push_us_per_event": round(push_time / len(batch) * 1_000_000, 1),
+        "serial_events_per_sec": round(len(batch) / serial_time, 1),
+        "partitioned_events_per_sec": round(len(batch) / parallel_time, 1),
+        "speedup": round(serial_time / parallel_time, 2),
+        "per_user_order_preserved": _in_order(serial_seen) and _in_order(parallel_seen),
+        "all_handled": sum(map(len, serial_seen.values())) == len(batch)
+        and sum(map(len, parallel_seen.values())) == len(batch),
+    }
+    print(result)
+    return result
@@ -8,7 +8,124 @@ app_license = "mit"
 doc_events = {
 	"Delivery Note": {
 		"on_submit": "line_integration.line_integration.events.delivery_note.send_line_notification"
-	}
+	},
+	"Loyalty Point Entry": {
+		"after_insert": "line_integration.utils.loyalty_cache.on_entry_insert",
+		"on_trash": "line_integration.utils.loyalty_cache.on_entry_trash",
+	},
+	"Sales Invoice": {
+		"on_cancel": "line_integration.utils.loyalty_cache.on_invoice_cancel",
+	},
+	"Loyalty Program": {
+		"on_update": "line_integration.utils.loyalty_cache.on_program_change",
+		"on_trash": "line_integration.utils.loyalty_cache.on_program_change",
+	},
+	"Item": {
+		"on_update": [
+			"line_integration.utils.menu_catalog.on_item_change",
+			"line_integration.utils.image_variants.on_item_change",
+			"line_integration.utils.cart_pricing.clear_cache",
+		],
+		"on_trash": [
+			"line_integration.utils.menu_catalog.on_item_change",
+			"line_integration.utils.cart_pricing.clear_cache",
+		],
+		"after_rename": "line_integration.utils.menu_catalog.on_item_change",
+	},
+	"File": {
+		"on_update": [
+			"line_integration.utils.image_urls.on_file_change",
+			"line_integration.utils.menu_catalog.on_file_change",
+		],
+		"on_trash": [
+			"line_integration.utils.image_urls.on_file_change",
+			"line_integration.utils.menu_catalog.on_file_change",
+		],
+	},
+	"Item Price": {
+		"on_update": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+			"line_integration.utils.menu_publisher.schedule_publish",
+		],
+		"on_trash": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+			"line_integration.utils.menu_publisher.schedule_publish",
+		],
+	},
+	"Pricing Rule": {
+		"on_update": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+			"line_integration.utils.menu_publisher.schedule_publish",
+		],
+		"on_trash": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+			"line_integration.utils.menu_publisher.schedule_publish",
+		],
+	},
+	"Sales Taxes and Charges Template": {
+		"on_update": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+		],
+		"on_trash": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+		],
+	},
+	"Tax Rule": {
+		"on_update": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+		],
+		"on_trash": [
+			"line_integration.utils.pricing.clear_price_cache",
+			"line_integration.utils.cart_pricing.clear_cache",
+		],
+	},
+	"Item Group": {
+		"on_update": "line_integration.utils.cart_pricing.clear_cache",
+		"on_trash": "line_integration.utils.cart_pricing.clear_cache",
+	},
+	"Item Tax Template": {
+		"on_update": "line_integration.utils.cart_pricing.clear_cache",
+		"on_trash": "line_integration.utils.cart_pricing.clear_cache",
+	},
+	"Customer": {
+		"on_update": "line_integration.utils.pricing.on_customer_change",
+		"on_trash": "line_integration.utils.pricing.on_customer_change",
+	},
+	"Customer Group": {
+		"on_update": "line_integration.utils.pricing.clear_customer_cache",
+		"on_trash": "line_integration.utils.pricing.clear_customer_cache",
+	},
+	"Selling Settings": {
+		"on_update": "line_integration.utils.pricing.clear_customer_cache",
+	},
+	"LINE Settings": {
+		"on_update": "line_integration.utils.rate_limit.clear_cache",
+	},
+}
+
+scheduler_events = {
+	"all": [
+		"line_integration.utils.webhook_queue.kick_stalled_partitions",
+	],
+	"hourly": [
+		"line_integration.utils.loyalty_cache.reconcile_balances",
+	],
+	"daily": [
+		"line_integration.utils.menu_publisher.schedule_publish",
+	],
+	"cron": {
+		"* * * * *": [
+			"line_integration.utils.outbound_queue.process_due_messages",
+			"line_integration.utils.line_client.flush_profile_activity",
+		],
+	},
 }
 
 fixtures = [
@@ -21,9 +138,12 @@ fixtures = [
 				[
 					"custom_add_in_line_menu",
 					"custom_line_menu_image",
+					"custom_line_menu_image_variants",
+					"custom_line_menu_aliases",
 					"line_order_note",
 					"line_loyalty_points",
 					"line_loyalty_amount",
+					"line_idempotency_key",
 				],
 			]
 		],
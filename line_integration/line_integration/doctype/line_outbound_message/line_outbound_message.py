@@ -0,0 +1,5 @@
+from frappe.model.document import Document
+
+
+class LINEOutboundMessage(Document):
+    pass
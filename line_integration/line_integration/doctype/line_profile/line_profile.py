@@ -6,3 +6,9 @@ class LINEProfile(Document):
     def validate(self):
         if not self.line_user_id:
             frappe.throw("LINE User ID is required.")
+
+    def on_update(self):
+        # This save already wrote the latest activity; a later flush must not replace it
+        from line_integration.utils.line_client import forget_profile_activity
+
+        forget_profile_activity(self.line_user_id)
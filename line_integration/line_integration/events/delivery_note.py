@@ -1,6 +1,11 @@
 import frappe
 
-from line_integration.utils.line_client import get_settings, push_message
+from line_integration.utils.line_client import (
+    get_settings,
+    multicast_message,
+    multicast_sent_count,
+    push_message,
+)
 
 
 def send_line_notification(doc, method=None):
@@ -19,10 +24,8 @@ def send_line_notification(doc, method=None):
         )
         fallback_user_id = frappe.db.get_value("Customer", doc.customer, "custom_line_user_id")
 
-        sent = False
-        for p in profiles:
-            if push_message(p.line_user_id, text):
-                sent = True
+        results = multicast_message([p.line_user_id for p in profiles], text)
+        sent = multicast_sent_count(results) > 0
         if not sent and fallback_user_id:
             push_message(fallback_user_id, text)
     except Exception:
@@ -0,0 +1,19 @@
+frappe.query_reports["Unmatched LINE Menu Names"] = {
+	filters: [
+		{
+			fieldname: "min_count",
+			label: __("Minimum Times"),
+			fieldtype: "Int",
+			default: 1,
+		},
+	],
+	onload(report) {
+		report.page.add_inner_button(__("Clear"), () => {
+			frappe.confirm(__("Reset all unmatched name counts?"), () => {
+				frappe
+					.call("line_integration.utils.menu_aliases.clear_unmatched")
+					.then(() => report.refresh());
+			});
+		});
+	},
+};
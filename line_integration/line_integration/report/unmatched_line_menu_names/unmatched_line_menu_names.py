@@ -0,0 +1,41 @@
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from line_integration.utils import menu_aliases, menu_catalog
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    min_count = cint(filters.get("min_count")) or 1
+    matcher = menu_catalog.get_matcher()
+
+    data = []
+    for row in menu_aliases.get_unmatched():
+        if row["count"] < min_count or matcher.match(row["key"]):
+            # Matches now thanks to an alias or rename; the next catalog rebuild forgets it
+            continue
+        suggestion = matcher.candidates(row["key"], limit=1)
+        best = suggestion[0] if suggestion else None
+        data.append(
+            {
+                "typed_name": row["name"],
+                "count": row["count"],
+                "last_seen": row["last_seen"],
+                "suggested_item": best.item.name if best else None,
+                "suggested_item_name": best.item.item_name if best else None,
+                "score": best.score if best else None,
+            }
+        )
+    return get_columns(), data
+
+
+def get_columns():
+    return [
+        {"label": _("Typed Name"), "fieldname": "typed_name", "fieldtype": "Data", "width": 220},
+        {"label": _("Times"), "fieldname": "count", "fieldtype": "Int", "width": 80},
+        {"label": _("Last Seen"), "fieldname": "last_seen", "fieldtype": "Datetime", "width": 160},
+        {"label": _("Closest Item"), "fieldname": "suggested_item", "fieldtype": "Link", "options": "Item", "width": 160},
+        {"label": _("Item Name"), "fieldname": "suggested_item_name", "fieldtype": "Data", "width": 200},
+        {"label": _("Similarity"), "fieldname": "score", "fieldtype": "Float", "precision": 2, "width": 100},
+    ]
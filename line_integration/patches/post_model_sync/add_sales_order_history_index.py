@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+    # Keyset pagination of LIFF order history: customer + (transaction_date, creation, name)
+    frappe.db.add_index(
+        "Sales Order",
+        ["customer", "transaction_date", "creation", "name"],
+        index_name="line_customer_history_index",
+    )
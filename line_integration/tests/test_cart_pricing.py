@@ -0,0 +1,195 @@
+"""
+Parity of the in-process cart engine (`quote_cart`) with a simulated Sales Order.
+
+    bench --site <site> run-tests --app line_integration --module line_integration.tests.test_cart_pricing
+"""
+
+import unittest
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+
+from line_integration.utils import cart_pricing, menu_catalog, pricing
+
+PRICE_LIST = "_Test LINE Cart Selling"
+ITEM_GROUP = "_Test LINE Cart Group"
+JUICE_GROUP = "_Test LINE Cart Juices"
+CUSTOMER_GROUP = "_Test LINE Cart Customers"
+CUSTOMER = "_Test LINE Cart Customer"
+TEA = "_Test LINE Cart Tea"
+COFFEE = "_Test LINE Cart Coffee"
+JUICE = "_Test LINE Cart Juice"
+BASE_PRICES = {TEA: 45, COFFEE: 60, JUICE: 55}
+
+
+def _settings(**values):
+    settings = frappe._dict(enable_qty_discount=0, qty_discount_threshold=0, qty_price_regular=0, qty_price_discount=0)
+    settings.update(values)
+    return settings
+
+
+def _insert(values):
+    name = values.get("name") or values.get("item_code") or values.get("item_group_name") or values.get("customer_group_name")
+    if name and frappe.db.exists(values["doctype"], name):
+        return frappe.get_doc(values["doctype"], name)
+    return frappe.get_doc(values).insert(ignore_permissions=True)
+
+
+def _reset_caches():
+    pricing.clear_customer_cache()
+    cart_pricing.clear_cache()
+    frappe.cache().delete_keys("line_cart_quote:")
+    # Readers rebuild the catalog for the next version
+    menu_catalog._set_version(menu_catalog._current_version() + 1)
+
+
+class TestCartPricing(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = frappe.db.get_default("Company")
+        if not cls.company:
+            raise unittest.SkipTest("No default company")
+        cls.currency = frappe.get_cached_value("Company", cls.company, "default_currency")
+
+        _insert({"doctype": "Price List", "price_list_name": PRICE_LIST, "name": PRICE_LIST, "selling": 1, "currency": cls.currency, "enabled": 1})
+        for group in (ITEM_GROUP, JUICE_GROUP):
+            _insert({"doctype": "Item Group", "item_group_name": group, "parent_item_group": "All Item Groups"})
+        _insert({"doctype": "Customer Group", "customer_group_name": CUSTOMER_GROUP, "parent_customer_group": "All Customer Groups"})
+        for code, rate in BASE_PRICES.items():
+            _insert(
+                {
+                    "doctype": "Item",
+                    "item_code": code,
+                    "item_name": code,
+                    "item_group": JUICE_GROUP if code == JUICE else ITEM_GROUP,
+                    "stock_uom": "Nos",
+                    "is_stock_item": 0,
+                    "custom_add_in_line_menu": 1,
+                }
+            )
+            _insert({"doctype": "Item Price", "item_code": code, "price_list": PRICE_LIST, "price_list_rate": rate})
+        _insert(
+            {
+                "doctype": "Customer",
+                "name": CUSTOMER,
+                "customer_name": CUSTOMER,
+                "customer_group": CUSTOMER_GROUP,
+                "default_price_list": PRICE_LIST,
+            }
+        )
+        _reset_caches()
+        if not cart_pricing._load_taxes(cls.company)["supported"]:
+            raise unittest.SkipTest("The default sales taxes of this site are not modelled by the engine")
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        _reset_caches()
+
+    def setUp(self):
+        _reset_caches()
+
+    def _add(self, values):
+        doc = frappe.get_doc(values).insert(ignore_permissions=True)
+        self.addCleanup(frappe.delete_doc, doc.doctype, doc.name, force=True, ignore_permissions=True)
+        _reset_caches()
+        return doc
+
+    def _rule(self, items=None, **values):
+        rule = {
+            "doctype": "Pricing Rule",
+            "title": f"_Test LINE Cart Rule {frappe.generate_hash(length=6)}",
+            "apply_on": "Item Code",
+            "items": [{"item_code": code} for code in items or []],
+            "selling": 1,
+            "price_or_product_discount": "Price",
+            "company": self.company,
+            "currency": self.currency,
+        }
+        rule.update(values)
+        return self._add(rule)
+
+    def assertParity(self, cart, settings=None):
+        settings = settings or _settings()
+        quote = cart_pricing.quote_cart(cart, customer=CUSTOMER, settings=settings)
+        self.assertIsNotNone(quote, "engine fell back for a supported cart")
+        so = cart_pricing.simulate_sales_order(cart, customer=CUSTOMER, settings=settings)
+        self.assertEqual([flt(line["rate"]) for line in quote["items"]], [flt(row.rate) for row in so.items])
+        self.assertEqual(flt(quote["total"]), flt(so.total))
+        self.assertEqual(flt(quote["grand_total"]), flt(so.grand_total))
+        return quote
+
+    def test_price_list_rates(self):
+        quote = self.assertParity([{"item_code": TEA, "qty": 2}, {"item_code": COFFEE, "qty": 1}])
+        self.assertEqual([line["rate"] for line in quote["items"]], [45, 60])
+
+    def test_customer_item_price(self):
+        self._add({"doctype": "Item Price", "item_code": TEA, "price_list": PRICE_LIST, "price_list_rate": 40, "customer": CUSTOMER})
+        quote = self.assertParity([{"item_code": TEA, "qty": 1}, {"item_code": COFFEE, "qty": 1}])
+        self.assertEqual(quote["items"][0]["rate"], 40)
+
+    def test_rate_rule_on_parent_customer_group(self):
+        self._rule([COFFEE], rate_or_discount="Rate", rate=42, applicable_for="Customer Group", customer_group="All Customer Groups")
+        quote = self.assertParity([{"item_code": COFFEE, "qty": 2}])
+        self.assertEqual(quote["items"][0]["rate"], 42)
+
+    def test_discount_percentage_rule(self):
+        self._rule([TEA], rate_or_discount="Discount Percentage", discount_percentage=10, applicable_for="Customer", customer=CUSTOMER)
+        quote = self.assertParity([{"item_code": TEA, "qty": 3}, {"item_code": JUICE, "qty": 1}])
+        self.assertEqual(quote["items"][0]["rate"], 40.5)
+
+    def test_discount_amount_rule_with_min_qty(self):
+        self._rule([JUICE], rate_or_discount="Discount Amount", discount_amount=5, min_qty=3)
+        below = self.assertParity([{"item_code": JUICE, "qty": 2}])
+        above = self.assertParity([{"item_code": JUICE, "qty": 3}])
+        self.assertEqual((below["items"][0]["rate"], above["items"][0]["rate"]), (55, 50))
+
+    def test_line_quantity_discount(self):
+        settings = _settings(enable_qty_discount=1, qty_discount_threshold=3, qty_price_discount=39)
+        quote = self.assertParity([{"item_code": TEA, "qty": 2}, {"item_code": COFFEE, "qty": 2}], settings)
+        self.assertEqual([line["rate"] for line in quote["items"]], [39, 39])
+
+    def test_unsupported_rule_only_affects_touched_items(self):
+        self._rule(
+            apply_on="Item Group",
+            item_groups=[{"item_group": JUICE_GROUP}],
+            rate_or_discount="Discount Percentage",
+            discount_percentage=5,
+        )
+        cart = [{"item_code": JUICE, "qty": 1}, {"item_code": TEA, "qty": 1}]
+        self.assertIsNone(cart_pricing.quote_cart(cart, customer=CUSTOMER, settings=_settings()))
+        self.assertParity([{"item_code": TEA, "qty": 1}, {"item_code": COFFEE, "qty": 2}])
+
+    def test_item_tax_template_falls_back(self):
+        account = frappe.db.get_value("Account", {"company": self.company, "account_type": "Tax", "is_group": 0})
+        if not account:
+            self.skipTest("No tax account")
+        template = self._add(
+            {
+                "doctype": "Item Tax Template",
+                "title": f"_Test LINE Cart Tax {frappe.generate_hash(length=6)}",
+                "company": self.company,
+                "taxes": [{"tax_type": account, "tax_rate": 7}],
+            }
+        )
+        self._set_item_taxes(JUICE, [{"item_tax_template": template.name}])
+        self.addCleanup(self._set_item_taxes, JUICE, [])
+        _reset_caches()
+
+        self.assertIsNone(cart_pricing.quote_cart([{"item_code": JUICE, "qty": 1}], customer=CUSTOMER, settings=_settings()))
+        self.assertParity([{"item_code": TEA, "qty": 1}])
+
+    @staticmethod
+    def _set_item_taxes(item_code, taxes):
+        item = frappe.get_doc("Item", item_code)
+        item.set("taxes", taxes)
+        item.save(ignore_permissions=True)
+
+    def test_customer_tax_category_falls_back(self):
+        category = _insert({"doctype": "Tax Category", "title": "_Test LINE Cart Category", "name": "_Test LINE Cart Category"})
+        frappe.db.set_value("Customer", CUSTOMER, "tax_category", category.name)
+        self.addCleanup(frappe.db.set_value, "Customer", CUSTOMER, "tax_category", None)
+        _reset_caches()
+        self.assertIsNone(cart_pricing.quote_cart([{"item_code": TEA, "qty": 1}], customer=CUSTOMER, settings=_settings()))
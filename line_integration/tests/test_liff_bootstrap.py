@@ -0,0 +1,108 @@
+"""
+Payload budget of `liff_bootstrap`.
+
+    bench --site <site> run-tests --app line_integration --module line_integration.tests.test_liff_bootstrap
+"""
+
+from frappe.tests.utils import FrappeTestCase
+
+from line_integration.api import liff_api
+
+BUDGET = liff_api.BOOTSTRAP_PAYLOAD_BUDGET
+
+
+def _payload(menu_items=10, orders=liff_api.BOOTSTRAP_HISTORY_SIZE, display_name="ลูกค้า"):
+    return {
+        "auth": {
+            "success": True,
+            "user_id": "U" + "0" * 32,
+            "display_name": display_name,
+            "picture_url": "https://profile.line-scdn.net/0h" + "a" * 60,
+            "is_registered": True,
+            "customer_name": "ลูกค้า LINE",
+            "customer_id": "CUST-0001",
+            "phone": "0812345678",
+        },
+        "points": {"points": 120, "points_formatted": "120", "loyalty_program": "Wellie Point"},
+        "menu": {
+            "etag": '"0"',
+            "version": 1,
+            "complete": True,
+            "items": [
+                {
+                    "item_code": f"ITEM-{n:04d}",
+                    "item_name": f"ชาไทยเย็น สูตรพิเศษ {n}",
+                    "description": "ชาไทยเข้มข้น หวานน้อย ใส่นมสดและวิปครีม " * 4,
+                    "image_url": f"https://example.com/files/menu-{n:04d}.jpg",
+                    "price": 65.0,
+                    "formatted_price": "฿ 65.00",
+                }
+                for n in range(menu_items)
+            ],
+        },
+        "history": {
+            "next_cursor": None,
+            "orders": [
+                {
+                    "name": f"SAL-ORD-2025-{n:05d}",
+                    "status": "To Deliver and Bill",
+                    "grand_total": 390.0,
+                    "formatted_total": "฿ 390.00",
+                    "items": [{"item_name": f"ชาไทยเย็น {k}", "qty": 2, "amount": 130.0} for k in range(6)],
+                }
+                for n in range(orders)
+            ],
+        },
+    }
+
+
+class TestBootstrapPayloadBudget(FrappeTestCase):
+    def assertWithinBudget(self, payload, budget=BUDGET):
+        self.assertLessEqual(liff_api._payload_size(payload), budget)
+
+    def test_small_payload_is_untouched(self):
+        payload = _payload(menu_items=5)
+        expected = liff_api._payload_size(payload)
+        fitted = liff_api.fit_payload_budget(payload)
+        self.assertEqual(liff_api._payload_size(fitted), expected)
+        self.assertTrue(fitted["menu"]["complete"])
+
+    def test_descriptions_are_dropped_first(self):
+        stripped = _payload(menu_items=200)
+        for item in stripped["menu"]["items"]:
+            del item["description"]
+        budget = liff_api._payload_size(stripped) + 100
+        fitted = liff_api.fit_payload_budget(_payload(menu_items=200), budget)
+        self.assertWithinBudget(fitted, budget)
+        self.assertEqual(len(fitted["menu"]["items"]), 200)
+        self.assertTrue(fitted["menu"]["complete"])
+        self.assertNotIn("description", fitted["menu"]["items"][0])
+
+    def test_large_menu_is_truncated_and_marked_incomplete(self):
+        fitted = liff_api.fit_payload_budget(_payload(menu_items=2000))
+        self.assertWithinBudget(fitted)
+        self.assertFalse(fitted["menu"]["complete"])
+        self.assertIsNone(fitted["menu"]["etag"])
+        self.assertTrue(fitted["auth"]["success"])
+
+    def test_parts_are_dropped_when_trimming_is_not_enough(self):
+        fitted = liff_api.fit_payload_budget(_payload(menu_items=50), budget=1000)
+        self.assertWithinBudget(fitted, 1000)
+        self.assertIsNone(fitted["history"])
+        self.assertEqual(fitted["menu"]["items"], [])
+        self.assertFalse(fitted["menu"]["complete"])
+        self.assertEqual(fitted["auth"]["display_name"], "ลูกค้า")
+
+    def test_oversized_profile_keeps_identifying_fields(self):
+        fitted = liff_api.fit_payload_budget(_payload(display_name="ก" * BUDGET))
+        self.assertWithinBudget(fitted)
+        self.assertEqual(set(fitted["auth"]), set(liff_api.BOOTSTRAP_AUTH_FIELDS))
+        self.assertTrue(fitted["auth"]["success"])
+        self.assertIsNone(fitted["points"])
+
+    def test_budget_holds_even_for_an_oversized_identity(self):
+        payload = _payload()
+        payload["auth"]["user_id"] = "U" * BUDGET
+        fitted = liff_api.fit_payload_budget(payload)
+        self.assertWithinBudget(fitted)
+        self.assertFalse(fitted["auth"]["success"])
@@ -0,0 +1,38 @@
+"""
+Conditional GET handling of the LIFF menu endpoints.
+
+    bench --site <site> run-tests --app line_integration --module line_integration.tests.test_menu_validators
+"""
+
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from line_integration.api import liff_api
+
+ETAG = '"abc"'
+LAST_MODIFIED = 1_700_000_000
+
+
+def _not_modified(**headers):
+    with patch.object(frappe, "request", SimpleNamespace(headers=headers), create=True):
+        return liff_api._not_modified(ETAG, LAST_MODIFIED)
+
+
+class TestMenuValidators(FrappeTestCase):
+    def test_matching_etag(self):
+        self.assertTrue(_not_modified(**{"If-None-Match": f'"other", {ETAG}'}))
+        self.assertFalse(_not_modified(**{"If-None-Match": '"other"'}))
+
+    def test_if_modified_since(self):
+        self.assertTrue(_not_modified(**{"If-Modified-Since": "Wed, 15 Nov 2023 00:00:00 GMT"}))
+        self.assertFalse(_not_modified(**{"If-Modified-Since": "Sun, 01 Jan 2023 00:00:00 GMT"}))
+
+    def test_garbage_if_modified_since_is_treated_as_modified(self):
+        for value in ("garbage", "Wed, 99 Foo 2023", "0", " "):
+            self.assertFalse(_not_modified(**{"If-Modified-Since": value}), value)
+
+    def test_no_validators(self):
+        self.assertFalse(_not_modified())
@@ -0,0 +1,395 @@
+"""
+In-process cart pricing for LIFF.
+
+Prices a cart the way a Sales Order would (the `build_so_items` quantity discount, item
+prices, item-level pricing rules and the default "On Net Total" taxes) from cached
+tables, without instantiating a Sales Order. Quotes are memoized per cart signature.
+
+Setups the engine cannot model exactly make `quote_cart` return None, and callers then
+fall back to `simulate_sales_order`. Most are scoped to the carts they touch: items under
+a group/brand rule, a rule with conditions, product discounts or margins, items with an
+Item Tax Template, items outside the menu and ambiguous rule priorities. Customers with a
+tax category fall back for every cart, and so does everyone when there are tax rules,
+non "On Net Total" taxes or transaction-level rules. `tests/test_cart_pricing.py` checks
+that both paths agree, and `benchmarks/cart_pricing.py` compares them on real data.
+"""
+
+import hashlib
+import json
+
+import frappe
+from frappe.utils import add_days, cint, flt, getdate, today
+
+from line_integration.utils import menu_catalog, metrics
+from line_integration.utils.pricing import (
+    _query_prices,
+    get_customer_pricing,
+    get_price_version,
+    get_selling_defaults,
+)
+
+METRICS_NAME = "cart_pricing"
+RULES_CACHE_KEY = "line_cart_pricing_rules"
+TAX_CACHE_KEY = "line_cart_taxes"
+LIST_RATE_CACHE_KEY = "line_cart_list_rates"
+QUOTE_CACHE_KEY = "line_cart_quote:{0}"
+QUOTE_CACHE_TTL = 600
+# Bumped by clear_cache, so memoized quotes never outlive the tables they were priced from
+VERSION_KEY = "line_cart_pricing_version"
+SUPPORTED_APPLICABLE_FOR = ("", "Customer", "Customer Group")
+ITEM_TAXES_FIELD = "__item_taxes"
+
+
+def _precision():
+    return cint(frappe.db.get_default("currency_precision")) or 2
+
+
+def _is_supported_rule(rule):
+    return (
+        rule.apply_on == "Item Code"
+        and rule.price_or_product_discount == "Price"
+        and not (rule.condition or "").strip()
+        and not rule.mixed_conditions
+        and not rule.is_cumulative
+        and not rule.coupon_code_based
+        and not rule.apply_multiple_pricing_rules
+        and not rule.apply_rule_on_other
+        and not flt(rule.margin_rate_or_amount)
+        and (rule.applicable_for or "") in SUPPORTED_APPLICABLE_FOR
+    )
+
+
+def _rule_children(doctype, field, rule_names):
+    """{pricing rule: [value, ...]} from one of the Pricing Rule child tables."""
+    values = {}
+    if rule_names:
+        for row in frappe.get_all(doctype, filters={"parent": ["in", rule_names]}, fields=["parent", field]):
+            values.setdefault(row.parent, []).append(row.get(field))
+    return values
+
+
+def _menu_items_in(field, values):
+    """Menu item codes whose `field` (item_group with descendants, or brand) is in `values`."""
+    values = [value for value in values if value]
+    if not values:
+        return []
+    if field == "item_group":
+        groups = set(values)
+        for group in values:
+            bounds = frappe.db.get_value("Item Group", group, ["lft", "rgt"])
+            if bounds and bounds[0]:
+                groups.update(
+                    frappe.get_all(
+                        "Item Group", filters={"lft": [">=", bounds[0]], "rgt": ["<=", bounds[1]]}, pluck="name"
+                    )
+                )
+        values = list(groups)
+    return frappe.get_all(
+        "Item", filters={"custom_add_in_line_menu": 1, field: ["in", values]}, pluck="name"
+    )
+
+
+def _load_rules(date):
+    """Selling rules valid on `date`, as {"by_item", "unsupported_items", "transaction"}.
+
+    `by_item` holds the rules the engine models, per item code. Items touched by any other
+    rule are listed in `unsupported_items`; `transaction` is set when a transaction-level
+    rule exists, which can touch every cart.
+    """
+    cache = frappe.cache()
+    table = cache.hget(RULES_CACHE_KEY, str(date))
+    if table is not None and "unsupported_items" in table:
+        return table
+    rules = frappe.db.sql(
+        """
+        SELECT name, apply_on, price_or_product_discount, rate_or_discount, rate,
+            discount_percentage, discount_amount, currency, for_price_list, company,
+            applicable_for, customer, customer_group, min_qty, max_qty, priority,
+            `condition`, mixed_conditions, is_cumulative, coupon_code_based,
+            apply_multiple_pricing_rules, apply_rule_on_other, margin_type, margin_rate_or_amount
+        FROM `tabPricing Rule`
+        WHERE disable = 0
+          AND selling = 1
+          AND IFNULL(valid_from, '2000-01-01') <= %(date)s
+          AND IFNULL(valid_upto, '2500-12-31') >= %(date)s
+        """,
+        {"date": date},
+        as_dict=True,
+    )
+    names = [rule.name for rule in rules]
+    item_codes = _rule_children("Pricing Rule Item Code", "item_code", names)
+    item_groups = _rule_children("Pricing Rule Item Group", "item_group", names)
+    brands = _rule_children("Pricing Rule Brand", "brand", names)
+
+    by_item = {}
+    unsupported = set()
+    transaction = False
+    for rule in rules:
+        if rule.apply_on == "Transaction":
+            transaction = True
+        elif _is_supported_rule(rule):
+            for code in item_codes.get(rule.name, []):
+                by_item.setdefault(code, []).append(rule)
+        elif rule.apply_on == "Item Group":
+            unsupported.update(_menu_items_in("item_group", item_groups.get(rule.name, [])))
+        elif rule.apply_on == "Brand":
+            unsupported.update(_menu_items_in("brand", brands.get(rule.name, [])))
+        else:
+            unsupported.update(item_codes.get(rule.name, []))
+    table = {"by_item": by_item, "unsupported_items": sorted(unsupported), "transaction": transaction}
+    cache.hset(RULES_CACHE_KEY, str(date), table)
+    return table
+
+
+def _load_item_taxes():
+    """Menu item codes with an Item Tax Template on the item or on its item group."""
+    cache = frappe.cache()
+    codes = cache.hget(TAX_CACHE_KEY, ITEM_TAXES_FIELD)
+    if codes is not None:
+        return codes
+    rows = frappe.get_all("Item Tax", filters={"parenttype": ["in", ["Item", "Item Group"]]}, fields=["parenttype", "parent"])
+    codes = {row.parent for row in rows if row.parenttype == "Item"}
+    codes.update(_menu_items_in("item_group", [row.parent for row in rows if row.parenttype == "Item Group"]))
+    codes = sorted(codes)
+    cache.hset(TAX_CACHE_KEY, ITEM_TAXES_FIELD, codes)
+    return codes
+
+
+def _load_taxes(company):
+    """{"supported": bool, "rows": [...]} for the company's default sales taxes template."""
+    cache = frappe.cache()
+    field = company or ""
+    taxes = cache.hget(TAX_CACHE_KEY, field)
+    if taxes is not None:
+        return taxes
+    rows = []
+    supported = not frappe.db.exists("Tax Rule", {"tax_type": "Sales"})
+    template = frappe.db.get_value(
+        "Sales Taxes and Charges Template", {"is_default": 1, "disabled": 0, "company": company}, "name"
+    )
+    if supported and template:
+        rows = frappe.get_all(
+            "Sales Taxes and Charges",
+            filters={"parent": template, "parenttype": "Sales Taxes and Charges Template"},
+            fields=["charge_type", "rate", "included_in_print_rate"],
+            order_by="idx asc",
+        )
+        inclusive = {bool(row.included_in_print_rate) for row in rows}
+        supported = all(row.charge_type == "On Net Total" for row in rows) and len(inclusive) <= 1
+    taxes = {"supported": supported, "rows": rows}
+    cache.hset(TAX_CACHE_KEY, field, taxes)
+    return taxes
+
+
+def _list_rates(item_codes, price_list, customer, date):
+    """{item_code: price_list_rate} as a Sales Order would fetch it (no fallbacks)."""
+    cache = frappe.cache()
+    field = f"{price_list}|{date}"
+    cached = cache.hget(LIST_RATE_CACHE_KEY, field) or {}
+    missing = [code for code in item_codes if code not in cached]
+    if missing:
+        found = _query_prices(missing, [price_list], date)
+        for code in missing:
+            cached[code] = found.get((price_list, code)) or 0
+        cache.hset(LIST_RATE_CACHE_KEY, field, cached)
+    rates = {code: cached.get(code, 0) for code in item_codes}
+    if customer:
+        for (_, code), rate in _query_prices(item_codes, [price_list], date, customer=customer).items():
+            rates[code] = rate
+    return rates
+
+
+def _rule_applies(rule, qty, price_list, customer, customer_groups, company):
+    if rule.min_qty and qty < flt(rule.min_qty):
+        return False
+    if rule.max_qty and qty > flt(rule.max_qty):
+        return False
+    if rule.for_price_list and rule.for_price_list != price_list:
+        return False
+    if rule.company and rule.company != company:
+        return False
+    if rule.applicable_for == "Customer":
+        return bool(customer) and rule.customer == customer
+    if rule.applicable_for == "Customer Group":
+        # ERPNext matches the customer's group and every group above it
+        return rule.customer_group in customer_groups
+    return True
+
+
+def _pick_rule(rules):
+    """Highest-priority rule; `False` when the top priority is ambiguous."""
+    if not rules:
+        return None
+    top = max(cint(rule.priority) for rule in rules)
+    best = [rule for rule in rules if cint(rule.priority) == top]
+    outcomes = {(rule.rate_or_discount, flt(rule.rate), flt(rule.discount_percentage), flt(rule.discount_amount)) for rule in best}
+    return best[0] if len(outcomes) == 1 else False
+
+
+def _cache_version():
+    cache = frappe.cache()
+    value = cache.get(cache.make_key(VERSION_KEY))
+    return int(value) if value else 0
+
+
+def _signature(items, customer, settings, date):
+    pricing = get_customer_pricing(customer)
+    payload = [
+        [(row.get("item_code"), flt(row.get("qty") or 1)) for row in items],
+        customer or "",
+        pricing["price_list"],
+        pricing["customer_group"],
+        pricing.get("tax_category"),
+        str(date),
+        get_price_version(),
+        menu_catalog.get_version(),
+        _cache_version(),
+        [
+            cint(getattr(settings, "enable_qty_discount", 0)),
+            cint(settings.qty_discount_threshold),
+            flt(settings.qty_price_regular),
+            flt(settings.qty_price_discount),
+        ],
+    ]
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def quote_cart(items, customer=None, settings=None, date=None):
+    """Price `items` ([{item_code, qty}]) without a Sales Order; None if unsupported.
+
+    Returns {"items": [{item_code, item_name, item, qty, rate, amount}], "total", "grand_total"}.
+    """
+    from line_integration.utils.line_client import get_settings
+
+    settings = settings or get_settings()
+    date = getdate(date or today())
+    key = QUOTE_CACHE_KEY.format(_signature(items, customer, settings, date))
+    cache = frappe.cache()
+    quote = cache.get_value(key)
+    if quote is not None:
+        metrics.incr(METRICS_NAME, "hit")
+        return quote or None
+    metrics.incr(METRICS_NAME, "miss")
+    quote = _compute_quote(items, customer, settings, date)
+    # Unsupported carts are memoized too (as {}) so they go straight to the fallback
+    cache.set_value(key, quote or {}, expires_in_sec=QUOTE_CACHE_TTL)
+    return quote
+
+
+def _compute_quote(items, customer, settings, date):
+    from line_integration.api.line_webhook import build_so_items
+
+    catalog_items = menu_catalog.get_catalog().items
+    by_code = {item.name: item for item in catalog_items}
+    order_rows = [{"item_code": row.get("item_code"), "qty": flt(row.get("qty") or 1)} for row in items]
+    if any(row["item_code"] not in by_code for row in order_rows):
+        return None
+
+    codes = {row["item_code"] for row in order_rows}
+    rules = _load_rules(date)
+    defaults = get_selling_defaults()
+    taxes = _load_taxes(defaults["company"])
+    pricing = get_customer_pricing(customer)
+    if (
+        rules["transaction"]
+        or not taxes["supported"]
+        # Tax categories pick other templates and item tax rows than the engine models
+        or pricing.get("tax_category")
+        or not codes.isdisjoint(rules["unsupported_items"])
+        or not codes.isdisjoint(_load_item_taxes())
+    ):
+        metrics.incr(METRICS_NAME, "unsupported")
+        return None
+
+    precision = _precision()
+    price_list = pricing["price_list"]
+    list_rates = _list_rates([row["item_code"] for row in order_rows], price_list, customer, date)
+
+    lines = []
+    for so_row in build_so_items(order_rows, settings):
+        code = so_row["item_code"]
+        qty = flt(so_row["qty"])
+        price_list_rate = flt(list_rates.get(code))
+        applicable = [
+            rule
+            for rule in rules["by_item"].get(code, [])
+            if _rule_applies(rule, qty, price_list, customer, pricing["customer_groups"], defaults["company"])
+        ]
+        rule = _pick_rule(applicable)
+        if rule is False:
+            metrics.incr(METRICS_NAME, "unsupported")
+            return None
+
+        rate = so_row.get("rate")
+        if rule:
+            if rule.rate_or_discount == "Rate":
+                if flt(rule.rate) and (not rule.currency or rule.currency == defaults["currency"]):
+                    price_list_rate = flt(rule.rate)
+                discounted = price_list_rate
+            elif rule.rate_or_discount == "Discount Percentage":
+                discounted = price_list_rate * (1 - flt(rule.discount_percentage) / 100.0)
+            else:
+                discounted = price_list_rate - flt(rule.discount_amount)
+            # A matched rule re-prices the row from the price list, like the Sales Order does
+            if price_list_rate:
+                rate = discounted
+        if rate is None:
+            rate = price_list_rate
+        rate = flt(rate, precision)
+        lines.append(
+            {
+                "item_code": code,
+                "item_name": by_code[code].item_name or code,
+                "item": by_code[code],
+                "qty": qty,
+                "rate": rate,
+                "amount": flt(rate * qty, precision),
+            }
+        )
+
+    total = flt(sum(line["amount"] for line in lines), precision)
+    grand_total = total
+    for row in taxes["rows"]:
+        if not row.included_in_print_rate:
+            grand_total += flt(total * flt(row.rate) / 100.0, precision)
+    return {"items": lines, "total": total, "grand_total": flt(grand_total, precision)}
+
+
+def simulate_sales_order(items, customer=None, settings=None):
+    """Reference path: price the cart on an unsaved Sales Order. Returns the document."""
+    from line_integration.api.line_webhook import build_so_items
+    from line_integration.utils.line_client import get_settings
+
+    settings = settings or get_settings()
+    defaults = get_selling_defaults()
+    so = frappe.new_doc("Sales Order")
+    so.customer = customer
+    so.company = defaults["company"]
+    so.currency = defaults["currency"]
+    so.transaction_date = today()
+    so.delivery_date = add_days(today(), 7)
+    order_rows = [{"item_code": row.get("item_code"), "qty": flt(row.get("qty") or 1)} for row in items]
+    for row in build_so_items(order_rows, settings):
+        so.append("items", row)
+    so.set_missing_values()
+    so.calculate_taxes_and_totals()
+    return so
+
+
+def clear_cache(doc=None, method=None):
+    """doc_events hook for Pricing Rule / Item Price / sales and item tax changes.
+
+    Memoized quotes are dropped too: their signature includes the version bumped here.
+    """
+    _clear()
+    # Again after commit, in case a concurrent request cached the pre-commit state
+    after_commit = getattr(frappe.db, "after_commit", None) if getattr(frappe.local, "db", None) else None
+    if after_commit is not None:
+        after_commit.add(_clear)
+
+
+def _clear():
+    cache = frappe.cache()
+    for key in (RULES_CACHE_KEY, TAX_CACHE_KEY, LIST_RATE_CACHE_KEY):
+        cache.delete_value(key)
+    cache.incr(cache.make_key(VERSION_KEY))
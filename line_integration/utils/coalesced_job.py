@@ -0,0 +1,64 @@
+"""
+Background rebuilds that coalesce bursts of changes without dropping any.
+
+`schedule(method, name)` marks `name` dirty and enqueues `method` once the current
+transaction commits. It does not use RQ `deduplicate`, which silently drops a change that
+lands while the job is already running. The job wraps its work in `run(name, fn)`, which
+calls `fn` while the dirty mark is set. A lock lets only one worker build at a time, and
+the mark is checked again after the lock is released. A burst of changes therefore costs
+one or two builds, and every change is eventually covered by a build that started after
+it was committed.
+"""
+
+import uuid
+
+import frappe
+
+DIRTY_KEY = "line_job_dirty:{0}"
+LOCK_KEY = "line_job_lock:{0}"
+LOCK_TTL = 900
+
+
+def schedule(method, name, queue="short", **kwargs):
+    """Mark `name` dirty and enqueue `method(**kwargs)` after the current commit."""
+
+    def mark_and_enqueue():
+        cache = frappe.cache()
+        cache.set(cache.make_key(DIRTY_KEY.format(name)), 1)
+        frappe.enqueue(method, queue=queue, **kwargs)
+
+    after_commit = getattr(frappe.db, "after_commit", None) if getattr(frappe.local, "db", None) else None
+    if after_commit is not None:
+        after_commit.add(mark_and_enqueue)
+    else:
+        mark_and_enqueue()
+
+
+def run(name, fn):
+    """Call `fn()` until `name` is no longer dirty; a no-op if another worker is on it."""
+    cache = frappe.cache()
+    dirty = cache.make_key(DIRTY_KEY.format(name))
+    lock = cache.make_key(LOCK_KEY.format(name))
+    token = uuid.uuid4().hex
+    while True:
+        if not cache.set(lock, token, nx=True, ex=LOCK_TTL):
+            # The holder checks the mark again after releasing the lock
+            return
+        try:
+            while cache.delete(dirty):
+                try:
+                    fn()
+                except Exception:
+                    # Keep the change pending for the next job
+                    cache.set(dirty, 1)
+                    raise
+        finally:
+            _release(cache, lock, token)
+        if not cache.get(dirty):
+            return
+
+
+def _release(cache, lock, token):
+    current = cache.get(lock)
+    if current is not None and (current.decode() if isinstance(current, bytes) else current) == token:
+        cache.delete(lock)
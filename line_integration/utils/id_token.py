@@ -0,0 +1,90 @@
+"""
+Local verification of LINE ID tokens (as returned by `liff.getIDToken()`).
+
+LIFF ID tokens are ES256 JWTs signed with LINE's published keys. The key set is cached
+in Redis and in process memory, so verifying a token normally needs no network call;
+the key set is only re-fetched when LINE rotates to a `kid` we have not seen. Those
+forced re-fetches happen at most once per JWKS_REFRESH_INTERVAL across all workers, and
+a `kid` still unknown afterwards is remembered as such, so tokens with made-up key ids
+cannot drive outbound requests to LINE.
+"""
+
+import frappe
+import jwt
+
+from line_integration.utils.line_client import LINE_API_BASE, line_request
+
+LINE_ISSUER = "https://access.line.me"
+JWKS_URL = f"{LINE_API_BASE}/oauth2/v2.1/certs"
+JWKS_CACHE_KEY = "line_id_token_jwks"
+JWKS_CACHE_TTL = 86400
+JWKS_REFRESH_LOCK_KEY = "line_id_token_jwks_refresh"
+JWKS_REFRESH_INTERVAL = 60
+UNKNOWN_KID_KEY = "line_id_token_unknown_kid:{0}"
+UNKNOWN_KID_TTL = 300
+MAX_KID_LENGTH = 128
+ALGORITHMS = ["ES256"]
+LEEWAY_SECONDS = 30
+
+_signing_keys = {}
+
+
+def _load_jwks(force=False):
+    jwks = None if force else frappe.cache().get_value(JWKS_CACHE_KEY)
+    if not jwks:
+        resp = line_request("GET", JWKS_URL)
+        if resp.status_code != 200:
+            raise jwt.InvalidTokenError("Could not fetch LINE signing keys")
+        jwks = resp.json()
+        frappe.cache().set_value(JWKS_CACHE_KEY, jwks, expires_in_sec=JWKS_CACHE_TTL)
+    for key in jwks.get("keys") or []:
+        if key.get("kid"):
+            _signing_keys[key["kid"]] = jwt.PyJWK(key)
+
+
+def _get_signing_key(kid):
+    if not kid or len(kid) > MAX_KID_LENGTH:
+        raise jwt.InvalidTokenError("Unknown signing key")
+    if kid not in _signing_keys:
+        _load_jwks()
+    if kid not in _signing_keys:
+        _refresh_for_unknown_kid(kid)
+    if kid not in _signing_keys:
+        raise jwt.InvalidTokenError("Unknown signing key")
+    return _signing_keys[kid].key
+
+
+def _refresh_for_unknown_kid(kid):
+    """LINE may have rotated keys since we cached the set: re-fetch it, but rarely."""
+    cache = frappe.cache()
+    unknown_key = cache.make_key(UNKNOWN_KID_KEY.format(kid))
+    if cache.get(unknown_key):
+        return
+    if not cache.set(cache.make_key(JWKS_REFRESH_LOCK_KEY), 1, nx=True, ex=JWKS_REFRESH_INTERVAL):
+        # Another worker re-fetched recently; pick up whatever it stored
+        _load_jwks()
+        return
+    _load_jwks(force=True)
+    if kid not in _signing_keys:
+        cache.set(unknown_key, 1, ex=UNKNOWN_KID_TTL)
+
+
+def verify_id_token(id_token, channel_id):
+    """Verify signature, issuer, `aud` = channel id and `exp`; return the claims.
+
+    Raises `jwt.InvalidTokenError` (or a subclass) when the token is not acceptable.
+    """
+    if not channel_id:
+        raise jwt.InvalidTokenError("LIFF channel id is not configured")
+    header = jwt.get_unverified_header(id_token)
+    if header.get("alg") not in ALGORITHMS:
+        raise jwt.InvalidTokenError("Unsupported ID token algorithm")
+    return jwt.decode(
+        id_token,
+        key=_get_signing_key(header.get("kid")),
+        algorithms=ALGORITHMS,
+        audience=str(channel_id),
+        issuer=LINE_ISSUER,
+        leeway=LEEWAY_SECONDS,
+        options={"require": ["exp", "iat", "sub", "aud", "iss"]},
+    )
@@ -0,0 +1,127 @@
+"""
+Public URL resolution for images sent to LINE / LIFF.
+
+LINE can only fetch public files, so each `file_url` is checked against its File record.
+The result (public or private) is cached in one Redis key per file_url with its own TTL,
+so resolving a carousel or a menu page costs one pipelined Redis read plus, for paths not
+seen recently, a single File query. File changes drop their entries.
+"""
+
+import frappe
+from frappe.utils import get_url
+
+from line_integration.utils import metrics
+
+METRICS_NAME = "image_urls"
+VISIBILITY_KEY = "line_image_visibility:{0}"
+VISIBILITY_TTL = 86400
+PUBLIC = "1"
+PRIVATE = "0"
+
+
+def _is_absolute(path):
+    return path.startswith(("http://", "https://"))
+
+
+def _key(cache, path):
+    return cache.make_key(VISIBILITY_KEY.format(path))
+
+
+def _read_cached(cache, paths):
+    try:
+        pipe = cache.pipeline(transaction=False)
+        for path in paths:
+            pipe.get(_key(cache, path))
+        values = pipe.execute()
+    except Exception:
+        return {}
+    cached = {}
+    for path, value in zip(paths, values, strict=True):
+        if value is not None:
+            cached[path] = (value.decode() if isinstance(value, bytes) else value) == PUBLIC
+    return cached
+
+
+def public_paths(paths):
+    """{path: path if the file is public (or an absolute URL), else None}.
+
+    Paths without a File record count as public, as LINE is given them unchanged.
+    """
+    result = {}
+    lookup = []
+    for path in {path for path in paths if path}:
+        if _is_absolute(path):
+            result[path] = path
+        else:
+            lookup.append(path)
+    if not lookup:
+        return result
+
+    cache = frappe.cache()
+    visibility = _read_cached(cache, lookup)
+    missing = [path for path in lookup if path not in visibility]
+    if missing:
+        metrics.incr(METRICS_NAME, "miss", len(missing))
+        private = {
+            row.file_url
+            for row in frappe.get_all(
+                "File",
+                filters={"file_url": ["in", missing], "is_private": 1},
+                fields=["file_url"],
+            )
+        }
+        found = {path: path not in private for path in missing}
+        visibility.update(found)
+        try:
+            pipe = cache.pipeline(transaction=False)
+            for path, public in found.items():
+                pipe.set(_key(cache, path), PUBLIC if public else PRIVATE, ex=VISIBILITY_TTL)
+            pipe.execute()
+        except Exception:
+            pass
+    if len(missing) < len(lookup):
+        metrics.incr(METRICS_NAME, "hit", len(lookup) - len(missing))
+
+    for path in lookup:
+        result[path] = path if visibility[path] else None
+    return result
+
+
+def resolve_public_image_urls(paths, logger=None):
+    """{path: absolute URL, or None for private files} for every non-empty path."""
+    urls = {}
+    for path, public_path in public_paths(paths).items():
+        if not public_path:
+            if logger:
+                logger.warning({"event": "line_image_private", "file_url": path})
+            urls[path] = None
+            continue
+        try:
+            urls[path] = public_path if _is_absolute(public_path) else get_url(public_path)
+        except Exception:
+            if logger:
+                logger.warning({"event": "line_image_get_url_failed", "file_url": path})
+            urls[path] = None
+    return urls
+
+
+def invalidate(file_urls):
+    file_urls = [url for url in file_urls if url]
+    if not file_urls:
+        return
+    try:
+        cache = frappe.cache()
+        cache.delete(*[_key(cache, url) for url in file_urls])
+    except Exception:
+        pass
+
+
+def on_file_change(doc, method=None):
+    """doc_events hook for File: forget the visibility of its current and previous URL."""
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    file_urls = {doc.get("file_url"), before and before.get("file_url")}
+    invalidate(file_urls)
+    # Again after commit, in case a concurrent request re-cached the old visibility
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is not None:
+        after_commit.add(lambda: invalidate(file_urls))
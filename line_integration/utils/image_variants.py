@@ -0,0 +1,223 @@
+"""
+Resized JPEG/WebP derivatives of LINE menu images.
+
+When an Item's `custom_line_menu_image` changes, a background job renders the image at
+VARIANT_WIDTHS (never upscaled) in JPEG and WebP with Pillow and stores each one as a
+public File attached to the Item. The file URLs are recorded on the Item in
+`custom_line_menu_image_variants` together with the source they were made from, so
+stale variants are ignored. Private source images get no public derivatives. Jobs are
+coalesced per item with `coalesced_job`, so an image change made while a job is running
+gets a run of its own. Variants are rendered in memory first, and their Files are written
+in the same transaction as the Item field.
+
+Existing items are processed with:
+
+    bench --site <site> execute line_integration.utils.image_variants.backfill
+"""
+
+import hashlib
+import io
+import json
+
+import frappe
+from frappe.utils import scrub
+
+from line_integration.utils import coalesced_job, image_urls, metrics
+
+METRICS_NAME = "image_variants"
+VARIANTS_FIELD = "custom_line_menu_image_variants"
+VARIANT_WIDTHS = (240, 480, 1024)
+# Width picked by each consumer: Flex hero, LIFF menu grid (2x density), cart line thumbnail
+HERO_WIDTH = 1024
+GRID_WIDTH = 480
+THUMB_WIDTH = 240
+# format -> (Pillow format, file extension, save options)
+FORMATS = {
+    "jpeg": ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "webp", {"quality": 80, "method": 6}),
+}
+JOB_NAME = "line_menu_image_variants:{0}"
+
+
+def _load(value):
+    """The recorded {"source": ..., "jpeg": {...}, "webp": {...}} dict, or {}."""
+    if not value:
+        return {}
+    try:
+        data = json.loads(value) if isinstance(value, str) else value
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _all_paths(data):
+    return {path for fmt in FORMATS for path in (data.get(fmt) or {}).values()}
+
+
+def is_current(value, source):
+    """Whether the recorded variants were made from `source` (possibly with no files)."""
+    data = _load(value)
+    return bool(data) and data.get("source") == (source or None)
+
+
+def parse_variants(value, source):
+    """{format: {width: path}} from the Item field, or {} if made from another source."""
+    data = _load(value)
+    if not source or data.get("source") != source:
+        return {}
+    return {
+        fmt: {int(width): path for width, path in data[fmt].items()}
+        for fmt in FORMATS
+        if data.get(fmt)
+    }
+
+
+def pick_variant(variants, width, fmt="jpeg"):
+    """Path of the smallest `fmt` variant at least `width` wide (else the largest), or None."""
+    sizes = (variants or {}).get(fmt) or {}
+    if not sizes:
+        return None
+    wide_enough = [size for size in sizes if size >= width]
+    return sizes[min(wide_enough) if wide_enough else max(sizes)]
+
+
+def _render(content, width, pil_format, options):
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            # JPEG has no alpha: flatten transparent PNGs onto white
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.split()[-1])
+            image = background
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, pil_format, **options)
+        return output.getvalue(), image.width
+
+
+def _save_file(item_code, file_name, content):
+    file_doc = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": file_name,
+            "is_private": 0,
+            "content": content,
+            "attached_to_doctype": "Item",
+            "attached_to_name": item_code,
+        }
+    )
+    file_doc.insert(ignore_permissions=True)
+    return file_doc.file_url
+
+
+def _delete_files(item_code, paths):
+    for name in frappe.get_all(
+        "File",
+        filters={"file_url": ["in", list(paths)], "attached_to_doctype": "Item", "attached_to_name": item_code},
+        pluck="name",
+    ):
+        frappe.delete_doc("File", name, ignore_permissions=True, force=True)
+
+
+def _render_all(content, digest, item_code):
+    """{format: {width: (file_name, data)}}, rendered in memory before anything is written."""
+    rendered = {}
+    for fmt, (pil_format, extension, options) in FORMATS.items():
+        widths = {}
+        for width in VARIANT_WIDTHS:
+            data, actual_width = _render(content, width, pil_format, options)
+            widths[str(width)] = (f"{scrub(item_code)}-{digest}-{width}.{extension}", data)
+            if actual_width < width:
+                # Source is narrower than this size; larger sizes would be identical
+                break
+        rendered[fmt] = widths
+    return rendered
+
+
+def generate_variants(item_code, force=False):
+    """Background job: (re)build the derivatives of `item_code`'s menu image."""
+    coalesced_job.run(JOB_NAME.format(item_code), lambda: _generate(item_code, force))
+
+
+def _generate(item_code, force):
+    from line_integration.utils import menu_catalog
+
+    source, current = frappe.db.get_value("Item", item_code, ["custom_line_menu_image", VARIANTS_FIELD]) or (None, None)
+    if not force and parse_variants(current, source):
+        return
+    old_paths = _all_paths(_load(current))
+
+    rendered = {}
+    file_doc = None
+    if source and not source.startswith(("http://", "https://")) and image_urls.public_paths([source]).get(source):
+        file_doc = frappe.db.get_value("File", {"file_url": source}, "name")
+    if file_doc:
+        try:
+            content = frappe.get_doc("File", file_doc).get_content()
+            rendered = _render_all(content, hashlib.sha1(content).hexdigest()[:8], item_code)
+        except Exception:
+            metrics.incr(METRICS_NAME, "failed")
+            frappe.log_error(frappe.get_traceback(), f"LINE Menu Image Variants Error: {item_code}")
+            return
+
+    # Files and the Item field are written and committed together; a rollback (which
+    # also removes files written in this transaction) leaves neither behind
+    try:
+        variants = {"source": source or None}
+        for fmt, widths in rendered.items():
+            variants[fmt] = {width: _save_file(item_code, name, data) for width, (name, data) in widths.items()}
+        frappe.db.set_value("Item", item_code, VARIANTS_FIELD, json.dumps(variants), update_modified=False)
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        raise
+    if rendered:
+        metrics.incr(METRICS_NAME, "generated")
+
+    # Old files go only once nothing refers to them any more
+    stale = old_paths - _all_paths(variants)
+    if stale:
+        _delete_files(item_code, stale)
+        frappe.db.commit()
+    menu_catalog.schedule_rebuild()
+
+
+def schedule_variants(item_code, force=False):
+    coalesced_job.schedule(
+        "line_integration.utils.image_variants.generate_variants",
+        JOB_NAME.format(item_code),
+        queue="long",
+        item_code=item_code,
+        force=force,
+    )
+
+
+def on_item_change(doc, method=None):
+    """doc_events hook: Item on_update; regenerate when the menu image changed."""
+    source = doc.get("custom_line_menu_image")
+    if not source and not doc.get(VARIANTS_FIELD):
+        return
+    if not is_current(doc.get(VARIANTS_FIELD), source):
+        schedule_variants(doc.name)
+
+
+def backfill(force=False, limit=None):
+    """Queue derivative generation for menu items whose variants are missing or stale."""
+    rows = frappe.get_all(
+        "Item",
+        filters={"custom_line_menu_image": ["is", "set"]},
+        fields=["name", "custom_line_menu_image", VARIANTS_FIELD],
+        order_by="name asc",
+        limit=int(limit) if limit else None,
+    )
+    queued = 0
+    for row in rows:
+        if force or not parse_variants(row.get(VARIANTS_FIELD), row.custom_line_menu_image):
+            schedule_variants(row.name, force=bool(force))
+            queued += 1
+    frappe.db.commit()
+    return {"items": len(rows), "queued": queued}
@@ -0,0 +1,81 @@
+"""
+Short-lived cache of verified LIFF access tokens.
+
+A successful verify + profile lookup is stored under a SHA-256 of the access token, so
+repeated calls from the same LIFF session resolve the user with one Redis read. Entries
+never outlive the token's `expires_in`, and are revoked when the user unfollows/blocks.
+"""
+
+import hashlib
+
+import frappe
+
+from line_integration.utils import metrics
+
+METRICS_NAME = "liff_session_cache"
+SESSION_KEY = "line_liff_session:{0}"
+USER_SESSIONS_KEY = "line_liff_user_sessions:{0}"
+DEFAULT_TTL = 600
+
+
+def _token_hash(access_token):
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+
+def _max_ttl(settings=None):
+    ttl = int(getattr(settings, "liff_session_cache_ttl", 0) or 0) if settings else 0
+    return ttl if ttl > 0 else DEFAULT_TTL
+
+
+def get_session(access_token):
+    """Cached user info for a previously verified access token, or None."""
+    if not access_token:
+        return None
+    try:
+        user_info = frappe.cache().get_value(SESSION_KEY.format(_token_hash(access_token)))
+    except Exception:
+        return None
+    metrics.incr(METRICS_NAME, "hit" if user_info else "miss")
+    return user_info
+
+
+def save_session(access_token, user_info, expires_in, settings=None):
+    """Cache verified user info for min(expires_in, configured TTL) seconds."""
+    user_id = (user_info or {}).get("user_id")
+    if not access_token or not user_id:
+        return
+    ttl = min(int(expires_in or 0), _max_ttl(settings))
+    if ttl <= 0:
+        return
+    token_hash = _token_hash(access_token)
+    try:
+        cache = frappe.cache()
+        cache.set_value(SESSION_KEY.format(token_hash), user_info, expires_in_sec=ttl)
+        # Track sessions per user so they can be revoked on unfollow/block
+        cache.sadd(USER_SESSIONS_KEY.format(user_id), token_hash)
+        cache.expire(cache.make_key(USER_SESSIONS_KEY.format(user_id)), _max_ttl(settings))
+    except Exception:
+        pass
+
+
+def revoke_user_sessions(user_id):
+    """Drop every cached LIFF session of `user_id`."""
+    if not user_id:
+        return
+    try:
+        cache = frappe.cache()
+        for token_hash in cache.smembers(USER_SESSIONS_KEY.format(user_id)) or []:
+            if isinstance(token_hash, bytes):
+                token_hash = token_hash.decode()
+            cache.delete_value(SESSION_KEY.format(token_hash))
+        cache.delete_value(USER_SESSIONS_KEY.format(user_id))
+        metrics.incr(METRICS_NAME, "revoked")
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "LIFF Session Revoke Error")
+
+
+def get_stats():
+    stats = metrics.get_all(METRICS_NAME)
+    lookups = int(stats.get("hit", 0) or 0) + int(stats.get("miss", 0) or 0)
+    stats["hit_ratio"] = round(int(stats.get("hit", 0) or 0) / lookups, 4) if lookups else None
+    return stats
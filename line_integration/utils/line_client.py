@@ -1,23 +1,152 @@
 import json
+import os
+import uuid
 
 import requests
 import frappe
 from frappe.utils import now_datetime
 from frappe.utils.password import get_decrypted_password
+from requests.adapters import HTTPAdapter
+
+from line_integration.utils import metrics, outbound_queue
+
+LINE_API_BASE = "https://api.line.me"
+# (connect, read) seconds; connect fails fast, read leaves room for LINE latency spikes
+DEFAULT_TIMEOUT = (3.05, 10)
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 20
+
+_http_client = None
+_http_client_pid = None
+
+PROFILE_CACHE_KEY = "line_profile_fetched:{0}"
+PROFILE_REFRESH_LOCK_KEY = "line_profile_refresh:{0}"
+PROFILE_METRICS = "profile_cache"
+DEFAULT_PROFILE_CACHE_TTL = 86400
+# Empty profiles (user blocked the account, LINE error) are cached this long
+EMPTY_PROFILE_CACHE_TTL = 3600
+PROFILE_ACTIVITY_KEY = "line_profile_activity"
+PROFILE_FLUSHING_KEY = "line_profile_activity:flushing"
+PROFILE_FLUSH_CHUNK = 500
 
 
 def get_settings():
     return frappe.get_single("LINE Settings")
 
 
-def _headers(token):
-    return {
+def _conf(key, default=None):
+    conf = frappe.local.conf if hasattr(frappe.local, "conf") else None
+    return (conf or {}).get(key, default)
+
+
+def _build_http_client():
+    """Create the pooled keep-alive client used for all LINE API traffic.
+
+    Site config keys: `line_http_pool_connections`, `line_http_pool_maxsize`,
+    `line_http2` (requires `httpx[http2]`; falls back to requests when missing).
+    """
+    pool_connections = int(_conf("line_http_pool_connections", DEFAULT_POOL_CONNECTIONS))
+    pool_maxsize = int(_conf("line_http_pool_maxsize", DEFAULT_POOL_MAXSIZE))
+    if _conf("line_http2"):
+        try:
+            import httpx
+
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=pool_maxsize,
+                    max_keepalive_connections=pool_maxsize,
+                ),
+            )
+        except ImportError:
+            frappe.logger("line_webhook").warning({"event": "line_http2_unavailable"})
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_client():
+    """Process-wide pooled client; rebuilt after fork so workers never share sockets."""
+    global _http_client, _http_client_pid
+    if _http_client is None or _http_client_pid != os.getpid():
+        _http_client = _build_http_client()
+        _http_client_pid = os.getpid()
+    return _http_client
+
+
+def line_request(method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """Send a request through the pooled client. `timeout` is (connect, read)."""
+    client = get_http_client()
+    if isinstance(client, requests.Session):
+        return client.request(method, url, timeout=timeout, **kwargs)
+
+    import httpx
+
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return client.request(method, url, timeout=httpx.Timeout(read, connect=connect), **kwargs)
+
+
+def _headers(token, retry_key=None):
+    headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {token}",
     }
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
+    return headers
+
+
+MESSAGE_ENDPOINTS = {
+    "Reply": ("/v2/bot/message/reply", "replyToken"),
+    "Push": ("/v2/bot/message/push", "to"),
+    "Multicast": ("/v2/bot/message/multicast", "to"),
+}
+
+
+def send_line_message(kind, recipient, messages, retry_key=None, access_token=None):
+    """Low-level send used by the outbound queue; returns the HTTP response."""
+    path, recipient_field = MESSAGE_ENDPOINTS[kind]
+    access_token = access_token or get_decrypted_password(
+        "LINE Settings", "LINE Settings", "channel_access_token"
+    )
+    return line_request(
+        "POST",
+        f"{LINE_API_BASE}{path}",
+        json={recipient_field: recipient, "messages": messages},
+        headers=_headers(access_token, retry_key if kind != "Reply" else None),
+    )
+
+
+def _queue_for_retry(kind, recipient, messages, retry_key=None, resp=None, error=None):
+    """Hand a failed send to the durable outbound queue; QUEUED if it was stored, else False."""
+    status_code = resp.status_code if resp is not None else None
+    if not outbound_queue.is_retryable(status_code):
+        return False
+    name = outbound_queue.queue_message(
+        kind,
+        recipient,
+        messages,
+        retry_key=retry_key,
+        status_code=status_code,
+        error=error or (resp.text[:500] if resp is not None else None),
+        retry_after=resp.headers.get("Retry-After") if resp is not None else None,
+    )
+    if name:
+        frappe.logger("line_webhook").warning(
+            {"event": f"line_{kind.lower()}_queued", "status": status_code, "outbound_message": name}
+        )
+    return outbound_queue.QUEUED if name else False
+
+
+def _acquire_send_token(settings):
+    return outbound_queue.acquire_send_token(settings)
 
 
 def reply_message(reply_token, content):
+    """True when LINE accepted the reply, QUEUED when it was stored for retry, else False."""
     logger = frappe.logger("line_webhook")
     if not reply_token:
         logger.info({"event": "line_reply_skip", "reason": "missing_reply_token"})
@@ -30,7 +159,7 @@ def reply_message(reply_token, content):
     if not access_token:
         logger.warning({"event": "line_reply_skip", "reason": "missing_access_token"})
         return False
-    url = "https://api.line.me/v2/bot/message/reply"
+    url = f"{LINE_API_BASE}/v2/bot/message/reply"
     messages = []
     if isinstance(content, str):
         messages = [{"type": "text", "text": content}]
@@ -42,14 +171,19 @@ def reply_message(reply_token, content):
         logger.warning({"event": "line_reply_skip", "reason": "unsupported_content_type"})
         return False
     payload = {"replyToken": reply_token, "messages": messages}
+    if not _acquire_send_token(settings):
+        return _queue_for_retry("Reply", reply_token, messages, error=outbound_queue.RATE_LIMITED)
     try:
-        resp = requests.post(
+        resp = line_request(
+            "POST",
             url,
-            data=json.dumps(payload),
+            json=payload,
             headers=_headers(access_token),
-            timeout=10,
         )
         if resp.status_code != 200:
+            queued = _queue_for_retry("Reply", reply_token, messages, resp=resp)
+            if queued:
+                return queued
             logger.error(
                 {
                     "event": "line_reply_failed",
@@ -82,10 +216,11 @@ def reply_message(reply_token, content):
             return True
     except Exception:
         frappe.log_error(frappe.get_traceback(), "LINE Reply Error")
-        return False
+        return _queue_for_retry("Reply", reply_token, messages, error="request failed")
 
 
 def push_message(user_id, text):
+    """True when LINE accepted the push, QUEUED when it was stored for retry, else False."""
     logger = frappe.logger("line_webhook")
     if not user_id:
         logger.info({"event": "line_push_skip", "reason": "missing_user_id"})
@@ -98,7 +233,7 @@ def push_message(user_id, text):
     if not access_token:
         logger.warning({"event": "line_push_skip", "reason": "missing_access_token"})
         return False
-    url = "https://api.line.me/v2/bot/message/push"
+    url = f"{LINE_API_BASE}/v2/bot/message/push"
     messages = []
     if isinstance(text, str):
         messages = [{"type": "text", "text": text}]
@@ -110,14 +245,20 @@ def push_message(user_id, text):
         logger.warning({"event": "line_push_skip", "reason": "unsupported_content_type"})
         return False
     payload = {"to": user_id, "messages": messages}
+    retry_key = str(uuid.uuid4())
+    if not _acquire_send_token(settings):
+        return _queue_for_retry("Push", user_id, messages, retry_key=retry_key, error=outbound_queue.RATE_LIMITED)
     try:
-        resp = requests.post(
+        resp = line_request(
+            "POST",
             url,
-            data=json.dumps(payload),
-            headers=_headers(access_token),
-            timeout=10,
+            json=payload,
+            headers=_headers(access_token, retry_key),
         )
         if resp.status_code != 200:
+            queued = _queue_for_retry("Push", user_id, messages, retry_key=retry_key, resp=resp)
+            if queued:
+                return queued
             logger.error(
                 {
                     "event": "line_push_failed",
@@ -150,7 +291,102 @@ def push_message(user_id, text):
             return True
     except Exception:
         frappe.log_error(frappe.get_traceback(), "LINE Push Error")
-        return False
+        return _queue_for_retry("Push", user_id, messages, retry_key=retry_key, error="request failed")
+
+
+MULTICAST_BATCH_SIZE = 500
+
+
+def _to_messages(content):
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    if isinstance(content, dict):
+        return [content]
+    if isinstance(content, (list, tuple)):
+        return list(content)
+    return None
+
+
+def multicast_message(user_ids, content):
+    """Send the same messages to many users, up to 500 recipients per request.
+
+    Returns one result dict per batch: {"to": [...], "success": bool, "queued": bool,
+    "status": int | None}. Batches rejected with 429/5xx are handed to the outbound queue.
+    """
+    logger = frappe.logger("line_webhook")
+    recipients = list(dict.fromkeys(u for u in (user_ids or []) if u))
+    if not recipients:
+        logger.info({"event": "line_multicast_skip", "reason": "missing_user_ids"})
+        return []
+    settings = get_settings()
+    if not settings.enabled:
+        logger.info({"event": "line_multicast_skip", "reason": "settings_disabled"})
+        return []
+    access_token = get_decrypted_password("LINE Settings", "LINE Settings", "channel_access_token") or ""
+    if not access_token:
+        logger.warning({"event": "line_multicast_skip", "reason": "missing_access_token"})
+        return []
+    messages = _to_messages(content)
+    if messages is None:
+        logger.warning({"event": "line_multicast_skip", "reason": "unsupported_content_type"})
+        return []
+
+    url = f"{LINE_API_BASE}/v2/bot/message/multicast"
+    results = []
+    for start in range(0, len(recipients), MULTICAST_BATCH_SIZE):
+        batch = recipients[start : start + MULTICAST_BATCH_SIZE]
+        result = {"to": batch, "success": False, "queued": False, "status": None}
+        retry_key = str(uuid.uuid4())
+        if not _acquire_send_token(settings):
+            result["queued"] = bool(
+                _queue_for_retry("Multicast", batch, messages, retry_key=retry_key, error=outbound_queue.RATE_LIMITED)
+            )
+            results.append(result)
+            continue
+        try:
+            resp = line_request(
+                "POST",
+                url,
+                json={"to": batch, "messages": messages},
+                headers=_headers(access_token, retry_key),
+            )
+            result["status"] = resp.status_code
+            result["success"] = resp.status_code == 200
+            if not result["success"]:
+                result["queued"] = bool(_queue_for_retry("Multicast", batch, messages, retry_key=retry_key, resp=resp))
+            if result["success"]:
+                logger.info({"event": "line_multicast_success", "recipients": len(batch)})
+            else:
+                logger.error(
+                    {
+                        "event": "line_multicast_failed",
+                        "status": resp.status_code,
+                        "body": resp.text,
+                        "recipients": len(batch),
+                    }
+                )
+                frappe.log_error(
+                    {
+                        "event": "line_multicast_failed",
+                        "status": resp.status_code,
+                        "body": resp.text,
+                        "recipients": len(batch),
+                        "payload_messages": messages,
+                    },
+                    "LINE Multicast Error",
+                )
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), "LINE Multicast Error")
+            result["queued"] = bool(
+                _queue_for_retry("Multicast", batch, messages, retry_key=retry_key, error="request failed")
+            )
+        results.append(result)
+    return results
+
+
+def multicast_sent_count(results):
+    """Number of recipients in delivered (or queued for retry) multicast batches."""
+    return sum(len(r["to"]) for r in results or [] if r.get("success") or r.get("queued"))
 
 
 def ensure_profile(user_id, event=None):
@@ -172,27 +408,132 @@ def ensure_profile(user_id, event=None):
     display_name = source.get("displayName")
     picture_url = source.get("pictureUrl")
 
-    # If display_name not provided in event, fetch from LINE profile API
+    # Webhook events never carry displayName; use the cached LINE profile and refresh
+    # stale entries in the background instead of calling the profile API inline
     if not display_name:
-        try:
-            profile = fetch_line_profile(user_id)
-            display_name = profile.get("displayName") or display_name
-            picture_url = profile.get("pictureUrl") or picture_url
-        except Exception:
-            pass
+        profile = get_cached_line_profile(user_id)
+        if profile is None:
+            schedule_profile_refresh(user_id)
+            profile = {}
+        display_name = profile.get("displayName") or display_name
+        picture_url = profile.get("pictureUrl") or picture_url
 
     max_display_len = (doc.meta.get_field("display_name") or {}).get("length", 0)
     max_picture_len = (doc.meta.get_field("picture_url") or {}).get("length", 0)
 
+    previous = (doc.display_name, doc.picture_url)
     doc.display_name = _truncate(display_name or doc.display_name, max_display_len or None)
     doc.picture_url = _truncate(picture_url or doc.picture_url, max_picture_len or None)
     doc.last_seen = now_datetime()
     if event:
         doc.last_event = json.dumps(event)
+
+    # Only activity changed: buffer it instead of a full document save
+    if not doc.is_new() and previous == (doc.display_name, doc.picture_url):
+        if record_profile_activity(user_id, event, doc.last_seen):
+            return doc
     doc.save(ignore_permissions=True)
     return doc
 
 
+def _coalesce_enabled(settings=None):
+    settings = settings or get_settings()
+    return bool(getattr(settings, "coalesce_profile_writes", 0))
+
+
+def record_profile_activity(user_id, event=None, seen_at=None):
+    """Buffer last_seen/last_event for `user_id`; flushed by `flush_profile_activity`.
+
+    Returns False when buffering is disabled or Redis is unavailable, in which case the
+    caller should write the document itself.
+    """
+    if not user_id or not _coalesce_enabled():
+        return False
+    try:
+        entry = {"last_seen": str(seen_at or now_datetime())}
+        if event:
+            entry["last_event"] = json.dumps(event)
+        else:
+            previous = frappe.cache().hget(PROFILE_ACTIVITY_KEY, user_id) or {}
+            if previous.get("last_event"):
+                entry["last_event"] = previous["last_event"]
+        frappe.cache().hset(PROFILE_ACTIVITY_KEY, user_id, entry)
+        return True
+    except Exception:
+        return False
+
+
+def forget_profile_activity(user_id):
+    """Drop buffered activity of `user_id` once its document was saved directly."""
+    if not user_id:
+        return
+    try:
+        cache = frappe.cache()
+        cache.hdel(PROFILE_ACTIVITY_KEY, user_id)
+        cache.hdel(PROFILE_FLUSHING_KEY, user_id)
+    except Exception:
+        pass
+
+
+def flush_profile_activity():
+    """Scheduler job: write buffered profile activity with one bulk UPDATE per chunk."""
+    cache = frappe.cache()
+    # A previous flush that failed midway left its hash behind: write that one first,
+    # so taking the current buffer below cannot overwrite it
+    if cache.exists(PROFILE_FLUSHING_KEY):
+        _flush_buffer(cache)
+    try:
+        # Atomically take the current buffer; new activity lands in a fresh hash
+        taken = cache.renamenx(cache.make_key(PROFILE_ACTIVITY_KEY), cache.make_key(PROFILE_FLUSHING_KEY))
+    except Exception:
+        # Nothing buffered
+        return
+    if taken:
+        _flush_buffer(cache)
+
+
+def _flush_buffer(cache):
+    buffered = cache.hgetall(PROFILE_FLUSHING_KEY) or {}
+    rows = [
+        ((user_id.decode() if isinstance(user_id, bytes) else user_id), entry)
+        for user_id, entry in buffered.items()
+    ]
+    for start in range(0, len(rows), PROFILE_FLUSH_CHUNK):
+        _bulk_update_activity(rows[start : start + PROFILE_FLUSH_CHUNK])
+    frappe.db.commit()
+    cache.delete_value(PROFILE_FLUSHING_KEY)
+
+
+def _bulk_update_activity(rows):
+    """Write buffered activity, skipping rows a direct save has already moved past.
+
+    last_event is assigned before last_seen: MariaDB evaluates single-table SET clauses
+    left to right, so its condition still sees the stored last_seen.
+    """
+    if not rows:
+        return
+    event_cases = []
+    seen_cases = []
+    values_event = []
+    values_seen = []
+    for user_id, entry in rows:
+        last_seen = entry.get("last_seen")
+        event_cases.append("WHEN %s THEN CASE WHEN last_seen IS NULL OR last_seen <= %s THEN %s END")
+        values_event.extend([user_id, last_seen, entry.get("last_event")])
+        seen_cases.append("WHEN %s THEN CASE WHEN last_seen IS NULL OR last_seen < %s THEN %s END")
+        values_seen.extend([user_id, last_seen, last_seen])
+    user_ids = [user_id for user_id, _ in rows]
+    frappe.db.sql(
+        f"""
+        UPDATE `tabLINE Profile`
+        SET last_event = COALESCE(CASE line_user_id {" ".join(event_cases)} END, last_event),
+            last_seen = COALESCE(CASE line_user_id {" ".join(seen_cases)} END, last_seen)
+        WHERE line_user_id IN ({", ".join(["%s"] * len(user_ids))})
+        """,
+        tuple(values_event + values_seen + user_ids),
+    )
+
+
 def fetch_line_profile(user_id):
     """Fetch LINE profile data for a given user_id."""
     if not user_id:
@@ -201,11 +542,76 @@ def fetch_line_profile(user_id):
     access_token = get_decrypted_password("LINE Settings", "LINE Settings", "channel_access_token") or ""
     if not access_token:
         return {}
-    url = f"https://api.line.me/v2/bot/profile/{user_id}"
-    resp = requests.get(url, headers=_headers(access_token), timeout=10)
+    url = f"{LINE_API_BASE}/v2/bot/profile/{user_id}"
+    resp = line_request("GET", url, headers=_headers(access_token))
     if resp.status_code != 200:
         return {}
     try:
         return resp.json() or {}
     except Exception:
         return {}
+
+
+def _profile_cache_ttl(settings=None):
+    settings = settings or get_settings()
+    ttl = int(getattr(settings, "profile_cache_ttl", 0) or 0)
+    return ttl if ttl > 0 else DEFAULT_PROFILE_CACHE_TTL
+
+
+def get_cached_line_profile(user_id):
+    """Return the cached LINE profile dict, or None when missing/expired."""
+    profile = frappe.cache().get_value(PROFILE_CACHE_KEY.format(user_id))
+    metrics.incr(PROFILE_METRICS, "hit" if profile is not None else "miss")
+    return profile
+
+
+def set_cached_line_profile(user_id, profile, settings=None, ttl=None):
+    frappe.cache().set_value(
+        PROFILE_CACHE_KEY.format(user_id),
+        {"displayName": profile.get("displayName"), "pictureUrl": profile.get("pictureUrl")},
+        expires_in_sec=ttl or _profile_cache_ttl(settings),
+    )
+
+
+def schedule_profile_refresh(user_id):
+    """Enqueue at most one background profile fetch per user at a time."""
+    try:
+        cache = frappe.cache()
+        if not cache.set(cache.make_key(PROFILE_REFRESH_LOCK_KEY.format(user_id)), 1, nx=True, ex=60):
+            return
+        frappe.enqueue(
+            "line_integration.utils.line_client.refresh_line_profile",
+            queue="short",
+            user_id=user_id,
+            enqueue_after_commit=True,
+        )
+        metrics.incr(PROFILE_METRICS, "refresh_enqueued")
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "LINE Profile Refresh Error")
+
+
+def refresh_line_profile(user_id):
+    """RQ job: fetch the LINE profile, cache it and update the LINE Profile doc."""
+    profile = fetch_line_profile(user_id)
+    metrics.incr(PROFILE_METRICS, "fetch")
+    if not profile:
+        # Negative entry, so events from a blocked user do not refetch every minute
+        set_cached_line_profile(user_id, {}, ttl=min(EMPTY_PROFILE_CACHE_TTL, _profile_cache_ttl()))
+        metrics.incr(PROFILE_METRICS, "empty")
+        return
+    set_cached_line_profile(user_id, profile)
+
+    profile_name = frappe.db.get_value("LINE Profile", {"line_user_id": user_id})
+    if not profile_name:
+        return
+    meta = frappe.get_meta("LINE Profile")
+    updates = {}
+    for fieldname, key in (("display_name", "displayName"), ("picture_url", "pictureUrl")):
+        value = profile.get(key)
+        max_length = (meta.get_field(fieldname) or {}).get("length", 0)
+        if value and max_length and len(value) > max_length:
+            value = value[:max_length]
+        if value:
+            updates[fieldname] = value
+    if updates:
+        frappe.db.set_value("LINE Profile", profile_name, updates, update_modified=False)
@@ -0,0 +1,311 @@
+"""
+Materialized loyalty balances per (customer, loyalty program).
+
+ERPNext computes a balance by summing Loyalty Point Entries on every call. Here the sums
+are kept in Redis, bucketed by expiry date so expired points drop out without a rebuild,
+and adjusted incrementally (after commit) when entries are inserted or deleted. Each
+balance is a plain Redis hash with a `points`/`spent` field per expiry date, so deltas are
+applied with HINCRBYFLOAT inside one script and concurrent invoices cannot overwrite each
+other. Every delta also bumps a generation counter; a balance loaded from the ledger is
+only stored if the generation is unchanged since before the ledger was read. Tier and program details are derived from a cached copy of the Loyalty Program.
+
+Sales Invoice cancellation deletes redemption entries with raw SQL, bypassing doc events,
+so it drops the customer's balances instead; `reconcile_balances` recomputes every cached
+balance from the ledger and reports any drift.
+"""
+
+import frappe
+from frappe.utils import flt, getdate, today
+
+from line_integration.utils import metrics
+
+METRICS_NAME = "loyalty_cache"
+# One hash per "customer|program": "<expiry>|points" / "<expiry>|spent", a LOADED marker
+# and a GENERATION counter that every delta bumps, loaded or not
+BALANCE_KEY = "line_loyalty_balance:{0}"
+LOADED = "loaded"
+GENERATION = "gen"
+# Lifetime of a generation-only hash, i.e. deltas to a balance that is not cached
+UNLOADED_TTL = 3600
+PROGRAM_KEY = "line_loyalty_programs"
+RECONCILE_CHUNK = 500
+
+# KEYS[1]=balance, ARGV: points field, points, spent field, spent, unloaded ttl -> 1 if applied
+APPLY_LUA = """
+redis.call('HINCRBY', KEYS[1], 'gen', 1)
+if redis.call('HEXISTS', KEYS[1], 'loaded') == 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 0
+end
+redis.call('HINCRBYFLOAT', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HINCRBYFLOAT', KEYS[1], ARGV[3], ARGV[4])
+return 1
+"""
+
+# KEYS[1]=balance, ARGV: generation read before the ledger ('' if none), field, value, ...
+# -> 1 if replaced, 0 if a delta landed meanwhile
+REPLACE_LUA = """
+local gen = redis.call('HGET', KEYS[1], 'gen') or ''
+if gen ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+if gen ~= '' then
+    redis.call('HSET', KEYS[1], 'gen', gen)
+end
+return 1
+"""
+
+
+def _field(customer, loyalty_program):
+    return f"{customer}|{loyalty_program}"
+
+
+def _balance_key(cache, customer, loyalty_program):
+    return cache.make_key(BALANCE_KEY.format(_field(customer, loyalty_program)))
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _read_buckets(cache, key):
+    """(buckets, generation) under `key`; buckets ({expiry_date: [points, spent]}) is None
+    if the balance is not cached, generation "" if no delta was ever recorded."""
+    # RedisWrapper.hgetall prefixes and unpickles; these fields are plain values
+    raw = {_decode(field): _decode(value) for field, value in (cache.execute_command("HGETALL", key) or {}).items()}
+    generation = raw.get(GENERATION) or ""
+    if LOADED not in raw:
+        return None, generation
+    buckets = {}
+    for field, value in raw.items():
+        expiry, _, column = field.rpartition("|")
+        if column in ("points", "spent"):
+            bucket = buckets.setdefault(expiry, [0.0, 0.0])
+            bucket[0 if column == "points" else 1] = flt(value)
+    return buckets, generation
+
+
+def _write_buckets(cache, key, buckets, generation):
+    """Replace the balance under `key` unless a delta was applied since `generation` was read."""
+    args = [LOADED, 1]
+    for expiry, (points, spent) in (buckets or {}).items():
+        args += [f"{expiry}|points", repr(flt(points)), f"{expiry}|spent", repr(flt(spent))]
+    replaced = cache.eval(REPLACE_LUA, 1, key, generation, *args)
+    if not replaced:
+        metrics.incr(METRICS_NAME, "replace_conflict")
+    return bool(replaced)
+
+
+def _load_buckets(customers, loyalty_program=None):
+    """{(customer, program): {expiry_date: [points, spent]}} of unexpired entries, from the ledger."""
+    if not customers:
+        return {}
+    program_condition = "AND loyalty_program = %(program)s" if loyalty_program else ""
+    rows = frappe.db.sql(
+        f"""
+        SELECT customer, loyalty_program, expiry_date,
+            SUM(loyalty_points) AS points, SUM(purchase_amount) AS spent
+        FROM `tabLoyalty Point Entry`
+        WHERE customer IN %(customers)s
+          {program_condition}
+          AND posting_date <= %(today)s
+          AND expiry_date >= %(today)s
+        GROUP BY customer, loyalty_program, expiry_date
+        """,
+        {"customers": tuple(customers), "program": loyalty_program, "today": today()},
+        as_dict=True,
+    )
+    balances = {}
+    for row in rows:
+        buckets = balances.setdefault((row.customer, row.loyalty_program), {})
+        buckets[str(row.expiry_date)] = [flt(row.points), flt(row.spent)]
+    return balances
+
+
+def _totals(buckets):
+    current = str(getdate(today()))
+    points = spent = 0.0
+    for expiry, (bucket_points, bucket_spent) in (buckets or {}).items():
+        if expiry >= current:
+            points += bucket_points
+            spent += bucket_spent
+    return points, spent
+
+
+def _program_details(customer, loyalty_program):
+    cache = frappe.cache()
+    details = cache.hget(PROGRAM_KEY, loyalty_program)
+    if details is None:
+        from erpnext.accounts.doctype.loyalty_program.loyalty_program import get_loyalty_program_details
+
+        details = dict(get_loyalty_program_details(customer, loyalty_program, silent=True) or {})
+        rules = frappe.get_all(
+            "Loyalty Program Collection",
+            filters={"parent": loyalty_program, "parenttype": "Loyalty Program"},
+            fields=["tier_name", "collection_factor", "min_spent"],
+        )
+        details["_tiers"] = sorted(rules, key=lambda rule: flt(rule.min_spent), reverse=True)
+        cache.hset(PROGRAM_KEY, loyalty_program, details)
+    return details
+
+
+def get_loyalty_details(customer, loyalty_program=None):
+    """Drop-in for ERPNext's `get_loyalty_program_details_with_points` (no expiry/company args)."""
+    if not customer:
+        return frappe._dict()
+    loyalty_program = loyalty_program or frappe.db.get_value("Customer", customer, "loyalty_program")
+    if not loyalty_program:
+        return frappe._dict()
+
+    cache = frappe.cache()
+    key = _balance_key(cache, customer, loyalty_program)
+    buckets, generation = _read_buckets(cache, key)
+    if buckets is None:
+        metrics.incr(METRICS_NAME, "miss")
+        buckets = _load_buckets([customer], loyalty_program).get((customer, loyalty_program), {})
+        # Not stored if an entry was applied meanwhile; the next read loads again
+        _write_buckets(cache, key, buckets, generation)
+    else:
+        metrics.incr(METRICS_NAME, "hit")
+
+    points, spent = _totals(buckets)
+    details = frappe._dict(_program_details(customer, loyalty_program))
+    tiers = details.pop("_tiers", [])
+    # Same tier selection as ERPNext: highest tier whose threshold the spend has not passed
+    for i, tier in enumerate(tiers):
+        if i == 0 or spent <= flt(tier.min_spent):
+            details.tier_name = tier.tier_name
+            details.collection_factor = tier.collection_factor
+        else:
+            break
+    details.update(loyalty_points=points, total_spent=spent)
+    return details
+
+
+def get_points(customer, loyalty_program=None):
+    return flt(get_loyalty_details(customer, loyalty_program).get("loyalty_points"))
+
+
+def _apply(customer, loyalty_program, posting_date, expiry_date, points, spent):
+    """Add a delta to a cached balance; balances that are not cached are left to load lazily.
+
+    Entries are counted under the same rule as `_load_buckets`: posted by today and not
+    yet expired (future-dated ones are picked up by `reconcile_balances`).
+    """
+    current = str(getdate(today()))
+    expiry = str(getdate(expiry_date)) if expiry_date else current
+    if expiry < current or (posting_date and str(getdate(posting_date)) > current):
+        return
+    cache = frappe.cache()
+    key = _balance_key(cache, customer, loyalty_program)
+    cache.eval(
+        APPLY_LUA,
+        1,
+        key,
+        f"{expiry}|points",
+        repr(flt(points)),
+        f"{expiry}|spent",
+        repr(flt(spent)),
+        UNLOADED_TTL,
+    )
+
+
+def _after_commit(fn, *args):
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is not None:
+        after_commit.add(lambda: fn(*args))
+    else:
+        fn(*args)
+
+
+def on_entry_insert(doc, method=None):
+    """doc_events hook: Loyalty Point Entry after_insert."""
+    _after_commit(
+        _apply,
+        doc.customer,
+        doc.loyalty_program,
+        doc.posting_date,
+        doc.expiry_date,
+        doc.loyalty_points,
+        doc.purchase_amount,
+    )
+
+
+def on_entry_trash(doc, method=None):
+    """doc_events hook: Loyalty Point Entry on_trash."""
+    _after_commit(
+        _apply,
+        doc.customer,
+        doc.loyalty_program,
+        doc.posting_date,
+        doc.expiry_date,
+        -flt(doc.loyalty_points),
+        -flt(doc.purchase_amount),
+    )
+
+
+def _cached_balance_keys(cache, customer=None):
+    """{(customer, program): redis key} of every cached balance (of `customer`, if given)."""
+    prefix = _decode(cache.make_key(BALANCE_KEY.format("")))
+    pattern = prefix + (f"{customer}|" if customer else "") + "*"
+    keys = {}
+    for key in cache.scan_iter(match=pattern, count=1000):
+        field = _decode(key)[len(prefix) :]
+        name, _, program = field.rpartition("|")
+        if customer is None or name == customer:
+            keys[(name, program)] = key
+    return keys
+
+
+def invalidate_customer(customer):
+    cache = frappe.cache()
+    keys = list(_cached_balance_keys(cache, customer).values())
+    if keys:
+        cache.delete(*keys)
+
+
+def on_invoice_cancel(doc, method=None):
+    """doc_events hook: Sales Invoice on_cancel (its loyalty entries are deleted with raw SQL)."""
+    if doc.get("customer") and (doc.get("loyalty_program") or doc.get("redeem_loyalty_points")):
+        _after_commit(invalidate_customer, doc.customer)
+
+
+def on_program_change(doc, method=None):
+    """doc_events hook: Loyalty Program on_update/on_trash."""
+    frappe.cache().hdel(PROGRAM_KEY, doc.name)
+
+
+def reconcile_balances():
+    """Scheduler job: recompute cached balances from the ledger, fix and report drift."""
+    cache = frappe.cache()
+    keys = _cached_balance_keys(cache)
+    # Generations are read before the ledger, so a delta committed in between is detected
+    cached, generations = {}, {}
+    for balance, key in keys.items():
+        cached[balance], generations[balance] = _read_buckets(cache, key)
+
+    drift = []
+    customers = sorted({customer for customer, _ in cached})
+    for start in range(0, len(customers), RECONCILE_CHUNK):
+        chunk = set(customers[start : start + RECONCILE_CHUNK])
+        ledger = _load_buckets(list(chunk))
+        for key in [k for k in cached if k[0] in chunk and cached[k] is not None]:
+            expected = ledger.get(key, {})
+            cached_points, _ = _totals(cached[key])
+            ledger_points, _ = _totals(expected)
+            if abs(cached_points - ledger_points) > 0.0001:
+                drift.append(
+                    {"customer": key[0], "loyalty_program": key[1], "cached": cached_points, "ledger": ledger_points}
+                )
+            # Rewrite either way, which also prunes expired buckets
+            _write_buckets(cache, keys[key], expected, generations[key])
+
+    metrics.set_fields(
+        METRICS_NAME, {"reconciled": sum(1 for buckets in cached.values() if buckets is not None), "last_drift": len(drift)}
+    )
+    if drift:
+        metrics.incr(METRICS_NAME, "drift", len(drift))
+        frappe.log_error({"drift": drift[:100], "count": len(drift)}, "LINE Loyalty Balance Drift")
+    return drift
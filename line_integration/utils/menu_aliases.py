@@ -0,0 +1,111 @@
+"""
+Menu item aliases and the names customers typed that matched nothing.
+
+Aliases live in the `custom_line_menu_aliases` child table on Item. They are compiled
+into the catalog's item map next to the item names, so an alias resolves with a plain
+dictionary hit. Names that ended up in `unknown` while parsing order text are counted in
+Redis per normalized key; the "Unmatched LINE Menu Names" report lists them with the
+closest menu item, as candidates for new aliases. Each catalog rebuild (which an alias
+change triggers) forgets the names the new catalog resolves.
+"""
+
+import json
+
+import frappe
+from frappe.utils import now_datetime
+
+ALIAS_DOCTYPE = "LINE Menu Item Alias"
+ALIAS_FIELD = "custom_line_menu_aliases"
+UNMATCHED_COUNT_KEY = "line_unmatched_menu_names"
+UNMATCHED_INFO_KEY = "line_unmatched_menu_names_info"
+# Stop tracking new names past this many, so random chatter cannot grow the hash forever
+MAX_UNMATCHED = 2000
+
+
+def load_aliases(item_codes):
+    """{item_code: [alias, ...]} for `item_codes`, in one query."""
+    if not item_codes:
+        return {}
+    aliases = {}
+    for row in frappe.get_all(
+        ALIAS_DOCTYPE,
+        filters={"parenttype": "Item", "parentfield": ALIAS_FIELD, "parent": ["in", list(item_codes)]},
+        fields=["parent", "alias"],
+        order_by="idx asc",
+    ):
+        if (row.alias or "").strip():
+            aliases.setdefault(row.parent, []).append(row.alias.strip())
+    return aliases
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def record_unmatched(names):
+    """Count names from `parse_orders_from_text`'s `unknown` list; never raises."""
+    from line_integration.api.line_webhook import normalize_key
+
+    keyed = {normalize_key(name): name for name in names or [] if normalize_key(name)}
+    if not keyed:
+        return
+    try:
+        cache = frappe.cache()
+        count_key = cache.make_key(UNMATCHED_COUNT_KEY)
+        info_key = cache.make_key(UNMATCHED_INFO_KEY)
+        keys = list(keyed)
+        pipe = cache.pipeline()
+        pipe.hlen(count_key)
+        pipe.hmget(count_key, keys)
+        size, existing = pipe.execute()
+        pipe = cache.pipeline()
+        for key, seen in zip(keys, existing, strict=True):
+            if seen is None and size >= MAX_UNMATCHED:
+                continue
+            name = keyed[key]
+            pipe.hincrby(count_key, key, 1)
+            pipe.hset(info_key, key, json.dumps({"name": name, "last_seen": str(now_datetime())}, ensure_ascii=False))
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def get_unmatched():
+    """[{key, name, count, last_seen}] of recorded names, most frequent first."""
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    pipe.hgetall(cache.make_key(UNMATCHED_COUNT_KEY))
+    pipe.hgetall(cache.make_key(UNMATCHED_INFO_KEY))
+    counts, infos = pipe.execute()
+    rows = []
+    for key, count in (counts or {}).items():
+        key = _decode(key)
+        info = (infos or {}).get(key.encode()) or (infos or {}).get(key)
+        info = json.loads(_decode(info)) if info else {}
+        rows.append({"key": key, "name": info.get("name") or key, "count": int(count), "last_seen": info.get("last_seen")})
+    rows.sort(key=lambda row: (-row["count"], row["key"]))
+    return rows
+
+
+def forget_unmatched(keys):
+    keys = [key for key in keys or [] if key]
+    if not keys:
+        return
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    pipe.hdel(cache.make_key(UNMATCHED_COUNT_KEY), *keys)
+    pipe.hdel(cache.make_key(UNMATCHED_INFO_KEY), *keys)
+    pipe.execute()
+
+
+def forget_matched(matcher):
+    """Forget recorded names that `matcher` now resolves (an alias or rename added since)."""
+    forget_unmatched([row["key"] for row in get_unmatched() if matcher.match(row["key"])])
+
+
+@frappe.whitelist()
+def clear_unmatched():
+    """Reset the unmatched name counts (from the report's button)."""
+    frappe.only_for(("System Manager", "Stock Manager"))
+    cache = frappe.cache()
+    cache.delete_value([UNMATCHED_COUNT_KEY, UNMATCHED_INFO_KEY])
@@ -0,0 +1,202 @@
+"""
+Versioned snapshot of the LINE menu catalog.
+
+Menu items (name, description, public image path and resized variants, normalized lookup
+key and aliases) are read from the database once, stored in Redis together with a version
+number and kept in process memory. Readers only compare the version (one Redis GET) and
+reuse the in-memory copy.
+Item/File changes rebuild the snapshot in a background job, which stores it first and only
+then moves the version to it, so readers keep using the previous snapshot meanwhile
+instead of all rebuilding it inline.
+"""
+
+import time
+
+import frappe
+from frappe.utils import get_url, now_datetime
+
+from line_integration.utils import (
+    coalesced_job,
+    image_urls,
+    image_variants,
+    menu_aliases,
+    menu_publisher,
+    metrics,
+)
+from line_integration.utils.menu_matcher import MenuMatcher
+
+METRICS_NAME = "menu_catalog"
+SNAPSHOT_KEY = "line_menu_catalog"
+VERSION_KEY = "line_menu_catalog_version"
+REBUILD_JOB = "menu_catalog_rebuild"
+MAX_ITEMS = 1000
+ITEM_FIELDS = [
+    "name",
+    "item_name",
+    "description",
+    "custom_line_menu_image",
+    image_variants.VARIANTS_FIELD,
+    "standard_rate",
+]
+
+# Per-process copies, one per site: a worker can serve several sites of a bench
+_local = {}
+
+
+def _site_local():
+    site = getattr(frappe.local, "site", None) or ""
+    return _local.setdefault(site, {"site": site, "version": None, "catalog": None, "matcher": None})
+
+
+def _current_version():
+    cache = frappe.cache()
+    value = cache.get(cache.make_key(VERSION_KEY))
+    return int(value) if value else 0
+
+
+def _set_version(version):
+    cache = frappe.cache()
+    cache.set(cache.make_key(VERSION_KEY), version)
+
+
+def build_catalog(version=None):
+    """Read menu items from the database and store them as snapshot `version`."""
+    from line_integration.api.line_webhook import normalize_key
+
+    if version is None:
+        version = _current_version()
+    rows = frappe.get_all(
+        "Item",
+        filters={"custom_add_in_line_menu": 1},
+        fields=ITEM_FIELDS,
+        order_by="item_name asc",
+        limit=MAX_ITEMS,
+    )
+    images = image_urls.public_paths({row.custom_line_menu_image for row in rows if row.custom_line_menu_image})
+    aliases = menu_aliases.load_aliases([row.name for row in rows])
+    items = []
+    for row in rows:
+        row.description = (row.description or "").strip()
+        row.image_path = images.get(row.custom_line_menu_image) if row.custom_line_menu_image else None
+        variants = row.pop(image_variants.VARIANTS_FIELD, None)
+        row.image_variants = image_variants.parse_variants(variants, row.custom_line_menu_image) if row.image_path else {}
+        row.key = normalize_key(row.item_name or row.name)
+        row.aliases = aliases.get(row.name, [])
+        items.append(row)
+    item_map = {item.key: item for item in items}
+    # Aliases resolve like names, but never take over another item's name
+    for item in items:
+        for alias in item.aliases:
+            item_map.setdefault(normalize_key(alias), item)
+    catalog = frappe._dict(
+        version=version,
+        built_at=str(now_datetime()),
+        built_ts=time.time(),
+        items=items,
+        item_map=item_map,
+        image_paths=sorted({row.custom_line_menu_image for row in rows if row.custom_line_menu_image}),
+    )
+    try:
+        frappe.cache().set_value(SNAPSHOT_KEY, catalog)
+    except Exception:
+        pass
+    metrics.incr(METRICS_NAME, "built")
+    return catalog
+
+
+def get_catalog():
+    """Current snapshot; rebuilt inline only when Redis has none for the current version."""
+    try:
+        version = _current_version()
+    except Exception:
+        # Redis unavailable: serve straight from the database
+        return build_catalog(version=0)
+    local = _site_local()
+    if local["catalog"] is not None and local["version"] == version and local["catalog"].get("site") == local["site"]:
+        return local["catalog"]
+    catalog = frappe.cache().get_value(SNAPSHOT_KEY)
+    if not catalog or catalog.get("version") != version:
+        metrics.incr(METRICS_NAME, "miss")
+        catalog = build_catalog(version)
+    catalog.site = local["site"]
+    local.update(version=version, catalog=catalog, matcher=None)
+    return catalog
+
+
+def get_menu_items(limit=None):
+    """Menu items ordered by item_name; treat the returned rows as read-only."""
+    items = get_catalog().items
+    return items[:limit] if limit else items
+
+
+def get_item_map():
+    """{normalized item name or alias: item} used by the order text parser."""
+    return get_catalog().item_map
+
+
+def get_matcher():
+    """Compiled MenuMatcher over the current item map, built once per version per process."""
+    catalog = get_catalog()
+    local = _site_local()
+    matcher = local.get("matcher")
+    if matcher is None or matcher[0] is not catalog:
+        matcher = (catalog, MenuMatcher.from_item_map(catalog.item_map))
+        local["matcher"] = matcher
+    return matcher[1]
+
+
+def get_version():
+    return get_catalog().version
+
+
+def image_url(item, width=None, fmt="jpeg"):
+    """Absolute URL of a catalog item's public menu image, or None.
+
+    With `width`, the closest resized `fmt` variant is used when one has been generated.
+    """
+    path = item.get("image_path")
+    if not path:
+        return None
+    if width:
+        path = image_variants.pick_variant(item.get("image_variants"), width, fmt) or path
+    try:
+        return get_url(path)
+    except Exception:
+        return None
+
+
+def rebuild_catalog():
+    """Background job: rebuild the snapshot as a new version and republish the static menu."""
+    coalesced_job.run(REBUILD_JOB, _rebuild)
+
+
+def _rebuild():
+    catalog = build_catalog(_current_version() + 1)
+    # Readers switch only once the new snapshot is stored
+    _set_version(catalog.version)
+    menu_publisher.schedule_publish()
+    menu_aliases.forget_matched(MenuMatcher.from_item_map(catalog.item_map))
+
+
+def schedule_rebuild():
+    coalesced_job.schedule("line_integration.utils.menu_catalog.rebuild_catalog", REBUILD_JOB)
+
+
+def on_item_change(doc, method=None, *args):
+    """doc_events hook for Item: rebuild when a menu item (or a former one) changes."""
+    before = doc.get_doc_before_save() if method != "on_trash" else None
+    if doc.get("custom_add_in_line_menu") or (before and before.get("custom_add_in_line_menu")):
+        schedule_rebuild()
+
+
+def on_file_change(doc, method=None):
+    """doc_events hook for File: rebuild when a menu image is updated or removed."""
+    file_url = doc.get("file_url")
+    if not file_url:
+        return
+    try:
+        catalog = frappe.cache().get_value(SNAPSHOT_KEY) or _site_local()["catalog"]
+    except Exception:
+        catalog = _site_local()["catalog"]
+    if catalog is None or file_url in (catalog.get("image_paths") or []):
+        schedule_rebuild()
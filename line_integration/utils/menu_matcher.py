@@ -0,0 +1,189 @@
+"""
+Indexed matcher from typed menu names to menu items.
+
+Built once per catalog version from normalized keys (see `line_webhook.normalize_key`).
+A query is resolved by, in order:
+
+1. an exact dictionary hit (confidence 1.0);
+2. the same key with Thai tone marks folded away (confidence FOLDED_SCORE);
+3. scoring a small candidate set. Candidates are menu keys contained in the query (found
+   with an Aho-Corasick automaton, e.g. "byeheavy" in "1byeheavy") plus keys sharing
+   character bigrams with it (inverted index, probing only the rarest grams a qualifying
+   key must share). Each candidate is scored by containment coverage or bigram Dice
+   similarity, whichever is higher, so typos still match. Candidates are scored in order
+   of an upper bound on their score, stopping once no remaining one can win.
+
+The best candidate is returned when its score reaches MIN_SCORE. Ties prefer the key
+closest in length to the query, then the alphabetically first key, so results no longer
+depend on dict order. Pure Python with no Frappe imports, so the benchmark can run
+anywhere.
+"""
+
+import math
+from collections import Counter, deque, namedtuple
+
+MIN_SCORE = 0.6
+FOLDED_SCORE = 0.95
+NGRAM = 2
+# Tone marks and other marks customers often omit or mistype
+THAI_FOLD = {ord(ch): None for ch in "็่้๊๋์ํ"}
+
+Match = namedtuple("Match", ["item", "key", "score"])
+
+
+def fold(key):
+    return (key or "").translate(THAI_FOLD)
+
+
+def ngrams(key):
+    padded = f"^{key}$"
+    return {padded[i : i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+class _Automaton:
+    """Aho-Corasick automaton reporting every pattern index contained in a text."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(index)
+
+        # Breadth-first, so a state's failure link is final before its children need it;
+        # depth-1 states keep failure link 0
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text):
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.out[state]:
+                found.update(self.out[state])
+        return found
+
+
+class MenuMatcher:
+    def __init__(self, entries):
+        """`entries`: iterable of (normalized key, item); the first item wins per key."""
+        self.exact = {}
+        for key, item in entries:
+            if key and key not in self.exact:
+                self.exact[key] = item
+        self.keys = sorted(self.exact)
+        self.folded_keys = [fold(key) for key in self.keys]
+        self.folded = {}
+        for index, folded in enumerate(self.folded_keys):
+            self.folded.setdefault(folded, index)
+        self.grams = [ngrams(folded) for folded in self.folded_keys]
+        self.postings = {}
+        for index, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(index)
+        self.automaton = _Automaton(self.folded_keys)
+
+    @classmethod
+    def from_item_map(cls, item_map):
+        return cls((item_map or {}).items())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _match(self, index, score):
+        key = self.keys[index]
+        return Match(self.exact[key], key, round(score, 4))
+
+    def _probe_grams(self, query_grams):
+        """Rarest query grams that any key able to reach MIN_SCORE must share one of.
+
+        A key scoring MIN_SCORE by Dice shares at least t*a/(2-t) of the query's `a`
+        grams; a key containing the query shares its a-2 inner grams. Whichever is
+        smaller is the minimum overlap `m`, so probing the a-m+1 rarest grams is enough.
+        """
+        size = len(query_grams)
+        overlap = min(math.ceil(MIN_SCORE * size / (2 - MIN_SCORE)), size - 2)
+        ordered = sorted(query_grams, key=lambda gram: len(self.postings.get(gram, ())))
+        return ordered[: size - max(overlap, 1) + 1]
+
+    def candidates(self, key, limit=3):
+        """Best matches for normalized `key`, highest score first."""
+        if not key:
+            return []
+        if key in self.exact:
+            return [Match(self.exact[key], key, 1.0)]
+        query = fold(key)
+        if query in self.folded:
+            return [self._match(self.folded[query], FOLDED_SCORE)]
+
+        query_grams = ngrams(query)
+        size = len(query_grams)
+        contained = self.automaton.find(query)
+        probe = self._probe_grams(query_grams)
+        hits = Counter()
+        for gram in probe:
+            hits.update(self.postings.get(gram, ()))
+        # Unprobed grams can add at most this much overlap
+        unprobed = size - len(probe)
+
+        bounded = []
+        for index in set(hits) | contained:
+            candidate = self.folded_keys[index]
+            if index in contained:
+                bound = 1.0
+            elif len(candidate) > len(query) and query in candidate:
+                bound = 1.0
+            else:
+                gram_count = len(self.grams[index])
+                bound = 2.0 * min(hits[index] + unprobed, size, gram_count) / (size + gram_count)
+            if bound >= MIN_SCORE:
+                bounded.append((bound, index))
+        bounded.sort(reverse=True)
+
+        scored = []
+        for bound, index in bounded:
+            if len(scored) >= limit and bound < -scored[limit - 1][0]:
+                # No remaining candidate can beat the current top `limit`
+                break
+            candidate = self.folded_keys[index]
+            grams = self.grams[index]
+            dice = 2.0 * len(query_grams & grams) / (size + len(grams))
+            if index in contained:
+                coverage = 0.5 + 0.5 * len(candidate) / len(query)
+            elif len(candidate) > len(query) and query in candidate:
+                coverage = 0.5 + 0.5 * len(query) / len(candidate)
+            else:
+                coverage = 0.0
+            scored.append((-max(dice, coverage), abs(len(candidate) - len(query)), self.keys[index], index))
+            scored.sort()
+        return [self._match(index, -negative) for negative, _, _, index in scored[:limit]]
+
+    def match(self, key, min_score=MIN_SCORE):
+        """Best Match for normalized `key`, or None below `min_score`."""
+        best = self.candidates(key, limit=1)
+        if best and best[0].score >= min_score:
+            return best[0]
+        return None
@@ -0,0 +1,116 @@
+"""
+Static, pre-rendered LIFF menu.
+
+The non-personalized menu (items, images, base prices) is rendered to
+`public/files/line_menu/menu-<hash>.json`, which nginx serves without going through
+Frappe. The file name changes with the content, so clients and proxies can cache each
+file forever. The current version and URL are kept in Redis for the `liff_menu_version`
+endpoint. For registered customers, `liff_get_menu_prices` returns them together with
+the customer's prices, and answers 304 while neither has changed.
+
+The menu is republished in a background job after a catalog rebuild or a price change,
+and daily for date-bound prices. Publishes are coalesced with `coalesced_job`, so an edit
+made during a publish is published too. Unchanged content is not rewritten. The last
+KEEP_VERSIONS files are kept so clients that just read the version can still fetch
+their file.
+"""
+
+import hashlib
+import os
+
+import frappe
+from frappe.utils import get_url, now_datetime
+
+from line_integration.utils import coalesced_job, metrics
+
+METRICS_NAME = "menu_publisher"
+STATE_KEY = "line_menu_static"
+PUBLISH_DIR = "line_menu"
+FILE_PREFIX = "menu-"
+KEEP_VERSIONS = 3
+PUBLISH_JOB = "menu_static_publish"
+
+
+def _publish_path(file_name=""):
+    return frappe.get_site_path("public", "files", PUBLISH_DIR, file_name)
+
+
+def render_menu():
+    """JSON body of the non-personalized menu, as `liff_get_menu` returns it to guests."""
+    from line_integration.api.liff_api import MENU_FORMAT_VERSION, build_menu
+
+    return frappe.as_json(
+        {"format": MENU_FORMAT_VERSION, "items": build_menu(customer=None)},
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _write_atomic(path, body):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def _prune(keep):
+    directory = _publish_path()
+    files = [
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith(FILE_PREFIX) and name.endswith(".json")
+    ]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[KEEP_VERSIONS:]:
+        if os.path.basename(path) != keep:
+            os.remove(path)
+
+
+def publish_menu():
+    """Background job: render the menu and publish it if its content changed."""
+    coalesced_job.run(PUBLISH_JOB, _publish)
+    return get_published()
+
+
+def _publish():
+    body = render_menu()
+    version = hashlib.sha1(body).hexdigest()[:16]
+    state = get_published()
+    file_name = f"{FILE_PREFIX}{version}.json"
+    path = _publish_path(file_name)
+    if state.get("version") == version and os.path.exists(path):
+        return
+
+    os.makedirs(_publish_path(), exist_ok=True)
+    _write_atomic(path, body)
+    state = {
+        "version": version,
+        "path": f"/files/{PUBLISH_DIR}/{file_name}",
+        "size": len(body),
+        "published_at": str(now_datetime()),
+    }
+    frappe.cache().set_value(STATE_KEY, state)
+    _prune(keep=file_name)
+    metrics.incr(METRICS_NAME, "published")
+
+
+def get_published():
+    """{version, path, size, published_at} of the current static menu, or {}."""
+    try:
+        return frappe.cache().get_value(STATE_KEY) or {}
+    except Exception:
+        return {}
+
+
+def get_version_info():
+    """Response of the version endpoint; schedules a publish when nothing is published."""
+    state = get_published()
+    if not state.get("version"):
+        schedule_publish()
+        return {"version": None, "url": None}
+    return {"version": state["version"], "url": get_url(state["path"])}
+
+
+def schedule_publish(doc=None, method=None):
+    """Queue a publish; also usable as a doc_events hook and as the daily scheduler job."""
+    coalesced_job.schedule("line_integration.utils.menu_publisher.publish_menu", PUBLISH_JOB)
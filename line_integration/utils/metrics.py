@@ -0,0 +1,64 @@
+import frappe
+
+
+def _key(name):
+    return frappe.cache().make_key(f"line_metrics:{name}")
+
+
+def incr(name, field, amount=1):
+    """Increment a counter in the metrics hash `name`; never raises."""
+    try:
+        frappe.cache().hincrby(_key(name), field, int(amount))
+    except Exception:
+        pass
+
+
+def set_fields(name, values):
+    """Overwrite gauge-style fields (last lag, timestamps) in the metrics hash."""
+    if not values:
+        return
+    try:
+        pipe = frappe.cache().pipeline()
+        pipe.hset(_key(name), mapping={k: v for k, v in values.items() if v is not None})
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def set_max(name, field, value):
+    """Keep the highest value seen for `field` (e.g. max lag)."""
+    try:
+        pipe = frappe.cache().pipeline()
+        pipe.hget(_key(name), field)
+        current = pipe.execute()[0]
+        if current is None or float(current) < float(value):
+            set_fields(name, {field: value})
+    except Exception:
+        pass
+
+
+def get_all(name):
+    """Return the metrics hash as a dict of numbers."""
+    try:
+        pipe = frappe.cache().pipeline()
+        pipe.hgetall(_key(name))
+        raw = pipe.execute()[0] or {}
+    except Exception:
+        return {}
+    result = {}
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        value = value.decode() if isinstance(value, bytes) else value
+        try:
+            number = float(value)
+            result[field] = int(number) if number.is_integer() else number
+        except (TypeError, ValueError):
+            result[field] = value
+    return result
+
+
+def reset(name):
+    try:
+        frappe.cache().delete(_key(name))
+    except Exception:
+        pass
@@ -0,0 +1,149 @@
+"""
+Idempotency records for LIFF order submission.
+
+Each submission carries a client-generated key. The first request reserves
+`line_liff_order:{customer}:{key}` with SET NX; repeats read the stored record instead of
+creating another Sales Order. Records move queued -> done | failed and expire after
+RECORD_TTL. A failed record can be reserved again, so a retry after a failure re-runs it,
+and so can a record left "queued" for STALE_SECONDS by a request or job that died. Taking
+over a record is a compare-and-set on its old value, so only one retry wins.
+
+The key is also stored on the Sales Order, in the same transaction as the order. A
+worker can die after committing the order but before recording the result. In that
+case, a stale record is completed from that order instead of being taken over, so the
+retry does not create a second Sales Order.
+"""
+
+import json
+import time
+
+import frappe
+from frappe.utils.background_jobs import is_job_enqueued
+
+from line_integration.utils import metrics
+
+METRICS_NAME = "order_submission"
+RECORD_KEY = "line_liff_order:{0}:{1}"
+RECORD_TTL = 86400
+# A record still "queued" after this long died before committing (for async records,
+# only once its job is no longer queued or running)
+STALE_SECONDS = 300
+MAX_KEY_LENGTH = 100
+RESERVE_ATTEMPTS = 3
+
+# KEYS[1]=record, ARGV: expected old value, new value, ttl -> 1 if replaced
+COMPARE_AND_SET_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+QUEUED = "queued"
+DONE = "done"
+FAILED = "failed"
+
+
+def _key(customer, idempotency_key):
+    return frappe.cache().make_key(RECORD_KEY.format(customer, idempotency_key))
+
+
+def clean_key(idempotency_key):
+    key = (idempotency_key or "").strip()
+    if not key or len(key) > MAX_KEY_LENGTH or not key.replace("-", "").replace("_", "").isalnum():
+        frappe.throw("Invalid idempotency key", frappe.ValidationError)
+    return key
+
+
+def get_record(customer, idempotency_key):
+    value = frappe.cache().get(_key(customer, idempotency_key))
+    return json.loads(value) if value else None
+
+
+def job_id(customer, idempotency_key):
+    """RQ job id of an async submission."""
+    return RECORD_KEY.format(customer, idempotency_key)
+
+
+def find_order(customer, idempotency_key):
+    """The submitted Sales Order created under `idempotency_key`, or None."""
+    name = frappe.db.get_value(
+        "Sales Order",
+        {"customer": customer, "line_idempotency_key": idempotency_key, "docstatus": 1},
+        "name",
+    )
+    return frappe.get_doc("Sales Order", name) if name else None
+
+
+def _recover(customer, idempotency_key):
+    """Record of an order committed under the key whose result was never recorded, or None."""
+    so = find_order(customer, idempotency_key)
+    if not so:
+        return None
+    from line_integration.api.liff_api import order_result
+
+    result = dict(order_result(so), job_id=idempotency_key)
+    mark_done(customer, idempotency_key, result)
+    metrics.incr(METRICS_NAME, "recovered")
+    return {"status": DONE, "job_id": idempotency_key, "result": result}
+
+
+def _retryable(customer, record):
+    if record.get("status") == FAILED:
+        return True
+    if record.get("status") != QUEUED or time.time() - float(record.get("created") or 0) <= STALE_SECONDS:
+        return False
+    return record.get("sync") or not is_job_enqueued(job_id(customer, record.get("job_id")))
+
+
+def reserve(customer, idempotency_key, sync=False):
+    """Claim the key. Returns None if claimed, otherwise the record of the earlier request."""
+    record = json.dumps({"status": QUEUED, "job_id": idempotency_key, "created": time.time(), "sync": sync})
+    cache = frappe.cache()
+    key = _key(customer, idempotency_key)
+    existing = None
+    for _ in range(RESERVE_ATTEMPTS):
+        if cache.set(key, record, nx=True, ex=RECORD_TTL):
+            return None
+        raw = cache.get(key)
+        if raw is None:
+            # Expired meanwhile
+            continue
+        existing = json.loads(raw)
+        if not _retryable(customer, existing):
+            break
+        if existing.get("status") == QUEUED:
+            recovered = _recover(customer, idempotency_key)
+            if recovered:
+                return recovered
+        # Previous attempt failed or died: take it over unless another retry already did
+        if cache.eval(COMPARE_AND_SET_LUA, 1, key, raw, record, RECORD_TTL):
+            metrics.incr(METRICS_NAME, "retry")
+            return None
+    metrics.incr(METRICS_NAME, "duplicate")
+    return existing or json.loads(record)
+
+
+def _store(customer, idempotency_key, record):
+    frappe.cache().set(_key(customer, idempotency_key), json.dumps(record, default=str), ex=RECORD_TTL)
+
+
+def mark_done(customer, idempotency_key, result):
+    _store(customer, idempotency_key, {"status": DONE, "job_id": idempotency_key, "result": result})
+    metrics.incr(METRICS_NAME, "done")
+
+
+def mark_failed(customer, idempotency_key, error):
+    _store(customer, idempotency_key, {"status": FAILED, "job_id": idempotency_key, "error": error})
+    metrics.incr(METRICS_NAME, "failed")
+
+
+def to_response(record):
+    """Endpoint response for a stored record."""
+    status = (record or {}).get("status")
+    if status == DONE:
+        return dict(record["result"], job_id=record.get("job_id"), status=DONE)
+    if status == FAILED:
+        return {"success": False, "status": FAILED, "job_id": record.get("job_id"), "error": record.get("error")}
+    return {"success": True, "pending": True, "status": QUEUED, "job_id": (record or {}).get("job_id")}
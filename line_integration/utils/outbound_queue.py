@@ -0,0 +1,245 @@
+"""
+Durable outbound queue for LINE messages.
+
+Pushes, multicasts and replies that LINE rejects with 429/5xx (or that never reach it)
+are stored as `LINE Outbound Message` documents and retried by a worker with
+exponential backoff, honouring `Retry-After`. Push and multicast retries reuse the
+original `X-Line-Retry-Key`, so LINE accepts each message at most once.
+
+All senders share a Redis token bucket, capping the channel-wide send rate across every
+web and background worker. The per-minute cron only hands due messages to short-queue
+jobs, so slow or throttled sends never hold up the scheduler.
+
+`reply_message` and `push_message` return QUEUED instead of True when the message was
+only stored for a later attempt.
+"""
+
+import json
+import random
+import time
+
+import frappe
+from frappe.utils import add_to_date, get_datetime, now_datetime
+
+from line_integration.utils import metrics
+
+DOCTYPE = "LINE Outbound Message"
+METRICS_NAME = "outbound_queue"
+RETRYABLE_STATUS = {408, 429}
+BACKOFF_BASE = 5
+BACKOFF_MAX = 900
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_RATE_PER_SECOND = 50
+# LINE reply tokens are only valid for a short time after the event
+REPLY_TOKEN_TTL = 50
+STALE_SENDING_MINUTES = 10
+BATCH_LIMIT = 500
+RATE_LIMITED = "local rate limit"
+# Returned by the senders when a message was stored for retry rather than delivered
+QUEUED = "queued"
+JOB_ID = "line_outbound_message:{0}"
+
+BUCKET_KEY = "line_outbound_token_bucket"
+# KEYS[1]=bucket, ARGV: rate, capacity, now, cost -> {allowed, wait_seconds}
+TOKEN_BUCKET_LUA = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+def is_retryable(status_code):
+    """None means the request never got a response (timeout, connection reset)."""
+    return status_code is None or status_code in RETRYABLE_STATUS or status_code >= 500
+
+
+def _rate(settings):
+    rate = float(getattr(settings, "outbound_rate_per_second", 0) or 0) if settings else 0
+    return rate if rate > 0 else DEFAULT_RATE_PER_SECOND
+
+
+def acquire_send_token(settings=None, cost=1, max_wait=0.5):
+    """Take `cost` tokens from the shared bucket, waiting up to `max_wait` seconds.
+
+    Fails open when Redis is unavailable so messaging never depends on the limiter.
+    """
+    rate = _rate(settings)
+    capacity = max(rate, cost)
+    deadline = time.time() + max_wait
+    try:
+        cache = frappe.cache()
+        key = cache.make_key(BUCKET_KEY)
+        while True:
+            allowed, wait = cache.eval(TOKEN_BUCKET_LUA, 1, key, rate, capacity, time.time(), cost)
+            if int(allowed):
+                return True
+            wait = float(wait)
+            if time.time() + wait > deadline:
+                metrics.incr(METRICS_NAME, "throttled")
+                return False
+            time.sleep(wait)
+    except Exception:
+        return True
+
+
+def queue_message(kind, recipient, messages, retry_key=None, status_code=None, error=None, retry_after=None):
+    """Persist a message for retry. Returns the document name or None if it could not be stored."""
+    delay = _retry_after_seconds(retry_after)
+    try:
+        doc = frappe.get_doc(
+            {
+                "doctype": DOCTYPE,
+                "kind": kind,
+                "status": "Queued",
+                "recipient": json.dumps(recipient) if isinstance(recipient, (list, tuple)) else recipient,
+                "messages": json.dumps(messages, ensure_ascii=False),
+                "retry_key": retry_key,
+                "attempts": 0 if error == RATE_LIMITED else 1,
+                "last_status_code": status_code,
+                "last_error": error,
+                "next_attempt_at": add_to_date(now_datetime(), seconds=delay) if delay else now_datetime(),
+            }
+        ).insert(ignore_permissions=True)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "LINE Outbound Queue Error")
+        return None
+    metrics.incr(METRICS_NAME, "queued")
+    if not delay:
+        _enqueue_send(doc.name, enqueue_after_commit=True)
+    return doc.name
+
+
+def _enqueue_send(name, enqueue_after_commit=False):
+    # The job claims the row before sending, so a duplicate job is harmless; the job id
+    # only saves enqueueing one while another is still waiting
+    frappe.enqueue(
+        "line_integration.utils.outbound_queue.send_queued_message",
+        queue="short",
+        job_id=JOB_ID.format(name),
+        deduplicate=True,
+        enqueue_after_commit=enqueue_after_commit,
+        name=name,
+    )
+
+
+def _retry_after_seconds(value):
+    try:
+        return max(int(float(value)), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _backoff_seconds(attempts):
+    delay = min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 4)
+
+
+def _claim(name):
+    """Lock the row and flip Queued -> Sending so concurrent workers skip it."""
+    status = frappe.db.get_value(DOCTYPE, name, "status", for_update=True)
+    if status != "Queued":
+        frappe.db.rollback()
+        return False
+    frappe.db.set_value(DOCTYPE, name, "status", "Sending")
+    frappe.db.commit()
+    return True
+
+
+def send_queued_message(name):
+    """RQ job: attempt one queued message and schedule the next retry if needed."""
+    from line_integration.utils.line_client import get_settings, send_line_message
+
+    if not _claim(name):
+        return
+    doc = frappe.get_doc(DOCTYPE, name)
+    settings = get_settings()
+    max_attempts = int(getattr(settings, "outbound_max_attempts", 0) or DEFAULT_MAX_ATTEMPTS)
+
+    if doc.kind == "Reply" and (now_datetime() - get_datetime(doc.creation)).total_seconds() > REPLY_TOKEN_TTL:
+        _finish(doc, "Failed", error="reply token expired")
+        return
+    if not acquire_send_token(settings, max_wait=1.0):
+        _reschedule(doc, 1, error=RATE_LIMITED)
+        return
+
+    recipient = json.loads(doc.recipient) if doc.kind == "Multicast" else doc.recipient
+    status_code = None
+    retry_after = None
+    error = None
+    try:
+        resp = send_line_message(doc.kind, recipient, json.loads(doc.messages or "[]"), retry_key=doc.retry_key)
+        status_code = resp.status_code
+        retry_after = resp.headers.get("Retry-After")
+        error = None if status_code == 200 else (resp.text or "")[:500]
+    except Exception as e:
+        error = str(e)[:500] or e.__class__.__name__
+
+    doc.attempts = int(doc.attempts or 0) + 1
+    doc.last_status_code = status_code
+    # 409 with a retry key: LINE already accepted an earlier attempt of this message
+    if status_code == 200 or (status_code == 409 and doc.retry_key):
+        _finish(doc, "Sent")
+        metrics.incr(METRICS_NAME, "sent")
+    elif not is_retryable(status_code) or doc.attempts >= max_attempts:
+        _finish(doc, "Failed", error=error)
+        metrics.incr(METRICS_NAME, "failed")
+        frappe.log_error(
+            {"message": name, "kind": doc.kind, "status": status_code, "error": error},
+            "LINE Outbound Message Failed",
+        )
+    else:
+        delay = _retry_after_seconds(retry_after) or _backoff_seconds(doc.attempts)
+        _reschedule(doc, delay, error=error)
+        metrics.incr(METRICS_NAME, "retried")
+
+
+def _finish(doc, status, error=None):
+    doc.status = status
+    doc.last_error = error
+    doc.next_attempt_at = None
+    doc.save(ignore_permissions=True)
+    frappe.db.commit()
+
+
+def _reschedule(doc, delay, error=None):
+    doc.status = "Queued"
+    doc.last_error = error
+    doc.next_attempt_at = add_to_date(now_datetime(), seconds=delay)
+    doc.save(ignore_permissions=True)
+    frappe.db.commit()
+
+
+def process_due_messages():
+    """Scheduler job: hand every queued message whose retry time has come to a send job."""
+    stale_before = add_to_date(now_datetime(), minutes=-STALE_SENDING_MINUTES)
+    for name in frappe.get_all(
+        DOCTYPE, filters={"status": "Sending", "modified": ["<", stale_before]}, pluck="name"
+    ):
+        frappe.db.set_value(DOCTYPE, name, "status", "Queued", update_modified=False)
+    frappe.db.commit()
+
+    due = frappe.get_all(
+        DOCTYPE,
+        filters={"status": "Queued", "next_attempt_at": ["<=", now_datetime()]},
+        pluck="name",
+        order_by="next_attempt_at asc",
+        limit=BATCH_LIMIT,
+    )
+    for name in due:
+        _enqueue_send(name)
@@ -0,0 +1,248 @@
+"""
+Batched menu pricing for LIFF.
+
+Resolves selling prices for a whole menu with a couple of set-based `Item Price` queries
+instead of one `get_item_details` call (plus fallbacks) per item. Results for the shared,
+non-customer-specific part are cached per (price list, customer group, date) and dropped
+whenever an Item Price or Pricing Rule changes. Each customer's price list, group and
+group ancestors are cached as well, and dropped when the Customer, a Customer Group or
+Selling Settings change.
+
+`liff_get_menu` shows `price_list_rate` whenever it is set, so the only pricing rules that
+change a menu price are item-level "Rate" rules; those are resolved in bulk as well.
+Discount-type rules and rules with a Python `condition` only affect carts.
+"""
+
+import time
+
+import frappe
+from frappe.utils import flt, getdate, today
+
+PRICE_CACHE_KEY = "line_menu_prices"
+# Epoch milliseconds of the last Item Price / Pricing Rule change
+PRICE_VERSION_KEY = "line_menu_price_version"
+CUSTOMER_CACHE_KEY = "line_customer_pricing"
+FALLBACK_PRICE_LIST = "Standard Selling"
+
+
+def get_selling_defaults():
+    """Company/currency defaults used by the menu, read once per request."""
+    return {
+        "company": frappe.db.get_default("Company"),
+        "currency": frappe.db.get_default("Currency") or "THB",
+    }
+
+
+def resolve_price_list(customer=None):
+    """Return (price_list, customer_group) the way ERPNext picks them for a customer."""
+    info = get_customer_pricing(customer)
+    return info["price_list"], info["customer_group"]
+
+
+def get_customer_pricing(customer=None):
+    """Cached {price_list, customer_group, customer_groups, tax_category} of `customer`.
+
+    `customer_groups` is the group with all its ancestors, which is what group pricing
+    rules are matched against.
+    """
+    cache = frappe.cache()
+    field = customer or ""
+    info = cache.hget(CUSTOMER_CACHE_KEY, field)
+    if info is None:
+        info = _load_customer_pricing(customer)
+        cache.hset(CUSTOMER_CACHE_KEY, field, info)
+    return info
+
+
+def _load_customer_pricing(customer):
+    customer_group = None
+    price_list = None
+    tax_category = None
+    if customer:
+        details = frappe.db.get_value(
+            "Customer", customer, ["default_price_list", "customer_group", "tax_category"], as_dict=True
+        ) or {}
+        customer_group = details.get("customer_group")
+        tax_category = details.get("tax_category")
+        price_list = details.get("default_price_list")
+        if not price_list and customer_group:
+            price_list = frappe.db.get_value("Customer Group", customer_group, "default_price_list")
+    if not price_list:
+        price_list = frappe.db.get_single_value("Selling Settings", "selling_price_list")
+    return {
+        "price_list": price_list,
+        "customer_group": customer_group,
+        "customer_groups": _customer_group_ancestors(customer_group),
+        "tax_category": tax_category,
+    }
+
+
+def _customer_group_ancestors(customer_group):
+    """`customer_group` and every group above it in the tree, nearest first."""
+    if not customer_group:
+        return []
+    bounds = frappe.db.get_value("Customer Group", customer_group, ["lft", "rgt"])
+    if not bounds or not bounds[0]:
+        return [customer_group]
+    return frappe.get_all(
+        "Customer Group",
+        filters={"lft": ["<=", bounds[0]], "rgt": [">=", bounds[1]]},
+        pluck="name",
+        order_by="lft desc",
+    )
+
+
+def _query_prices(item_codes, price_lists, date, customer=None):
+    """Best Item Price per (price_list, item_code) valid on `date`.
+
+    Customer-specific rows are only read when `customer` is given; the latest
+    `valid_from` wins, mirroring ERPNext's ordering.
+    """
+    if not item_codes or not price_lists:
+        return {}
+    customer_condition = "ip.customer = %(customer)s" if customer else "IFNULL(ip.customer, '') = ''"
+    rows = frappe.db.sql(
+        f"""
+        SELECT ip.price_list, ip.item_code, ip.price_list_rate
+        FROM `tabItem Price` ip
+        WHERE ip.item_code IN %(item_codes)s
+          AND ip.price_list IN %(price_lists)s
+          AND ip.selling = 1
+          AND {customer_condition}
+          AND IFNULL(ip.valid_from, '2000-01-01') <= %(date)s
+          AND IFNULL(ip.valid_upto, '2500-12-31') >= %(date)s
+        ORDER BY ip.valid_from DESC, ip.modified DESC
+        """,
+        {
+            "item_codes": tuple(item_codes),
+            "price_lists": tuple(price_lists),
+            "customer": customer,
+            "date": date,
+        },
+        as_dict=True,
+    )
+    prices = {}
+    for row in rows:
+        prices.setdefault((row.price_list, row.item_code), flt(row.price_list_rate))
+    return prices
+
+
+def _query_rate_rules(item_codes, price_list, date, customer=None, customer_groups=None):
+    """{item_code: rate} from enabled selling "Rate" pricing rules on Item Code.
+
+    Without `customer` only rules for everyone or for one of `customer_groups` are read;
+    with `customer` only that customer's rules. Highest priority wins.
+    """
+    if not item_codes:
+        return {}
+    if customer:
+        applicable = "pr.applicable_for = 'Customer' AND pr.customer = %(customer)s"
+    else:
+        applicable = (
+            "(IFNULL(pr.applicable_for, '') = ''"
+            " OR (pr.applicable_for = 'Customer Group' AND pr.customer_group IN %(customer_groups)s))"
+        )
+    rows = frappe.db.sql(
+        f"""
+        SELECT pri.item_code, pr.rate
+        FROM `tabPricing Rule` pr
+        INNER JOIN `tabPricing Rule Item Code` pri ON pri.parent = pr.name
+        WHERE pri.item_code IN %(item_codes)s
+          AND pr.disable = 0
+          AND pr.selling = 1
+          AND pr.apply_on = 'Item Code'
+          AND pr.price_or_product_discount = 'Price'
+          AND pr.rate_or_discount = 'Rate'
+          AND pr.rate > 0
+          AND IFNULL(pr.`condition`, '') = ''
+          AND IFNULL(pr.min_qty, 0) <= 1
+          AND IFNULL(pr.for_price_list, '') IN ('', %(price_list)s)
+          AND {applicable}
+          AND IFNULL(pr.valid_from, '2000-01-01') <= %(date)s
+          AND IFNULL(pr.valid_upto, '2500-12-31') >= %(date)s
+        ORDER BY CAST(IFNULL(pr.priority, '0') AS UNSIGNED) DESC, pr.modified DESC
+        """,
+        {
+            "item_codes": tuple(item_codes),
+            "price_list": price_list or "",
+            "customer": customer,
+            "customer_groups": tuple(customer_groups or ("",)),
+            "date": date,
+        },
+        as_dict=True,
+    )
+    rates = {}
+    for row in rows:
+        rates.setdefault(row.item_code, flt(row.rate))
+    return rates
+
+
+def _get_shared_prices(item_codes, price_list, customer_group, customer_groups, date):
+    """Cached {item_code: rate} for everyone in `customer_group`.
+
+    Rate pricing rule first, then the price list, then Standard Selling.
+    """
+    cache = frappe.cache()
+    cache_field = f"{price_list}|{customer_group or ''}|{date}"
+    cached = cache.hget(PRICE_CACHE_KEY, cache_field) or {}
+    missing = [code for code in item_codes if code not in cached]
+    if missing:
+        price_lists = [pl for pl in (price_list, FALLBACK_PRICE_LIST) if pl]
+        found = _query_prices(missing, price_lists, date)
+        rules = _query_rate_rules(missing, price_list, date, customer_groups=customer_groups)
+        for code in missing:
+            rate = rules.get(code) or found.get((price_list, code)) or 0
+            if rate <= 0:
+                rate = found.get((FALLBACK_PRICE_LIST, code)) or 0
+            cached[code] = rate
+        cache.hset(PRICE_CACHE_KEY, cache_field, cached)
+    return {code: cached.get(code, 0) for code in item_codes}
+
+
+def get_menu_prices(items, customer=None, date=None):
+    """Return {item_code: rate} for menu `items` (rows with name and standard_rate).
+
+    Order of precedence per item: customer-specific rule or Item Price, customer group
+    or general rule, price list rate, Standard Selling rate, then the Item's standard_rate.
+    """
+    date = getdate(date or today())
+    item_codes = [item.name for item in items]
+    if not item_codes:
+        return {}
+    info = get_customer_pricing(customer)
+    price_list = info["price_list"]
+    rates = _get_shared_prices(item_codes, price_list, info["customer_group"], info["customer_groups"], date)
+    if customer:
+        own = {code: rate for (_, code), rate in _query_prices(item_codes, [price_list], date, customer=customer).items()}
+        own.update(_query_rate_rules(item_codes, price_list, date, customer=customer))
+        rates.update({code: rate for code, rate in own.items() if rate > 0})
+    for item in items:
+        if (rates.get(item.name) or 0) <= 0:
+            rates[item.name] = flt(item.get("standard_rate"))
+    return rates
+
+
+def get_price_version():
+    """Changes whenever cached menu prices are dropped; 0 if prices never changed."""
+    cache = frappe.cache()
+    value = cache.get(cache.make_key(PRICE_VERSION_KEY))
+    return int(value) if value else 0
+
+
+def clear_price_cache(doc=None, method=None):
+    """doc_events hook for Item Price / Pricing Rule changes."""
+    cache = frappe.cache()
+    cache.delete_value(PRICE_CACHE_KEY)
+    cache.set(cache.make_key(PRICE_VERSION_KEY), int(time.time() * 1000))
+
+
+def on_customer_change(doc, method=None):
+    """doc_events hook for Customer: its price list or group may have changed."""
+    frappe.cache().hdel(CUSTOMER_CACHE_KEY, doc.name)
+
+
+def clear_customer_cache(doc=None, method=None):
+    """doc_events hook for Customer Group / Selling Settings changes."""
+    frappe.cache().delete_value(CUSTOMER_CACHE_KEY)
+    # Shared group prices depend on the group tree and default price lists too
+    clear_price_cache()
@@ -0,0 +1,169 @@
+"""
+Sliding-window rate limits for the guest endpoints (LINE webhook, LIFF API, pings).
+
+Each (endpoint, scope, identity) has a Redis sorted set of request timestamps; one Lua
+call drops timestamps older than the window, counts the rest and records the request if
+it is under the limit. Two scopes are checked:
+
+- "ip": in the `rate_limited` decorator, before the endpoint does any DB or network work.
+- "user": in `check_user`, called once the LINE user id is verified (ID token or cached
+  LIFF session) and before the LINE Profile lookup.
+
+Limits come from LINE Settings (defaults plus a per-endpoint table) and are cached in
+Redis until the settings are saved. A limited request gets a small JSON 429 with
+Retry-After. If Redis is unavailable, requests are allowed.
+"""
+
+import functools
+import json
+import time
+import uuid
+
+import frappe
+from werkzeug.wrappers import Response
+
+from line_integration.utils import metrics
+
+METRICS_NAME = "rate_limit"
+LIMITS_CACHE_KEY = "line_rate_limits"
+WINDOW_KEY = "line_rate_limit:{0}:{1}:{2}"
+IP = "ip"
+USER = "user"
+DEFAULT_WINDOW = 60
+DEFAULT_IP_LIMIT = 120
+DEFAULT_USER_LIMIT = 60
+# Built-in limits for endpoints the generic defaults do not suit; a LINE Settings row wins
+ENDPOINT_DEFAULTS = {
+    # All webhook traffic comes from LINE's own servers
+    "line_webhook": {IP: 1200, USER: 0},
+    "ping": {IP: 60, USER: 0},
+    "liff_debug": {IP: 60, USER: 0},
+    "liff_register": {IP: 20, USER: 5},
+    "liff_submit_order": {IP: 30, USER: 10},
+}
+LIMITED_MESSAGE = "มีการเรียกใช้งานถี่เกินไป กรุณาลองใหม่อีกครั้งในภายหลัง"
+
+# KEYS[1]=window, ARGV: now_ms, window_ms, limit, member -> {allowed, retry_after_ms}
+SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    return {1, 0}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, math.max(1, tonumber(oldest[2]) + window - now)}
+"""
+
+
+class RateLimitExceeded(frappe.TooManyRequestsError):
+    def __init__(self, endpoint, scope, retry_after):
+        super().__init__(LIMITED_MESSAGE)
+        self.endpoint = endpoint
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def _load_limits():
+    settings = frappe.get_cached_doc("LINE Settings")
+    window = int(settings.get("rate_limit_window") or 0) or DEFAULT_WINDOW
+    limits = {
+        "enabled": bool(int(settings.get("enable_rate_limit") or 0)),
+        "default": {
+            "window": window,
+            IP: int(settings.get("rate_limit_per_ip") or 0),
+            USER: int(settings.get("rate_limit_per_user") or 0),
+        },
+        "endpoints": {endpoint: dict(values, window=window) for endpoint, values in ENDPOINT_DEFAULTS.items()},
+    }
+    for row in settings.get("rate_limits") or []:
+        if row.endpoint:
+            limits["endpoints"][row.endpoint] = {
+                "window": int(row.window_seconds or 0) or window,
+                IP: int(row.ip_limit or 0),
+                USER: int(row.user_limit or 0),
+            }
+    return limits
+
+
+def get_limits():
+    return frappe.cache().get_value(LIMITS_CACHE_KEY, generator=_load_limits)
+
+
+def _limit_for(endpoint, scope):
+    """(limit, window seconds) for `endpoint`; a limit of 0 means unlimited."""
+    limits = get_limits()
+    if not limits.get("enabled"):
+        return 0, 0
+    config = limits["endpoints"].get(endpoint) or limits["default"]
+    return int(config.get(scope) or 0), int(config.get("window") or DEFAULT_WINDOW)
+
+
+def hit(endpoint, scope, identity):
+    """Record a request; raise RateLimitExceeded when it is over the endpoint's limit."""
+    if not identity:
+        return
+    try:
+        limit, window = _limit_for(endpoint, scope)
+        if limit <= 0:
+            return
+        cache = frappe.cache()
+        key = cache.make_key(WINDOW_KEY.format(endpoint, scope, identity))
+        now_ms = int(time.time() * 1000)
+        allowed, retry_ms = cache.eval(SLIDING_WINDOW_LUA, 1, key, now_ms, window * 1000, limit, f"{now_ms}:{uuid.uuid4().hex[:8]}")
+    except Exception:
+        return
+    if int(allowed):
+        return
+    metrics.incr(METRICS_NAME, f"limited:{endpoint}:{scope}")
+    raise RateLimitExceeded(endpoint, scope, max(1, -(-int(retry_ms) // 1000)))
+
+
+def check_user(user_id):
+    """Apply the per-user limit of the endpoint being served (no-op outside `rate_limited`)."""
+    endpoint = getattr(frappe.local, "line_rate_limit_endpoint", None)
+    if endpoint:
+        hit(endpoint, USER, user_id)
+
+
+def too_many_requests(exc):
+    body = json.dumps({"exc_type": "TooManyRequestsError", "message": LIMITED_MESSAGE}, ensure_ascii=False)
+    response = Response(body, status=429, mimetype="application/json")
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response
+
+
+def rate_limited(endpoint):
+    """Decorator for guest endpoints; place it under `@frappe.whitelist`.
+
+    Nested calls (liff_bootstrap -> liff_auth) are counted once, under the outer endpoint.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(frappe.local, "line_rate_limit_endpoint", None):
+                return fn(*args, **kwargs)
+            try:
+                hit(endpoint, IP, getattr(frappe.local, "request_ip", None))
+            except RateLimitExceeded as e:
+                return too_many_requests(e)
+            frappe.local.line_rate_limit_endpoint = endpoint
+            try:
+                return fn(*args, **kwargs)
+            except RateLimitExceeded as e:
+                return too_many_requests(e)
+            finally:
+                frappe.local.line_rate_limit_endpoint = None
+
+        return wrapper
+
+    return decorator
+
+
+def clear_cache(doc=None, method=None):
+    """doc_events hook: LINE Settings on_update."""
+    frappe.cache().delete_value(LIMITS_CACHE_KEY)
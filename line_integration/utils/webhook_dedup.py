@@ -0,0 +1,65 @@
+"""
+Idempotency guard for LINE webhook events.
+
+LINE redelivers events (`deliveryContext.isRedelivery`) when our endpoint is slow. Each
+`webhookEventId` is claimed with a single `SET NX EX` in Redis; events whose id was
+already claimed are dropped before any database work.
+"""
+
+import frappe
+
+from line_integration.utils import metrics
+
+METRICS_NAME = "webhook_dedup"
+EVENT_KEY = "line_webhook_event:{0}"
+DEFAULT_TTL = 86400
+
+
+def _ttl(settings):
+    ttl = int(getattr(settings, "webhook_dedup_ttl", 0) or 0) if settings else 0
+    return ttl if ttl > 0 else DEFAULT_TTL
+
+
+def is_redelivery(event):
+    return bool(((event or {}).get("deliveryContext") or {}).get("isRedelivery"))
+
+
+def filter_new_events(events, settings=None):
+    """Return only events whose webhookEventId has not been seen within the TTL.
+
+    All ids of a payload are claimed in one pipelined round trip. Events without an id
+    (older webhook versions) are passed through unchanged.
+    """
+    events = events or []
+    keyed = [(e, e.get("webhookEventId")) for e in events if isinstance(e, dict)]
+    ids = [event_id for _, event_id in keyed if event_id]
+    if not ids:
+        return [e for e, _ in keyed]
+
+    ttl = _ttl(settings)
+    try:
+        cache = frappe.cache()
+        pipe = cache.pipeline()
+        for event_id in ids:
+            pipe.set(cache.make_key(EVENT_KEY.format(event_id)), 1, nx=True, ex=ttl)
+        claimed = iter(pipe.execute())
+    except Exception:
+        # Redis unavailable: prefer processing over silently dropping events
+        frappe.log_error(frappe.get_traceback(), "LINE Webhook Dedup Error")
+        return [e for e, _ in keyed]
+
+    fresh = []
+    for event, event_id in keyed:
+        if not event_id or next(claimed):
+            fresh.append(event)
+            if is_redelivery(event):
+                metrics.incr(METRICS_NAME, "redeliveries_accepted")
+            continue
+        metrics.incr(METRICS_NAME, "dropped")
+        if is_redelivery(event):
+            metrics.incr(METRICS_NAME, "dropped_redeliveries")
+    return fresh
+
+
+def get_stats():
+    return metrics.get_all(METRICS_NAME)
@@ -0,0 +1,276 @@
+"""
+Background processing for LINE webhook events.
+
+When "Async Webhook Processing" is enabled in LINE Settings the webhook endpoint only
+verifies the signature and pushes the raw events to Redis; `handle_event` then runs
+in background workers so LINE gets its 200 within milliseconds.
+
+Events are partitioned by `source.userId` onto a fixed number of Redis lists. Each
+partition is drained by at most one job at a time (guarded by a lock), so events from
+one user are processed in order while different users run in parallel across workers.
+
+An event is moved (LMOVE) onto the partition's processing list before it is handled and
+removed only afterwards. If a worker dies mid-event, the next drain of that partition
+handles the leftover entry first, so delivery is at-least-once and still in order.
+
+The partition count in use is pinned in Redis. A changed "Webhook Partitions" setting
+only takes over once every pinned partition is empty, so lowering it cannot strand
+events in partitions nothing drains any more.
+"""
+
+import json
+import time
+import uuid
+import zlib
+
+import frappe
+
+from line_integration.utils import metrics
+
+METRICS_NAME = "webhook_queue"
+DEFAULT_QUEUE = "default"
+DEFAULT_PARTITIONS = 8
+PARTITION_KEY = "line_webhook_partition:{0}"
+PROCESSING_KEY = "line_webhook_partition_processing:{0}"
+LOCK_KEY = "line_webhook_partition_lock:{0}"
+LOCK_TTL = 300
+PARTITION_COUNT_KEY = "line_webhook_partition_count"
+PREVIOUS_COUNT_KEY = "line_webhook_partition_count_previous"
+PREVIOUS_COUNT_TTL = 86400
+
+
+def is_async_enabled(settings):
+    return bool(getattr(settings, "async_webhook_processing", 0))
+
+
+def get_configured_partitions(settings=None):
+    count = int(getattr(settings, "webhook_partitions", 0) or 0) if settings else 0
+    return count if count > 0 else DEFAULT_PARTITIONS
+
+
+def get_partition_count(settings=None):
+    """Partition count events are routed with: the pinned count until it can switch safely."""
+    configured = get_configured_partitions(settings)
+    cache = frappe.cache()
+    pinned = _read_int(cache, PARTITION_COUNT_KEY)
+    if pinned == configured:
+        return pinned
+    if pinned and not _all_idle(cache, pinned):
+        return pinned
+    if pinned:
+        # Still scanned by kick_stalled_partitions, for producers that raced the switch
+        cache.set(cache.make_key(PREVIOUS_COUNT_KEY), pinned, ex=PREVIOUS_COUNT_TTL)
+    cache.set(cache.make_key(PARTITION_COUNT_KEY), configured)
+    return configured
+
+
+def _scan_count(settings=None):
+    """Partitions that may hold events: current, configured and recently replaced counts."""
+    cache = frappe.cache()
+    return max(
+        get_partition_count(settings),
+        get_configured_partitions(settings),
+        _read_int(cache, PREVIOUS_COUNT_KEY),
+    )
+
+
+def _read_int(cache, key):
+    value = cache.get(cache.make_key(key))
+    try:
+        return int(value) if value is not None else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def _all_idle(cache, partitions):
+    pipe = cache.pipeline()
+    for partition in range(partitions):
+        pipe.llen(cache.make_key(PARTITION_KEY.format(partition)))
+        pipe.llen(cache.make_key(PROCESSING_KEY.format(partition)))
+    return not any(pipe.execute())
+
+
+def partition_key(event):
+    """Ordering key of an event: the LINE user, falling back to group/room."""
+    source = (event or {}).get("source") or {}
+    return source.get("userId") or source.get("groupId") or source.get("roomId") or ""
+
+
+def partition_for(key, partitions):
+    """Stable partition index for `key` (crc32, identical across processes)."""
+    if not key or partitions <= 1:
+        return 0
+    return zlib.crc32(key.encode("utf-8")) % partitions
+
+
+def enqueue_events(events, settings):
+    """Persist raw events to their partitions and wake the drain jobs. Returns count queued."""
+    events = [e for e in (events or []) if isinstance(e, dict)]
+    if not events:
+        return 0
+    touched = push_events(events, settings)
+    for partition in touched:
+        # A running drain job re-checks its list after releasing the lock, so skipping
+        # the enqueue while the lock is held cannot strand the event.
+        if not _lock_held(partition):
+            _enqueue_drain(partition, settings)
+    return len(events)
+
+
+def push_events(events, settings):
+    """Append events to their partition lists; returns the partitions touched."""
+    cache = frappe.cache()
+    partitions = get_partition_count(settings)
+    received_at = time.time()
+    touched = set()
+    for event in events:
+        partition = partition_for(partition_key(event), partitions)
+        cache.rpush(
+            PARTITION_KEY.format(partition),
+            json.dumps({"event": event, "received_at": received_at}),
+        )
+        touched.add(partition)
+    metrics.incr(METRICS_NAME, "enqueued", len(events))
+    return touched
+
+
+def _enqueue_drain(partition, settings=None):
+    frappe.enqueue(
+        "line_integration.utils.webhook_queue.drain_partition",
+        queue=getattr(settings, "webhook_queue", None) or DEFAULT_QUEUE,
+        partition=partition,
+    )
+
+
+def _lock_key(partition):
+    return frappe.cache().make_key(LOCK_KEY.format(partition))
+
+
+def _lock_held(partition):
+    # RedisWrapper.exists adds the key prefix itself
+    return bool(frappe.cache().exists(LOCK_KEY.format(partition)))
+
+
+def _acquire_lock(partition, token):
+    return bool(frappe.cache().set(_lock_key(partition), token, nx=True, ex=LOCK_TTL))
+
+
+def _release_lock(partition, token):
+    cache = frappe.cache()
+    key = _lock_key(partition)
+    current = cache.get(key)
+    if current is not None and (current.decode() if isinstance(current, bytes) else current) == token:
+        cache.delete(key)
+
+
+def drain_partition(partition):
+    """RQ job: process one partition's events in order until the list is empty."""
+    from line_integration.api.line_webhook import handle_event
+    from line_integration.utils.line_client import get_settings
+
+    token = uuid.uuid4().hex
+    if not _acquire_lock(partition, token):
+        return
+    try:
+        _drain(partition, token, handle_event, get_settings())
+    except BaseException:
+        _release_lock(partition, token)
+        raise
+
+
+def _drain(partition, token, handler, settings):
+    cache = frappe.cache()
+    name = PARTITION_KEY.format(partition)
+    processing = PROCESSING_KEY.format(partition)
+
+    # Entries left by a worker that died mid-event come first, to keep the user's order
+    for raw in cache.lrange(processing, 0, -1):
+        metrics.incr(METRICS_NAME, "recovered")
+        _process_entry(raw, handler, settings)
+        cache.lpop(processing)
+
+    while True:
+        # lmove is not wrapped by RedisWrapper, so it needs the prefixed keys
+        raw = cache.lmove(cache.make_key(name), cache.make_key(processing), "LEFT", "RIGHT")
+        if raw is None:
+            _release_lock(partition, token)
+            # Close the race with a producer that saw the lock just before release
+            if cache.llen(name) and _acquire_lock(partition, token):
+                continue
+            return
+        cache.expire(_lock_key(partition), LOCK_TTL)
+        _process_entry(raw, handler, settings)
+        # Acknowledge only once the event has been handled
+        cache.lpop(processing)
+
+
+def _process_entry(raw, handler, settings):
+    try:
+        entry = json.loads(raw)
+    except Exception:
+        metrics.incr(METRICS_NAME, "failed")
+        return
+    started = time.time()
+    received_at = entry.get("received_at")
+    if received_at:
+        lag_ms = int((started - float(received_at)) * 1000)
+        metrics.set_fields(METRICS_NAME, {"last_lag_ms": lag_ms, "last_processed_at": int(started)})
+        metrics.set_max(METRICS_NAME, "max_lag_ms", lag_ms)
+    try:
+        handler(entry.get("event") or {}, settings)
+        metrics.incr(METRICS_NAME, "processed")
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        metrics.incr(METRICS_NAME, "failed")
+        frappe.log_error(frappe.get_traceback(), "LINE Webhook Error")
+
+
+def kick_stalled_partitions():
+    """Scheduler job: restart draining for partitions whose worker died mid-run."""
+    from line_integration.utils.line_client import get_settings
+
+    settings = get_settings()
+    if not is_async_enabled(settings):
+        return
+    cache = frappe.cache()
+    for partition in range(_scan_count(settings)):
+        if _has_work(cache, partition) and not _lock_held(partition):
+            _enqueue_drain(partition, settings)
+
+
+def _has_work(cache, partition):
+    return bool(cache.llen(PARTITION_KEY.format(partition)) or cache.llen(PROCESSING_KEY.format(partition)))
+
+
+def get_stats(settings=None):
+    """Queue depth per partition and processing lag for the async webhook pipeline."""
+    from line_integration.utils.line_client import get_settings
+
+    settings = settings or get_settings()
+    cache = frappe.cache()
+    stats = metrics.get_all(METRICS_NAME)
+    depths = {}
+    oldest = None
+    for partition in range(_scan_count(settings)):
+        name = PARTITION_KEY.format(partition)
+        depth = (cache.llen(name) or 0) + (cache.llen(PROCESSING_KEY.format(partition)) or 0)
+        depths[partition] = depth
+        if depth:
+            head = cache.lrange(PROCESSING_KEY.format(partition), 0, 0) or cache.lrange(name, 0, 0)
+            try:
+                received_at = json.loads(head[0]).get("received_at") if head else None
+            except Exception:
+                received_at = None
+            if received_at and (oldest is None or received_at < oldest):
+                oldest = received_at
+    stats["partition_count"] = get_partition_count(settings)
+    stats["pending"] = sum(depths.values())
+    stats["partitions"] = depths
+    stats["busy_partitions"] = [p for p in depths if _lock_held(p)]
+    stats["oldest_pending_age_ms"] = int((time.time() - oldest) * 1000) if oldest else 0
+    last_processed_at = stats.get("last_processed_at")
+    stats["seconds_since_last_processed"] = (
+        int(time.time() - float(last_processed_at)) if last_processed_at else None
+    )
+    return stats